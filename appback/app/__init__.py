@@ -1,35 +1,114 @@
 # app/__init__.py
 import os
+import sys
+import threading
 from flask import Flask
 from flask_cors import CORS
-from .services import ml_service
+from .services import model_registry, job_queue, evidence_storage
+from .database import init_pool
 
 def create_app():
     app = Flask(__name__)
+    # Multipart file parts stream straight into the evidence store while being hashed
+    app.request_class = evidence_storage.StreamingRequest
 
     CORS(app)
     
     # Configuration
     app.config['MODEL_PATH'] = 'cyber_case_model_rf.joblib'
     app.config['DEBUG'] = True
+    app.config['DATABASE_URL'] = os.environ.get('DATABASE_URL')
+    app.config['DB_POOL_MIN_SIZE'] = int(os.environ.get('DB_POOL_MIN_SIZE', 1))
+    app.config['DB_POOL_MAX_SIZE'] = int(os.environ.get('DB_POOL_MAX_SIZE', 10))
+    app.config['DB_POOL_TIMEOUT'] = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+    app.config['DB_POOL_HEALTH_CHECK'] = os.environ.get('DB_POOL_HEALTH_CHECK', 'true').lower() == 'true'
+    app.config['DASHBOARD_CACHE_TTL'] = float(os.environ.get('DASHBOARD_CACHE_TTL', 15))
+    app.config['CASES_PAGE_SIZE'] = int(os.environ.get('CASES_PAGE_SIZE', 12))
+    app.config['CASES_MAX_PAGE_SIZE'] = int(os.environ.get('CASES_MAX_PAGE_SIZE', 100))
+    app.config['COUNT_CACHE_TTL'] = float(os.environ.get('COUNT_CACHE_TTL', 30))
+    app.config['RANK_CASES_MAX_BATCH'] = int(os.environ.get('RANK_CASES_MAX_BATCH', 5000))
+    # Background job workers started inside the web process (0 = only `flask run-worker` processes)
+    app.config['JOB_WORKER_THREADS'] = int(os.environ.get('JOB_WORKER_THREADS', 2))
+    app.config['JOB_POLL_INTERVAL'] = float(os.environ.get('JOB_POLL_INTERVAL', 1.0))
+
+    # Shared connection pool (must exist before the model may be trained from the DB)
+    app.extensions['db_pool'] = init_pool(
+        app.config['DATABASE_URL'],
+        min_size=app.config['DB_POOL_MIN_SIZE'],
+        max_size=app.config['DB_POOL_MAX_SIZE'],
+        checkout_timeout=app.config['DB_POOL_TIMEOUT'],
+        health_check=app.config['DB_POOL_HEALTH_CHECK'],
+    )
     
-    # Load or train ML model at startup
-    ml_pipeline = ml_service.load_model(app.config['MODEL_PATH'])
-    
-    if ml_pipeline is None:
-        ml_pipeline = ml_service.train_ml_model()
-        ml_service.save_model(ml_pipeline, app.config['MODEL_PATH'])
-    
-    # Store the loaded model in the app config for access in routes
-    app.config['ML_PIPELINE'] = ml_pipeline
+    # Versioned model registry; each process serves the active version and polls for changes.
+    # A legacy MODEL_PATH file (or, failing that, the built-in sample data) seeds an empty registry;
+    # `flask train-model` (or POST /retrain_model) publishes new versions offline.
+    # MODEL_PRELOAD loads it in create_app, e.g. with `gunicorn --preload` so forked workers
+    # inherit one copy. Otherwise the first request loads it: synchronously in a single-process
+    # server (`python run.py`), or in the background under a pre-fork server (gunicorn, uWSGI),
+    # where the load balancer waits on /health/ready. MODEL_LOAD_IN_BACKGROUND overrides this.
+    app.config['MODEL_REGISTRY_DIR'] = os.environ.get(
+        'MODEL_REGISTRY_DIR', os.path.join(app.root_path, '..', 'model_registry')
+    )
+    app.config['MODEL_RELOAD_INTERVAL'] = float(os.environ.get('MODEL_RELOAD_INTERVAL', 30))
+    app.config['MODEL_PRELOAD'] = os.environ.get('MODEL_PRELOAD', 'false').lower() == 'true'
+    prefork_server = 'gunicorn' in sys.modules or 'uwsgi' in sys.modules
+    app.config['MODEL_LOAD_IN_BACKGROUND'] = os.environ.get(
+        'MODEL_LOAD_IN_BACKGROUND', str(prefork_server)
+    ).lower() == 'true'
+    # Inference backend: 'sklearn' (default) or 'flat' (vectorized flattened forest, validated bit-for-bit)
+    app.config['ML_INFERENCE_BACKEND'] = os.environ.get('ML_INFERENCE_BACKEND', 'sklearn')
+
+    model_holder = model_registry.ModelHolder(
+        model_registry.ModelRegistry(app.config['MODEL_REGISTRY_DIR']),
+        backend=app.config['ML_INFERENCE_BACKEND'],
+        poll_interval=app.config['MODEL_RELOAD_INTERVAL'],
+        legacy_path=app.config['MODEL_PATH'],
+    )
+    if app.config['MODEL_PRELOAD']:
+        model_holder.ensure_loaded()
+    # Routes read `.current` once per request (pipeline, encoder and forest of one version)
+    app.extensions['ml_model'] = model_holder
 
     UPLOAD_FOLDER = os.path.join(app.root_path, '..', 'uploads')
     app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
     app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'pdf'}
+    # Evidence downloads: 'none', 'x-sendfile' (Apache/lighttpd) or 'x-accel-redirect' (nginx)
+    app.config['EVIDENCE_SENDFILE'] = os.environ.get('EVIDENCE_SENDFILE', 'none')
+    app.config['EVIDENCE_ACCEL_PREFIX'] = os.environ.get('EVIDENCE_ACCEL_PREFIX', '/protected-evidence/')
+    app.config['USE_X_SENDFILE'] = app.config['EVIDENCE_SENDFILE'] == 'x-sendfile'
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
     # Register Blueprints
     from .routes.main import main_bp
     app.register_blueprint(main_bp)
 
+    from .commands import register_commands
+    register_commands(app)
+
+    # Model loading/reload polling and in-process job workers start with the first request, so
+    # CLI commands never spawn them and forked server workers each get their own threads
+    start_lock = threading.Lock()
+
+    @app.before_request
+    def start_background_threads():
+        if app.extensions.get('background_started'):
+            return
+        with start_lock:
+            if app.extensions.get('background_started'):
+                return
+            if not app.config['MODEL_LOAD_IN_BACKGROUND']:
+                try:
+                    app.extensions['ml_model'].ensure_loaded()
+                except Exception as e:
+                    # the loader thread keeps retrying; /health/ready reports the failure
+                    app.logger.error(f"Model load failed: {e}")
+            app.extensions['ml_model'].start()
+            if app.config['JOB_WORKER_THREADS'] > 0:
+                app.extensions['job_workers'] = job_queue.WorkerPool(
+                    threads=app.config['JOB_WORKER_THREADS'],
+                    poll_interval=app.config['JOB_POLL_INTERVAL'],
+                ).start()
+            app.extensions['background_started'] = True
+
     return app
\ No newline at end of file
@@ -0,0 +1,277 @@
+# app/commands.py
+import click
+import time
+from app.database import get_db_conn
+from flask import current_app
+from app.services import stats_service, pagination, search_service, ml_service, feature_encoder, forest_engine, job_queue, linking_service, grouping_service, group_summary_service, suggestion_service, similarity_service, training_service, model_registry, evidence_storage, file_serving, preview_service, import_service
+
+# DDL owned by each service; `flask init-schema` applies them all (idempotent).
+SCHEMA_STATEMENTS = [
+    stats_service.SCHEMA_SQL,
+    pagination.SCHEMA_SQL,
+    search_service.SCHEMA_SQL,
+    job_queue.SCHEMA_SQL,
+    linking_service.SCHEMA_SQL,
+    grouping_service.SCHEMA_SQL,
+    group_summary_service.SCHEMA_SQL,
+    suggestion_service.SCHEMA_SQL,
+    evidence_storage.SCHEMA_SQL,
+]
+
+def register_commands(app):
+    @app.cli.command('init-schema')
+    def init_schema():
+        """Creates the PostgreSQL tables and indexes used by the services."""
+        with get_db_conn() as conn:
+            cursor = conn.cursor()
+            for statement in SCHEMA_STATEMENTS:
+                cursor.execute(statement)
+            conn.commit()
+            cursor.close()
+        click.echo("PostgreSQL schema is up to date.")
+
+    @app.cli.command('rebuild-stats')
+    def rebuild_stats():
+        """Reconciles the case_daily_stats rollup counters with the cases table."""
+        with get_db_conn() as conn:
+            row_count, elapsed = stats_service.rebuild_stats(conn)
+        click.echo(f"Rebuilt {row_count} rollup rows in {elapsed:.2f}s.")
+
+    @app.cli.command('backfill-evidence-keys')
+    @click.option('--batch-size', default=5000, help='Rows updated per transaction.')
+    def backfill_evidence_keys(batch_size):
+        """Computes structured_evidence.normalized_value for rows that don't have it yet."""
+        with get_db_conn() as conn:
+            updated = linking_service.backfill_normalized_values(conn, batch_size=batch_size)
+        click.echo(f"Normalized {updated} evidence rows.")
+
+    @app.cli.command('regroup-cases')
+    def regroup_cases():
+        """Recomputes all case groups from the evidence graph, merging overlapping groups."""
+        with get_db_conn() as conn:
+            result = grouping_service.regroup_all(conn)
+        click.echo(
+            f"Scanned {result['evidence_rows']} evidence rows: moved {result['cases_moved']} cases, "
+            f"created {result['groups_created']} groups, merged {result['groups_merged']} groups "
+            f"in {result['elapsed']:.2f}s."
+        )
+
+    @app.cli.command('reconcile-group-summaries')
+    def reconcile_group_summaries():
+        """Rebuilds every group's totals and evidence counts from the base tables."""
+        with get_db_conn() as conn:
+            updated, elapsed = group_summary_service.reconcile_all(conn)
+        click.echo(f"Reconciled {updated} group summaries in {elapsed:.2f}s.")
+
+    @app.cli.command('import-cases')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'fmt', type=click.Choice(['auto', 'csv', 'jsonl']), default='auto', help='Input format (auto: by extension).')
+    @click.option('--batch-size', default=10000, help='Rows validated, scored and COPYed per transaction.')
+    @click.option('--errors', 'errors_path', default=None, help='Rejected rows as JSONL (default: <path>.errors.jsonl).')
+    def import_cases(path, fmt, batch_size, errors_path):
+        """Bulk-imports historical cases from CSV or JSONL through COPY staging tables."""
+        if fmt == 'auto':
+            fmt = 'csv' if path.lower().endswith('.csv') else 'jsonl'
+        errors_path = errors_path or f"{path}.errors.jsonl"
+        model = current_app.extensions['ml_model'].ensure_loaded()
+
+        def report(stats):
+            click.echo(f"read {stats['read']:>9}  imported {stats['imported']:>9}  rejected {stats['rejected']:>7}  "
+                       f"{stats['rows_per_sec']:>8} rows/s  {stats['elapsed']:>8}s")
+
+        with open(path, newline='', encoding='utf-8-sig') as stream, \
+                open(errors_path, 'w', encoding='utf-8') as errors, get_db_conn() as conn:
+            stats = import_service.run_import(
+                conn, stream, fmt, model.pipeline, forest=model.forest,
+                batch_size=batch_size, errors=errors, progress=report,
+            )
+        click.echo(f"Imported {stats['imported']} of {stats['read']} rows in {stats['elapsed']}s "
+                   f"({stats['rows_per_sec']} rows/s); {stats['rejected']} rejected -> {errors_path}")
+
+    @app.cli.command('migrate-evidence-files')
+    @click.option('--batch-size', default=500, help='Files moved per transaction.')
+    def migrate_evidence_files(batch_size):
+        """Moves legacy UUID-named uploads into the content-addressed store, deduplicating them."""
+        with get_db_conn() as conn:
+            migrated, freed = evidence_storage.migrate_legacy_files(conn, current_app.config['UPLOAD_FOLDER'], batch_size=batch_size)
+        click.echo(f"Migrated {migrated} files; deduplication freed {freed / 1e6:.1f} MB.")
+
+    @app.cli.command('generate-previews')
+    def generate_previews():
+        """Queues thumbnail/preview generation for stored evidence that doesn't have them yet."""
+        with get_db_conn() as conn:
+            queued = preview_service.enqueue_all(conn, current_app.config['UPLOAD_FOLDER'])
+        click.echo(f"Queued preview generation for {queued} files.")
+
+    @app.cli.command('purge-upload-sessions')
+    @click.option('--older-than-hours', default=24, help='Idle time after which a resumable upload is abandoned.')
+    def purge_upload_sessions(older_than_hours):
+        """Deletes abandoned resumable uploads and their partial files."""
+        with get_db_conn() as conn:
+            purged = evidence_storage.purge_stale_sessions(conn, current_app.config['UPLOAD_FOLDER'], older_than_hours=older_than_hours)
+        click.echo(f"Purged {purged} upload sessions.")
+
+    @app.cli.command('sweep-evidence-blobs')
+    def sweep_evidence_blobs():
+        """Removes stored evidence blobs that no evidence file references any more."""
+        removed = evidence_storage.sweep_unreferenced_blobs(current_app.config['UPLOAD_FOLDER'])
+        click.echo(f"Removed {removed} unreferenced blobs.")
+
+    @app.cli.command('rebuild-suggestion-index')
+    def rebuild_suggestion_index():
+        """Recomputes the MinHash-LSH buckets used for group suggestions for every case."""
+        with get_db_conn() as conn:
+            indexed = suggestion_service.rebuild_index(conn)
+        click.echo(f"Indexed {indexed} cases.")
+
+    @app.cli.command('bench-suggestions')
+    @click.option('--cases', default=100000, help='Synthetic cases in the index.')
+    @click.option('--queries', default=20, help='New cases scored.')
+    def bench_suggestions(cases, queries):
+        """Compares LSH-narrowed group suggestion latency with scoring every case (in memory)."""
+        result = suggestion_service.run_benchmark(n_cases=cases, queries=queries)
+        for key, value in result.items():
+            click.echo(f"{key:>20}: {value}")
+
+    @app.cli.command('bench-similarity')
+    @click.option('--candidates', default=50000, help='Candidate texts scored per query.')
+    @click.option('--queries', default=5, help='Queries timed.')
+    def bench_similarity(candidates, queries):
+        """Compares pairwise Python similarity with batched TF-IDF scoring (serial and process pool)."""
+        import random
+        rng = random.Random(7)
+        cases = [suggestion_service._bench_case(rng, i) for i in range(candidates + queries)]
+        texts = [suggestion_service.case_text(c['case_name'], c['description']) for c in cases]
+        results = similarity_service.run_benchmark(texts[:candidates], texts[candidates:])
+        for key, value in results.items():
+            click.echo(f"{key:>20}: {value}")
+
+    @app.cli.command('stress-group-numbers')
+    @click.option('--threads', default=8, help='Concurrent connections reserving numbers.')
+    @click.option('--reservations', default=200, help='Committed reservations per thread.')
+    @click.option('--batch-size', default=1, help='Numbers per reservation.')
+    def stress_group_numbers(threads, reservations, batch_size):
+        """Hammers the group number allocator concurrently and reports duplicates (should be 0)."""
+        issued, duplicates, elapsed = grouping_service.run_allocation_stress(
+            threads=threads, reservations=reservations, batch_size=batch_size
+        )
+        click.echo(f"Issued {issued} numbers in {elapsed:.2f}s ({issued / elapsed:.0f}/s), duplicates: {duplicates}.")
+        if duplicates:
+            raise SystemExit(1)
+
+    @app.cli.command('extract-training-data')
+    @click.option('--out', default=None, help='Snapshot directory (default: inside the model registry).')
+    @click.option('--chunk-size', default=50000, help='Rows fetched and written per chunk.')
+    def extract_training_data(out, chunk_size):
+        """Writes the verified-case training features to a columnar .npy snapshot."""
+        snapshot_dir = out or training_service.snapshot_dir_for(current_app.config['MODEL_REGISTRY_DIR'])
+        with get_db_conn() as conn:
+            manifest = training_service.extract_snapshot(conn, snapshot_dir, chunk_size=chunk_size)
+        click.echo(f"Wrote {manifest['rows']} rows in {manifest['parts']} chunks to {snapshot_dir} ({manifest['extract_s']}s).")
+
+    @app.cli.command('train-model')
+    @click.option('--snapshot', default=None, help='Train from an existing snapshot instead of extracting one.')
+    def train_model(snapshot):
+        """Extracts a snapshot, trains in a separate process and publishes a new model version."""
+        report = training_service.run_training(current_app.config['MODEL_REGISTRY_DIR'], snapshot_dir=snapshot)
+        for key, value in report.items():
+            click.echo(f"{key:>12}: {value}")
+
+    @app.cli.command('list-models')
+    def list_models():
+        """Lists model versions in the registry with their training metadata."""
+        registry = current_app.extensions['ml_model'].registry
+        active = registry.active_version()
+        for metadata in registry.list_versions():
+            if not metadata:
+                continue
+            marker = '*' if metadata['version'] == active else ' '
+            metrics = metadata.get('metrics') or {}
+            click.echo(f"{marker} {metadata['version']}  source={metadata.get('source')} "
+                       f"rows={metadata.get('training_rows', '-')} mae={metrics.get('mae', '-')} r2={metrics.get('r2', '-')}")
+
+    @app.cli.command('activate-model')
+    @click.argument('version')
+    def activate_model(version):
+        """Makes VERSION the active model; running servers pick it up on their next poll."""
+        previous = current_app.extensions['ml_model'].registry.activate(version)
+        click.echo(f"Activated {version} (was {previous}).")
+
+    @app.cli.command('rollback-model')
+    def rollback_model():
+        """Re-activates the model version that was active before the current one."""
+        version = current_app.extensions['ml_model'].registry.rollback()
+        click.echo(f"Rolled back to {version}.")
+
+    @app.cli.command('bench-startup')
+    @click.option('--repeats', default=3, help='Cold starts timed per measurement.')
+    def bench_startup(repeats):
+        """Times app import, create_app() and model loading (copied vs. memory-mapped)."""
+        results = model_registry.run_startup_benchmark(current_app.extensions['ml_model'].registry, repeats=repeats)
+        for key, value in results.items():
+            click.echo(f"{key:>22}: {value}")
+
+    @app.cli.command('bench-file-serving')
+    @click.argument('url')
+    @click.option('--concurrency', default=8, help='Parallel download threads.')
+    @click.option('--requests', 'requests_per_mode', default=200, help='Requests per mode.')
+    def bench_file_serving(url, concurrency, requests_per_mode):
+        """Measures download throughput for URL (full, Range and If-None-Match) against a running server."""
+        result = file_serving.run_benchmark(url, concurrency=concurrency, requests_per_mode=requests_per_mode)
+        click.echo(f"{result['file_bytes']} bytes, ETag {result['etag']}, {result['concurrency']} threads")
+        click.echo(f"{'mode':>12} {'statuses':>12} {'req/s':>8} {'MB/s':>8} {'p50 (ms)':>10} {'p95 (ms)':>10}")
+        for row in result['modes']:
+            statuses = ','.join(str(code) for code in row['statuses'])
+            click.echo(f"{row['mode']:>12} {statuses:>12} {row['requests_s']:>8} {row['mb_s']:>8} {row['p50_ms']:>10} {row['p95_ms']:>10}")
+
+    @app.cli.command('bench-search')
+    @click.option('--sizes', default='10000,100000,1000000', help='Comma-separated table sizes.')
+    @click.option('--samples', default=20, help='Search terms sampled per size.')
+    def bench_search(sizes, samples):
+        """Reports case search latency vs. table size, with and without trigram indexes."""
+        size_list = [int(size) for size in sizes.split(',')]
+        with get_db_conn() as conn:
+            results = search_service.run_benchmark(conn, sizes=size_list, samples=samples)
+        click.echo(f"{'rows':>10} {'seq scan (ms)':>15} {'trigram (ms)':>15}")
+        for row in results:
+            click.echo(f"{row['rows']:>10} {row['seq_scan_ms']:>15} {row['trigram_index_ms']:>15}")
+
+    @app.cli.command('bench-inference')
+    @click.option('--rows', default=10000, help='Rows in the large batch.')
+    @click.option('--repeats', default=20, help='Timed runs per measurement.')
+    def bench_inference(rows, repeats):
+        """Compares pipeline.predict with the flat forest backend for 1 row and a large batch."""
+        pipeline = current_app.extensions['ml_model'].ensure_loaded().pipeline
+        probes = list(feature_encoder.probe_cases())
+        forest = forest_engine.build_forest(pipeline, ml_service.build_feature_frame(probes))
+        if forest is None:
+            click.echo("Flat forest failed validation against sklearn; nothing to benchmark.")
+            return
+        frame_1 = ml_service.build_feature_frame(probes[:1])
+        frame_batch = ml_service.build_feature_frame([probes[i % len(probes)] for i in range(rows)])
+        results = forest_engine.run_benchmark(pipeline, forest, frame_1, frame_batch, repeats=repeats)
+        click.echo(f"{'batch':>12} {'pipeline (ms)':>15} {'flat (ms)':>12}")
+        for row in results:
+            click.echo(f"{row['batch']:>12} {row['pipeline_predict_ms']:>15} {row['flat_forest_ms']:>12}")
+
+    @app.cli.command('run-worker')
+    @click.option('--threads', default=4, help='Worker threads in this process.')
+    @click.option('--batch-size', default=10, help='Jobs claimed per poll.')
+    def run_worker(threads, batch_size):
+        """Runs background job workers (case linking, group summaries) until interrupted."""
+        pool = job_queue.WorkerPool(threads=threads, batch_size=batch_size,
+                                    poll_interval=current_app.config['JOB_POLL_INTERVAL']).start()
+        click.echo(f"Job worker running with {threads} threads. Press Ctrl+C to stop.")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            click.echo("Stopping workers...")
+            pool.stop(timeout=30)
+
+    @app.cli.command('retry-failed-jobs')
+    def retry_failed_jobs():
+        """Moves failed jobs back to the queue with a fresh attempt budget."""
+        with get_db_conn() as conn:
+            count = job_queue.retry_failed_jobs(conn)
+        click.echo(f"Requeued {count} failed jobs.")
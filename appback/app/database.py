@@ -1,4 +1,226 @@
 import sqlite3
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+
+
+# --- PostgreSQL Connection Pool ---
+class PoolTimeout(Exception):
+    """Raised when no pooled connection became free within the checkout timeout."""
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of PostgreSQL connections shared by every route and service.
+    Connections are opened lazily (so forked workers never inherit sockets), checked
+    with a cheap ping on checkout, and always rolled back before returning to the pool.
+    """
+
+    def __init__(self, dsn, min_size=1, max_size=10, checkout_timeout=10.0, health_check=True):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Pool size must satisfy 0 <= min_size <= max_size and max_size >= 1.")
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.health_check = health_check
+
+        self._cond = threading.Condition()
+        self._idle = []
+        self._size = 0       # connections currently open (idle + in use)
+        self._in_use = 0
+        self._waiters = 0
+        self._warmed = False
+
+        # Metrics
+        self._checkouts = 0
+        self._timeouts = 0
+        self._reconnects = 0
+        self._checkout_time_total = 0.0
+        self._checkout_time_max = 0.0
+
+    def _connect(self):
+        if not self.dsn:
+            raise Exception("DATABASE_URL environment variable is not set.")
+        return psycopg2.connect(self.dsn)
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        if not self.health_check:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _warm(self):
+        """Opens ``min_size`` connections the first time this process borrows one."""
+        with self._cond:
+            if self._warmed:
+                return
+            self._warmed = True
+            missing = self.min_size - self._size
+            self._size += max(missing, 0)
+        opened = []
+        try:
+            for _ in range(max(missing, 0)):
+                opened.append(self._connect())
+        finally:
+            with self._cond:
+                self._size -= max(missing, 0) - len(opened)
+                self._idle.extend(opened)
+                self._cond.notify_all()
+
+    def getconn(self):
+        """Borrows a connection, waiting up to ``checkout_timeout`` seconds for one to free up."""
+        if not self._warmed:
+            self._warm()
+
+        started = time.monotonic()
+        deadline = started + self.checkout_timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    conn = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(
+                        f"No database connection available after {self.checkout_timeout}s "
+                        f"({self._in_use} in use, max {self.max_size})."
+                    )
+                self._waiters += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiters -= 1
+            self._in_use += 1
+
+        try:
+            if conn is not None and not self._is_healthy(conn):
+                self._close_quietly(conn)
+                self._reconnects += 1
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        elapsed = time.monotonic() - started
+        with self._cond:
+            self._checkouts += 1
+            self._checkout_time_total += elapsed
+            self._checkout_time_max = max(self._checkout_time_max, elapsed)
+        return conn
+
+    def putconn(self, conn, close=False):
+        """Returns a connection to the pool, discarding it if it is broken."""
+        if not conn.closed and not close:
+            try:
+                # Never hand an open transaction to the next borrower.
+                conn.rollback()
+            except psycopg2.Error:
+                close = True
+
+        with self._cond:
+            self._in_use -= 1
+            if close or conn.closed:
+                self._size -= 1
+                discard = True
+            else:
+                self._idle.append(conn)
+                discard = False
+            self._cond.notify()
+        if discard:
+            self._close_quietly(conn)
+
+    @contextmanager
+    def connection(self):
+        """Context-managed borrow/return; the connection is released even on early returns."""
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def closeall(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._warmed = False
+        for conn in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "waiters": self._waiters,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "reconnects": self._reconnects,
+                "avg_checkout_ms": round(self._checkout_time_total / self._checkouts * 1000, 3) if self._checkouts else 0.0,
+                "max_checkout_ms": round(self._checkout_time_max * 1000, 3),
+            }
+
+
+_pool = None
+
+def init_pool(dsn=None, min_size=1, max_size=10, checkout_timeout=10.0, health_check=True):
+    """Creates (or replaces) the process-wide connection pool. Called from create_app()."""
+    global _pool
+    if _pool is not None:
+        _pool.closeall()
+    _pool = ConnectionPool(
+        dsn or os.environ.get('DATABASE_URL'),
+        min_size=min_size,
+        max_size=max_size,
+        checkout_timeout=checkout_timeout,
+        health_check=health_check,
+    )
+    return _pool
+
+def get_pool():
+    # Scripts that import services without create_app() fall back to env defaults.
+    if _pool is None:
+        init_pool()
+    return _pool
+
+def get_db_conn():
+    """
+    Borrows a pooled connection to the PostgreSQL database.
+    Use as ``with get_db_conn() as conn:`` so the connection is always returned.
+    """
+    return get_pool().connection()
+
+
+# --- Legacy SQLite Schema ---
 
 def init_db():
     conn = sqlite3.connect('cyber_cases.db')
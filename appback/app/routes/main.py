@@ -1,182 +1,42 @@
 # app/routes/main.py
-from flask import Blueprint, request, jsonify, current_app, send_from_directory
-from collections import defaultdict
+from flask import Blueprint, Response, request, jsonify, current_app
 from werkzeug.utils import secure_filename
-import psycopg2
 from psycopg2.extras import RealDictCursor
-import pandas as pd
 import uuid
 import datetime
 import math
 import os
-from app.services import ml_service,linking_service
+import time
+from app.services import ml_service, linking_service, intake_service, job_queue
+from app.services import dashboard_service, stats_service, group_summary_service
+from app.services import pagination, case_repository, search_service
+from app.services import evidence_storage, file_serving, preview_service, export_service
+from app.database import get_db_conn, get_pool
 
 
 main_bp = Blueprint('main', __name__)
 
 # --- Helper Functions ---
-def get_db_conn():
-    """Establishes a connection to the PostgreSQL database."""
-    db_url = os.environ.get('DATABASE_URL')
-    if not db_url:
-        raise Exception("DATABASE_URL environment variable is not set.")
-    conn = psycopg2.connect(db_url)
-    return conn
-
-def update_case_links(case_id):
-    
-    conn = get_db_conn()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-
-    # ดึงรายละเอียดของคดีนี้
-    cursor.execute("SELECT * FROM cases WHERE id = %s", (case_id,))
-    new_case = cursor.fetchone()
-    if not new_case:
-        return
-
-    # ดึงกลุ่มคดีที่มีอยู่
-    cursor.execute("SELECT id, group_number FROM case_groups")
-    existing_groups = cursor.fetchall()
-
-    best_group = None
-    best_score = 0.0
-
-    for group in existing_groups:
-        # ตัวอย่าง: หาเคสในกลุ่มนี้ เพื่อเปรียบเทียบ
-        cursor.execute("SELECT * FROM cases WHERE group_number = %s", (group['group_number'],))
-        group_cases = cursor.fetchall()
-
-        if not group_cases:
-            continue
-
-        # คำนวณ similarity โดยใช้ชื่อคดีเป็นเกณฑ์ง่าย ๆ (สามารถเปลี่ยนเป็น NLP ได้)
-        sim_scores = [
-            jellyfish.jaro_winkler_similarity(new_case['case_name'], c['case_name'])
-            for c in group_cases
-        ]
-        avg_sim = sum(sim_scores) / len(sim_scores)
-
-        if avg_sim > best_score and avg_sim >= 0.85:
-            best_score = avg_sim
-            best_group = group
-
-    if best_group:
-        # เสนอให้เข้า group นี้
-        suggestion_id = str(uuid.uuid4())
-        cursor.execute("""
-            INSERT INTO case_group_suggestions (id, case_id, suggested_group_id, ml_score, status)
-            VALUES (%s, %s, %s, %s, %s)
-        """, (suggestion_id, case_id, best_group['id'], best_score, 'pending'))
-
-    conn.commit()
-    conn.close()
-
 def get_best_suggested_group(case_id):
-    conn = get_db_conn()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    cursor.execute("""
-        SELECT cg.id, cg.group_number, s.ml_score
-        FROM case_group_suggestions s
-        JOIN case_groups cg ON s.suggested_group_id = cg.id
-        WHERE s.case_id = %s AND s.status = 'pending'
-        ORDER BY s.ml_score DESC
-        LIMIT 1
-    """, (case_id,))
-    row = cursor.fetchone()
-    conn.close()
+    with get_db_conn() as conn:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute("""
+            SELECT cg.id, cg.group_number, s.ml_score
+            FROM case_group_suggestions s
+            JOIN case_groups cg ON s.suggested_group_id = cg.id
+            WHERE s.case_id = %s AND s.status = 'pending'
+            ORDER BY s.ml_score DESC
+            LIMIT 1
+        """, (case_id,))
+        row = cursor.fetchone()
     return row if row else None
 
 # --- Dashboard Stats API ---
 @main_bp.route('/dashboard', methods=['GET'])
 def get_dashboard_stats():
     try:
-        conn = get_db_conn()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-
-        # 1. จำนวนคดีทั้งหมด
-        cursor.execute("SELECT COUNT(id) AS count FROM cases")
-        total_cases = cursor.fetchone()['count']
-
-        # 2. คดีตามสถานะ
-        cursor.execute("SELECT COUNT(id) AS count FROM cases WHERE status = 'รับเรื่อง'")
-        pending_cases = cursor.fetchone()['count']
-        cursor.execute("SELECT COUNT(id) AS count FROM cases WHERE status = 'กำลังสืบสวน'")
-        in_progress_cases = cursor.fetchone()['count']
-        cursor.execute("SELECT COUNT(id) AS count FROM cases WHERE status = 'ปิดคดี'")
-        completed_cases = cursor.fetchone()['count']
-
-        # 3. คดีใหม่วันนี้
-        cursor.execute("SELECT COUNT(id) AS count FROM cases WHERE timestamp::date = CURRENT_DATE")
-        cases_today = cursor.fetchone()['count']
-
-        # 4. คดีใน 7 วันล่าสุด
-        cursor.execute("""
-            SELECT timestamp::date as day, COUNT(id) as count
-            FROM cases
-            WHERE timestamp >= CURRENT_DATE - INTERVAL '6 days'
-            GROUP BY day ORDER BY day
-        """)
-        cases_last_7_days = cursor.fetchall()
-
-        # 5. จำนวนคดีแต่ละประเภท
-        cursor.execute("""
-            SELECT case_type, COUNT(id) AS count
-            FROM cases
-            WHERE case_type IS NOT NULL
-            GROUP BY case_type
-        """)
-        cases_by_type = {row['case_type']: row['count'] for row in cursor.fetchall()}
-
-        # 6. จำนวนคดีแต่ละประเภทในแต่ละเดือน
-        cursor.execute("""
-            SELECT TO_CHAR(timestamp, 'YYYY-MM') as month, case_type, COUNT(id) as count
-            FROM cases
-            WHERE case_type IS NOT NULL
-            GROUP BY month, case_type
-            ORDER BY month
-        """)
-        monthly_breakdown_rows = cursor.fetchall()
-        monthly_breakdown = defaultdict(dict)
-        for row in monthly_breakdown_rows:
-            monthly_breakdown[row['month']][row['case_type']] = row['count']
-
-        # 7. Top 5 คดีสำคัญ
-        cursor.execute("""
-            SELECT id, case_number, case_name, description, timestamp,
-                   num_victims, estimated_financial_damage, priority_score
-            FROM cases
-            ORDER BY priority_score DESC
-            LIMIT 5
-        """)
-        top_5_cases = cursor.fetchall()
-
-        # 8. Top 5 บัญชีธนาคารที่พบบ่อยที่สุด (ถ้ามีตาราง bank_accounts)
-        cursor.execute("""
-            SELECT account_number, COUNT(*) as case_count
-            FROM bank_accounts
-            GROUP BY account_number
-            ORDER BY case_count DESC
-            LIMIT 5
-        """)
-        top_5_accounts = cursor.fetchall()
-
-        cursor.close()
-        conn.close()
-
-        response_data = {
-            "summary_stats": {
-                "total_cases": total_cases,
-                "pending_cases": pending_cases,
-                "in_progress_cases": in_progress_cases,
-                "completed_cases": completed_cases,
-                "cases_today": cases_today
-            },
-            "cases_last_7_days": cases_last_7_days,
-            "cases_by_type": cases_by_type,
-            "monthly_case_breakdown": monthly_breakdown,
-            "top_5_priority_cases": top_5_cases,
-            "top_5_accounts": top_5_accounts
-        }
+        ttl = current_app.config.get('DASHBOARD_CACHE_TTL', dashboard_service.DEFAULT_CACHE_TTL)
+        response_data = dashboard_service.get_dashboard_stats(ttl=ttl)
         return jsonify(response_data), 200
 
     except Exception as e:
@@ -186,25 +46,39 @@ def get_dashboard_stats():
 @main_bp.route('/cases', methods=['GET'])
 def get_all_cases():
     page = request.args.get('page', default=1, type=int)
-    limit = 12
+    limit = pagination.get_page_size(
+        request.args,
+        default=current_app.config.get('CASES_PAGE_SIZE', pagination.DEFAULT_PAGE_SIZE),
+        maximum=current_app.config.get('CASES_MAX_PAGE_SIZE', pagination.MAX_PAGE_SIZE)
+    )
     offset = (page - 1) * limit
 
-    base_query = "FROM cases c LEFT JOIN complainants comp ON c.complainant_id = comp.id"
-    select_clause = """
-        SELECT c.*, 
-               CONCAT(comp.first_name, ' ', comp.last_name) as complainant_name,
-               (SELECT STRING_AGG(CONCAT(o.first_name, ' ', o.last_name), ', ') 
-                FROM officers o JOIN case_officers co ON o.id = co.officer_id 
-                WHERE co.case_id = c.id) as officer_names
-    """
+    # ?cursor= switches to keyset pagination on (priority_score DESC, id DESC)
+    cursor_mode = 'cursor' in request.args
+    count_mode = request.args.get('count', 'approx' if cursor_mode else 'exact')
+    if count_mode not in ('exact', 'approx', 'none'):
+        return jsonify({"error": "count must be one of exact, approx, none."}), 400
+    try:
+        after = pagination.decode_cursor(request.args.get('cursor'), 'priority') if cursor_mode else []
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    base_query = case_repository.LISTING_FROM
+    select_clause = case_repository.LISTING_SELECT
     
     where_clause = " WHERE 1=1"
     params = []
     
     search_term = request.args.get('q')
     if search_term:
-        where_clause += " AND (REPLACE(c.case_number, '-', '') ILIKE %s OR c.case_name ILIKE %s)"
-        params.extend([f"%{search_term.replace('-', '')}%", f"%{search_term}%"])
+        search_sql, search_params = search_service.build_search_clause(search_term, alias='c.')
+        where_clause += search_sql
+        params.extend(search_params)
+
+    # ?sort=relevance orders search results by trigram similarity instead of priority
+    sort_by_relevance = request.args.get('sort') == 'relevance' and bool(search_term)
+    if sort_by_relevance and cursor_mode:
+        return jsonify({"error": "sort=relevance is not supported with cursor pagination."}), 400
     filter_map = {
         # Text fields from 'cases' table
         'case_number': {'column': 'c.case_number', 'operator': 'LIKE', 'formatter': lambda v: f"%{v}%"},
@@ -234,25 +108,53 @@ def get_all_cases():
             params.append(formatted_value)
 
     try:
-        conn = get_db_conn()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        with get_db_conn() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
         
-        # Use a simplified query for counting to improve performance
-        count_query = f"SELECT COUNT(c.id) {base_query}{where_clause}"
-        cursor.execute(count_query, tuple(params))
-        total_records = cursor.fetchone()['count']
-        total_pages = math.ceil(total_records / limit) if total_records > 0 else 1
-
-        data_query = f"{select_clause}{base_query}{where_clause} ORDER BY c.priority_score DESC LIMIT %s OFFSET %s"
-        data_params = tuple(params + [limit, offset])
-        cursor.execute(data_query, data_params)
-        cases_from_db = cursor.fetchall()
-
-        conn.close()
+            total_records, total_is_estimate = pagination.count_rows(
+                cursor, f"{base_query}{where_clause}", params, mode=count_mode, table='cases',
+                ttl=current_app.config.get('COUNT_CACHE_TTL', pagination.COUNT_CACHE_TTL)
+            )
+
+            if cursor_mode:
+                keyset_clause = where_clause
+                keyset_params = list(params)
+                if after:
+                    keyset_clause += " AND (c.priority_score, c.id) < (%s, %s)"
+                    keyset_params.extend(after)
+                data_query = f"{select_clause}{base_query}{keyset_clause} ORDER BY c.priority_score DESC, c.id DESC LIMIT %s"
+                cursor.execute(data_query, tuple(keyset_params + [limit + 1]))
+            elif sort_by_relevance:
+                rank_sql, rank_params = search_service.build_rank_expression(search_term, alias='c.')
+                data_query = (f"{select_clause}, {rank_sql} AS search_rank {base_query}{where_clause} "
+                              f"ORDER BY search_rank DESC, c.priority_score DESC, c.id DESC LIMIT %s OFFSET %s")
+                data_params = tuple(rank_params + params + [limit, offset])
+                cursor.execute(data_query, data_params)
+            else:
+                data_query = f"{select_clause}{base_query}{where_clause} ORDER BY c.priority_score DESC, c.id DESC LIMIT %s OFFSET %s"
+                data_params = tuple(params + [limit, offset])
+                cursor.execute(data_query, data_params)
+            cases_from_db = cursor.fetchall()
+
+            if cursor_mode:
+                has_more = len(cases_from_db) > limit
+                cases_from_db = cases_from_db[:limit]
+            cases_from_db = case_repository.attach_officer_names(cursor, cases_from_db)
         
+        if cursor_mode:
+            last = cases_from_db[-1] if cases_from_db else None
+            next_cursor = pagination.encode_cursor('priority', [last['priority_score'], last['id']]) if has_more else None
+            page_info = {"limit": limit, "next_cursor": next_cursor,
+                         "total_records": total_records, "total_is_estimate": total_is_estimate}
+        else:
+            total_pages = (math.ceil(total_records / limit) if total_records > 0 else 1) if total_records is not None else None
+            page_info = {"page": page, "limit": limit, "total_records": total_records, "total_pages": total_pages}
+            if total_is_estimate:
+                page_info["total_is_estimate"] = True
+
         response_data = {
-            "pagination": {"page": page, "limit": limit, "total_records": total_records, "total_pages": total_pages},
-            "data": [dict(row) for row in cases_from_db]
+            "pagination": page_info,
+            "data": cases_from_db
         }
         return jsonify(response_data), 200
         
@@ -262,8 +164,8 @@ def get_all_cases():
 
 @main_bp.route('/rank_case', methods=['POST'])
 def rank_case():
-    ml_model_pipeline = current_app.config['ML_PIPELINE']
-    if not ml_model_pipeline:
+    model = current_app.extensions['ml_model'].current
+    if model is None:
         return jsonify({"error": "Model is not loaded."}), 503
 
     data = request.get_json()
@@ -277,190 +179,132 @@ def rank_case():
     structured_evidence_data = data.get('structured_evidence', [])
 
     try:
-        # เตรียมข้อมูลสำหรับโมเดล
-        case_details_filled = case_details.copy()
-
-        # Calculate derived features that the model expects
-        case_details_filled['evidence_count'] = len(structured_evidence_data)
-        case_details_filled['has_actionable_evidence'] = any(
-            ev.get('evidence_type', '').upper() in ['BANK_ACCOUNT', 'PHONE_NUMBER'] 
-            for ev in structured_evidence_data
+        # เตรียมข้อมูลสำหรับโมเดล (fast path: dict -> NumPy vector, no DataFrame)
+        case_details_filled = ml_service.derive_case_features(case_details, structured_evidence_data)
+        priority_score = ml_service.score_case(
+            model.pipeline, case_details_filled,
+            encoder=model.encoder,
+            forest=model.forest
         )
-        case_details_filled['days_since_creation'] = 0  # New case
-        case_details_filled['num_linked_cases'] = 0     # New case, no links yet
-        case_details_filled['is_grouped'] = False           # New case, not grouped yet
-
-        # Create DataFrame with all features expected by the model
-        input_df = pd.DataFrame([case_details_filled])
-        all_features = (
-            ml_service.CATEGORICAL_FEATURES +
-            ml_service.ORDINAL_FEATURES +
-            ml_service.NUMERICAL_FEATURES +
-            ml_service.BINARY_FEATURES
-        )
-        for feature in all_features:
-            if feature not in input_df.columns:
-                # ถ้าไม่มีคอลัมน์นั้น ให้สร้างขึ้นมาแล้วเติมค่า default ที่เหมาะสม
-                if feature in ml_service.BINARY_FEATURES:
-                    input_df[feature] = 0 # False
-                elif feature in ml_service.NUMERICAL_FEATURES:
-                    input_df[feature] = 0
-                else:
-                    input_df[feature] = 'None' # หรือ 'Unknown'
-        REPUTATIONAL_DAMAGE_MAP = {
-            "1": "Low", "2": "Medium", "3": "High", "4": "Critical", "None": "None", None: "None",
-            1: "Low", 2: "Medium", 3: "High", 4: "Critical"
-        }
-        TECHNICAL_COMPLEXITY_MAP = {
-            "1": "Low", "2": "Medium", "3": "High", "4": "Very High", "5": "Extreme", "None": "Low", None: "Low",
-            1: "Low", 2: "Medium", 3: "High", 4: "Very High", 5: "Extreme"
-        }
-        EVIDENCE_CLARITY_MAP = {
-            "1": "Low", "2": "Medium", "3": "High", "4": "Very High", "None": "None", None: "None",
-            1: "Low", 2: "Medium", 3: "High", 4: "Very High"
-        }
-
-       # Apply mappings
-        input_df['reputational_damage_level'] = input_df['reputational_damage_level'].map(REPUTATIONAL_DAMAGE_MAP).fillna("Low")
-        input_df['technical_complexity_level'] = input_df['technical_complexity_level'].map(TECHNICAL_COMPLEXITY_MAP).fillna("Low")
-        input_df['initial_evidence_clarity'] = input_df['initial_evidence_clarity'].map(EVIDENCE_CLARITY_MAP).fillna("Medium")
-
-        # Fill missing columns
-        all_model_features = ml_service.CATEGORICAL_FEATURES + ml_service.ORDINAL_FEATURES + ml_service.NUMERICAL_FEATURES + ml_service.BINARY_FEATURES
-        for feature in all_model_features:
-            if feature not in input_df.columns:
-                if feature in ml_service.BINARY_FEATURES:
-                    input_df[feature] = 0
-                elif feature in ml_service.NUMERICAL_FEATURES:
-                    input_df[feature] = 0
-                else:
-                    input_df[feature] = 'None'
-
-        # Clean and convert dtypes
-        for col in ml_service.CATEGORICAL_FEATURES + ml_service.ORDINAL_FEATURES:
-            input_df[col] = input_df[col].astype(str)
-        for col in ml_service.BINARY_FEATURES:
-            input_df[col] = input_df[col].apply(lambda x: 1 if x == True else 0)
-
-        input_df = input_df[all_model_features]
-        # เช็คว่า dtype ถูกต้องก่อนเข้า predict
-        print(input_df.dtypes)
-        print(input_df.head())
         
-        priority_score = ml_model_pipeline.predict(input_df)[0]
-        priority_score = max(0, min(100, priority_score))
+        with get_db_conn() as conn:
+            cursor = conn.cursor()
+
+            case_id = str(uuid.uuid4())
+            case_number = case_details.get('case_number')
+            current_time = datetime.datetime.now()
+            sensitive_data_compromised = bool(case_details_filled.get('sensitive_data_compromised', 0))
+            ongoing_threat = bool(case_details_filled.get('ongoing_threat', 0))
+            risk_of_evidence_loss = bool(case_details_filled.get('risk_of_evidence_loss', 0))
         
-        conn = get_db_conn()
-        cursor = conn.cursor()
-
-        case_id = str(uuid.uuid4())
-        case_number = case_details.get('case_number')
-        current_time = datetime.datetime.now()
-        sensitive_data_compromised = bool(case_details_filled.get('sensitive_data_compromised', 0))
-        ongoing_threat = bool(case_details_filled.get('ongoing_threat', 0))
-        risk_of_evidence_loss = bool(case_details_filled.get('risk_of_evidence_loss', 0))
-        
-        complainant_id = str(uuid.uuid4())
+            complainant_id = str(uuid.uuid4())
 
-        cursor.execute("""
-            INSERT INTO complainants (
-                id, first_name, last_name, phone_number, email, address, province, district, subdistrict, zipcode
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """, (
-            complainant_id,
-            complainant_data.get('first_name'),
-            complainant_data.get('last_name'),
-            complainant_data.get('phone_number'),
-            complainant_data.get('email'),
-            complainant_data.get('address'),
-            complainant_data.get('province'),
-            complainant_data.get('district'),
-            complainant_data.get('subdistrict'),
-            complainant_data.get('zipcode')
-        ))
-        # Insert case
-        cursor.execute("""
-            INSERT INTO cases (
-                id, case_number, case_name, timestamp, last_updated, date_closed, status, priority_score, 
-                case_type, description, estimated_financial_damage, num_victims, 
-                reputational_damage_level, sensitive_data_compromised, ongoing_threat, 
-                risk_of_evidence_loss, technical_complexity_level, initial_evidence_clarity, 
-                complainant_id, group_id, suspests
-            ) 
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """, (
-            case_id, 
-            case_number, 
-            case_details.get('case_name'), 
-            current_time,               # timestamp as datetime
-            current_time,               # last_updated as datetime
-            None,                      # date_closed (ยังไม่ปิดคดี)
-            'รับเรื่อง',               # status (string)
-            float(priority_score),      # priority_score (float)
-            case_details.get('case_type'), 
-            case_details.get('description'), 
-            int(case_details.get('estimated_financial_damage', 0)), 
-            int(case_details.get('num_victims', 0)), 
-            case_details.get('reputational_damage_level'), 
-            sensitive_data_compromised,  # boolean
-            ongoing_threat,              # boolean
-            risk_of_evidence_loss,       # boolean
-            case_details.get('technical_complexity_level'), 
-            case_details.get('initial_evidence_clarity'), 
-            complainant_id, 
-            None,      # group_id (ถ้าไม่มี ให้ใส่ None)
-            None       # suspests (ถ้าไม่มี ให้ใส่ None)
-        ))
-
-        # Insert officers (ถ้ามี)
-        for officer in officers_data:
-            officer_id = officer.get('id', str(uuid.uuid4()))
             cursor.execute("""
-                INSERT INTO officers (id, first_name, last_name, phone_number, email) VALUES (%s, %s, %s, %s, %s) 
-                ON CONFLICT (id) DO NOTHING
+                INSERT INTO complainants (
+                    id, first_name, last_name, phone_number, email, address, province, district, subdistrict, zipcode
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
             """, (
-                officer_id, officer['first_name'], officer['last_name'], officer['phone_number'], officer.get('email')
+                complainant_id,
+                complainant_data.get('first_name'),
+                complainant_data.get('last_name'),
+                complainant_data.get('phone_number'),
+                complainant_data.get('email'),
+                complainant_data.get('address'),
+                complainant_data.get('province'),
+                complainant_data.get('district'),
+                complainant_data.get('subdistrict'),
+                complainant_data.get('zipcode')
             ))
-            cursor.execute("INSERT INTO case_officers (case_id, officer_id) VALUES (%s, %s)", (case_id, officer_id))
-
-        # Insert suspects (ถ้ามี)
-        for suspect in suspects_data:
-            suspect_id = str(uuid.uuid4())
+            # Insert case
             cursor.execute("""
-                INSERT INTO suspests (
-                    id, first_name, last_name, national_id, account, phone_number, email, address, province, district, subdistrict, zipcode, created_at, updated_at, case_number
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                INSERT INTO cases (
+                    id, case_number, case_name, timestamp, last_updated, date_closed, status, priority_score, 
+                    case_type, description, estimated_financial_damage, num_victims, 
+                    reputational_damage_level, sensitive_data_compromised, ongoing_threat, 
+                    risk_of_evidence_loss, technical_complexity_level, initial_evidence_clarity, 
+                    complainant_id, group_id, suspests
+                ) 
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
             """, (
-                suspect_id,
-                suspect.get('first_name'),
-                suspect.get('last_name'),
-                suspect.get('national_id'),
-                suspect.get('account'),
-                suspect.get('phone_number'),
-                suspect.get('email'),
-                suspect.get('address'),
-                suspect.get('province'),
-                suspect.get('district'),
-                suspect.get('subdistrict'),
-                suspect.get('zipcode'),
-                datetime.datetime.now(),
-                datetime.datetime.now(),
-                case_number
+                case_id, 
+                case_number, 
+                case_details.get('case_name'), 
+                current_time,               # timestamp as datetime
+                current_time,               # last_updated as datetime
+                None,                      # date_closed (ยังไม่ปิดคดี)
+                'รับเรื่อง',               # status (string)
+                float(priority_score),      # priority_score (float)
+                case_details.get('case_type'), 
+                case_details.get('description'), 
+                int(case_details.get('estimated_financial_damage', 0)), 
+                int(case_details.get('num_victims', 0)), 
+                case_details.get('reputational_damage_level'), 
+                sensitive_data_compromised,  # boolean
+                ongoing_threat,              # boolean
+                risk_of_evidence_loss,       # boolean
+                case_details.get('technical_complexity_level'), 
+                case_details.get('initial_evidence_clarity'), 
+                complainant_id, 
+                None,      # group_id (ถ้าไม่มี ให้ใส่ None)
+                None       # suspests (ถ้าไม่มี ให้ใส่ None)
             ))
 
-        # Insert structured evidence (ถ้ามี)
-        for ev in structured_evidence_data:
-            evidence_id = str(uuid.uuid4())
-            cursor.execute("""
-                INSERT INTO structured_evidence (id, case_number, evidence_type, evidence_value, created_timestamp) 
-                VALUES (%s, %s, %s, %s, %s)
-            """, (
-                evidence_id, case_number, ev.get('evidence_type'), ev.get('evidence_value'), current_time
-            ))
+            stats_service.record_case_added(cursor, current_time, case_details.get('case_type'), 'รับเรื่อง')
+
+            # Insert officers (ถ้ามี)
+            for officer in officers_data:
+                officer_id = officer.get('id', str(uuid.uuid4()))
+                cursor.execute("""
+                    INSERT INTO officers (id, first_name, last_name, phone_number, email) VALUES (%s, %s, %s, %s, %s) 
+                    ON CONFLICT (id) DO NOTHING
+                """, (
+                    officer_id, officer['first_name'], officer['last_name'], officer['phone_number'], officer.get('email')
+                ))
+                cursor.execute("INSERT INTO case_officers (case_id, officer_id) VALUES (%s, %s)", (case_id, officer_id))
+
+            # Insert suspects (ถ้ามี)
+            for suspect in suspects_data:
+                suspect_id = str(uuid.uuid4())
+                cursor.execute("""
+                    INSERT INTO suspests (
+                        id, first_name, last_name, national_id, account, phone_number, email, address, province, district, subdistrict, zipcode, created_at, updated_at, case_number
+                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """, (
+                    suspect_id,
+                    suspect.get('first_name'),
+                    suspect.get('last_name'),
+                    suspect.get('national_id'),
+                    suspect.get('account'),
+                    suspect.get('phone_number'),
+                    suspect.get('email'),
+                    suspect.get('address'),
+                    suspect.get('province'),
+                    suspect.get('district'),
+                    suspect.get('subdistrict'),
+                    suspect.get('zipcode'),
+                    datetime.datetime.now(),
+                    datetime.datetime.now(),
+                    case_number
+                ))
+
+            # Insert structured evidence (ถ้ามี)
+            for ev in structured_evidence_data:
+                evidence_id = str(uuid.uuid4())
+                cursor.execute("""
+                    INSERT INTO structured_evidence (id, case_id, case_number, evidence_type, evidence_value, normalized_value, created_timestamp) 
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                """, (
+                    evidence_id, case_id, case_number, ev.get('evidence_type'), ev.get('evidence_value'),
+                    linking_service.normalize_text(ev.get('evidence_value')), current_time
+                ))
+
+            # เชื่อมโยงคดีทำใน background worker (job commit พร้อมกับคดี)
+            if structured_evidence_data:
+                job_queue.enqueue(cursor, job_queue.LINK_CASE, case_id)
+            job_queue.enqueue(cursor, job_queue.SUGGEST_GROUPS, case_id)
  
-        conn.commit()
-        linking_service.update_case_links(case_id)
-        conn.close()
+            conn.commit()
+        dashboard_service.invalidate_dashboard_cache()
         
         return jsonify({"message": "Case created successfully", "case_number": case_number, "priority_score": float(priority_score)}), 201
 
@@ -470,42 +314,128 @@ def rank_case():
         current_app.logger.error(f"Traceback: {traceback.format_exc()}")
         return jsonify({"error": "Failed to create case due to a server error."}), 500
     
+@main_bp.route('/rank_cases', methods=['POST'])
+def rank_cases():
+    """Bulk intake: validates, scores (one predict call) and inserts (one transaction) many cases."""
+    model = current_app.extensions['ml_model'].current
+    if model is None:
+        return jsonify({"error": "Model is not loaded."}), 503
+
+    data = request.get_json()
+    if not data or not isinstance(data.get('cases'), list):
+        return jsonify({"error": "Invalid data format. Expected {\"cases\": [...]}."}), 400
+
+    items = data['cases']
+    max_batch = current_app.config.get('RANK_CASES_MAX_BATCH', 5000)
+    if len(items) > max_batch:
+        return jsonify({"error": f"Too many cases in one request (max {max_batch})."}), 413
+
+    current_time = datetime.datetime.now()
+    results = [None] * len(items)
+    prepared, prepared_indexes = [], []
+    for index, item in enumerate(items):
+        try:
+            prepared.append(intake_service.prepare_case(item, current_time))
+            prepared_indexes.append(index)
+        except ValueError as e:
+            results[index] = {"index": index, "status": "error", "error": str(e)}
+
+    try:
+        intake_service.score_prepared_cases(model.pipeline, prepared, forest=model.forest)
+
+        with get_db_conn() as conn:
+            cursor = conn.cursor()
+            intake_service.insert_prepared_cases(cursor, prepared)
+            job_queue.enqueue_many(cursor, job_queue.LINK_CASE, [p['case_id'] for p in prepared if p['evidence_rows']])
+            job_queue.enqueue_many(cursor, job_queue.SUGGEST_GROUPS, [p['case_id'] for p in prepared])
+            conn.commit()
+        if prepared:
+            dashboard_service.invalidate_dashboard_cache()
+
+    except Exception as e:
+        current_app.logger.error(f"Failed to create cases in bulk: {e}")
+        import traceback
+        current_app.logger.error(f"Traceback: {traceback.format_exc()}")
+        return jsonify({"error": "Failed to create cases due to a server error. No cases were saved."}), 500
+
+    for index, p in zip(prepared_indexes, prepared):
+        results[index] = {
+            "index": index,
+            "status": "created",
+            "case_number": p['case_number'],
+            "priority_score": p['priority_score']
+        }
+
+    created = len(prepared)
+    return jsonify({
+        "created": created,
+        "failed": len(items) - created,
+        "results": results
+    }), 201 if created else 400
+
 @main_bp.route('/group_cases/<string:group_number>', methods=['GET'])
 def get_all_group_cases(group_number):
     page = request.args.get('page', default=1, type=int)
-    limit = 12
+    limit = pagination.get_page_size(
+        request.args,
+        default=current_app.config.get('CASES_PAGE_SIZE', pagination.DEFAULT_PAGE_SIZE),
+        maximum=current_app.config.get('CASES_MAX_PAGE_SIZE', pagination.MAX_PAGE_SIZE)
+    )
     offset = (page - 1) * limit
     search_term = request.args.get('q', '').strip()
 
+    # ?cursor= switches to keyset pagination on (timestamp DESC, id DESC)
+    cursor_mode = 'cursor' in request.args
     try:
-        conn = get_db_conn()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-
-        base_query = """
-            SELECT * FROM cases 
-            WHERE group_id = %s
-        """
-        params = [group_number]
-
-        if search_term:
-            # ใช้ ILIKE และ wildcard % สำหรับค้นหาแบบใกล้เคียง case_name และ case_number
-            base_query += " AND (case_name ILIKE %s OR REPLACE(case_number, '-', '') ILIKE %s)"
-            like_pattern = f"%{search_term}%"
-            params.extend([like_pattern, like_pattern])
-
-        base_query += " ORDER BY timestamp DESC LIMIT %s OFFSET %s"
-        params.extend([limit, offset])
+        after = pagination.decode_cursor(request.args.get('cursor'), 'timestamp') if cursor_mode else []
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-        cursor.execute(base_query, tuple(params))
-        case_data = cursor.fetchall()
-
-        cursor.close()
-        conn.close()
+    try:
+        with get_db_conn() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+
+            base_query = """
+                SELECT * FROM cases 
+                WHERE group_id = %s
+            """
+            params = [group_number]
+
+            if search_term:
+                # ค้นหาแบบใกล้เคียง case_name และ case_number ผ่าน trigram index
+                search_sql, search_params = search_service.build_search_clause(search_term)
+                base_query += search_sql
+                params.extend(search_params)
+
+            if cursor_mode:
+                if after:
+                    base_query += " AND (timestamp, id) < (%s, %s)"
+                    params.extend(after)
+                base_query += " ORDER BY timestamp DESC, id DESC LIMIT %s"
+                params.append(limit + 1)
+            else:
+                base_query += " ORDER BY timestamp DESC, id DESC LIMIT %s OFFSET %s"
+                params.extend([limit, offset])
+
+            cursor.execute(base_query, tuple(params))
+            case_data = cursor.fetchall()
+
+            cursor.close()
+
+        if cursor_mode:
+            has_more = len(case_data) > limit
+            case_data = case_data[:limit]
+            last = case_data[-1] if case_data else None
+            return jsonify({
+                "limit": limit,
+                "next_cursor": pagination.encode_cursor('timestamp', [last['timestamp'], last['id']]) if has_more else None,
+                "data": [case_repository.public_case(row) for row in case_data]
+            }), 200
 
         return jsonify({
             "page": page,
             "limit": limit,
-            "data": [dict(row) for row in case_data]
+            "data": [case_repository.public_case(row) for row in case_data]
         }), 200
 
     except Exception as e:
@@ -515,31 +445,14 @@ def get_all_group_cases(group_number):
 @main_bp.route('/cases/<string:case_number>', methods=['GET'])
 def get_case_by_number(case_number):
     try:
-        conn = get_db_conn()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        with get_db_conn() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
 
-        cursor.execute("SELECT * FROM cases WHERE case_number = %s", (case_number,))
-        case_data = cursor.fetchone()
+            case_dict = case_repository.get_case_detail(cursor, case_number)
         
-        if not case_data:
-            conn.close()
-            return jsonify({"error": "Case not found"}), 404
-        
-        case_dict = dict(case_data)
-        
-        cursor.execute("SELECT * FROM complainants WHERE id = %s", (case_dict['complainant_id'],))
-        complainant_data = cursor.fetchone()
-        case_dict['complainant'] = dict(complainant_data) if complainant_data else None
-        
-        cursor.execute("""
-            SELECT o.* FROM officers o
-            JOIN case_officers co ON o.id = co.officer_id
-            WHERE co.case_id = %s
-        """, (case_dict['id'],))
-        officers_data = cursor.fetchall()
-        case_dict['officers'] = [dict(row) for row in officers_data]
-
-        conn.close()
+            if not case_dict:
+                return jsonify({"error": "Case not found"}), 404
+
         return jsonify(case_dict), 200
 
     except Exception as e:
@@ -549,29 +462,28 @@ def get_case_by_number(case_number):
 @main_bp.route('/suggestion_group_case/<string:group_number>', methods=['GET'])
 def get_suggested_cases_by_group(group_number):
     try:
-        conn = get_db_conn()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        with get_db_conn() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
 
-        cursor.execute("SELECT id FROM case_groups WHERE group_number = %s", (group_number,))
-        group = cursor.fetchone()
+            cursor.execute("SELECT id FROM case_groups WHERE group_number = %s", (group_number,))
+            group = cursor.fetchone()
 
-        if not group:
-            return jsonify({"error": "Group not found"}), 404
+            if not group:
+                return jsonify({"error": "Group not found"}), 404
 
-        group_id = group['id']
+            group_id = group['id']
 
-        # ดึงคดีที่ ML แนะนำให้เข้า group นี้
-        cursor.execute("""
-            SELECT s.id AS suggestion_id, c.case_number, c.case_name, c.priority_score, s.ml_score, s.status
-            FROM case_group_suggestions s
-            JOIN cases c ON s.case_id = c.id
-            WHERE s.suggested_group_id = %s AND s.status = 'pending'
-            ORDER BY s.ml_score DESC
-        """, (group_id,))
+            # ดึงคดีที่ ML แนะนำให้เข้า group นี้
+            cursor.execute("""
+                SELECT s.id AS suggestion_id, c.case_number, c.case_name, c.priority_score, s.ml_score, s.status
+                FROM case_group_suggestions s
+                JOIN cases c ON s.case_id = c.id
+                WHERE s.suggested_group_id = %s AND s.status = 'pending'
+                ORDER BY s.ml_score DESC
+            """, (group_id,))
 
-        suggestions = cursor.fetchall()
+            suggestions = cursor.fetchall()
 
-        conn.close()
         return jsonify(suggestions), 200
 
     except Exception as e:
@@ -587,25 +499,24 @@ def respond_group_suggestion(suggestion_id):
         return jsonify({"error": "Invalid action"}), 400
 
     try:
-        conn = get_db_conn()
-        cursor = conn.cursor()
+        with get_db_conn() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
 
-        # ดึง suggestion เดิม
-        cursor.execute("SELECT case_id, suggested_group_id FROM case_group_suggestions WHERE id = %s", (suggestion_id,))
-        suggestion = cursor.fetchone()
+            # ดึง suggestion เดิม
+            cursor.execute("SELECT case_id, suggested_group_id FROM case_group_suggestions WHERE id = %s", (suggestion_id,))
+            suggestion = cursor.fetchone()
 
-        if not suggestion:
-            return jsonify({"error": "Suggestion not found"}), 404
+            if not suggestion:
+                return jsonify({"error": "Suggestion not found"}), 404
 
-        if action == 'accept':
-            # อัปเดต case ให้เข้า group
-            cursor.execute("UPDATE cases SET group_id = %s WHERE id = %s", (suggestion['suggested_group_id'], suggestion['case_id']))
+            if action == 'accept':
+                # อัปเดต case ให้เข้า group (พร้อมปรับสรุปของกลุ่มเดิม/กลุ่มใหม่)
+                group_summary_service.move_cases(cursor, [suggestion['case_id']], suggestion['suggested_group_id'])
         
-        # อัปเดตสถานะของ suggestion
-        cursor.execute("UPDATE case_group_suggestions SET status = %s WHERE id = %s", (action, suggestion_id))
+            # อัปเดตสถานะของ suggestion
+            cursor.execute("UPDATE case_group_suggestions SET status = %s WHERE id = %s", (action, suggestion_id))
 
-        conn.commit()
-        conn.close()
+            conn.commit()
 
         return jsonify({"message": f"Suggestion {action}ed successfully"}), 200
 
@@ -615,60 +526,91 @@ def respond_group_suggestion(suggestion_id):
 
 @main_bp.route('/cases/<string:case_number>', methods=['PUT'])
 def update_case(case_number):
-    ml_model_pipeline = current_app.config['ML_PIPELINE']
+    model = current_app.extensions['ml_model'].current
+    if model is None:
+        return jsonify({"error": "Model is not loaded."}), 503
     data = request.get_json()
     case_details = data.get('case_details', {})
     officers_data = data.get('officers', [])
     
     try:
-        # เตรียมข้อมูลสำหรับโมเดล
-        input_df = pd.DataFrame([case_details])[ml_service.TEXT_FEATURES + ml_service.BINARY_FEATURES + ml_service.NUMERICAL_FEATURES + ml_service.TARGET_COLUMN]
-        priority_score = ml_model_pipeline.predict(input_df)[0]
-        priority_score = max(0, min(100, priority_score))
-
-        conn = get_db_conn()
-        cursor = conn.cursor()
-
-        current_time = datetime.datetime.now().isoformat()
-        date_closed = None
-
-        cursor.execute("SELECT date_closed FROM cases WHERE case_number = %s", (case_number,))
-        old_case = cursor.fetchone()
-        if case_details.get('status') == 'ปิดคดี':
-            if not (old_case and old_case[0]):
-                date_closed = current_time
-
-        update_fields = {
-            'last_updated': current_time,
-            'priority_score': float(priority_score),
-            'case_number': case_details.get('case_number'),
-            'case_name': case_details.get('case_name'),
-            'status': case_details.get('status'),
-            'description': case_details.get('description'),
-            'case_type': case_details.get('case_type')
-        }
-        if date_closed:
-            update_fields['date_closed'] = date_closed
+        with get_db_conn() as conn:
+            cursor = conn.cursor()
+
+            current_time = datetime.datetime.now().isoformat()
+            date_closed = None
+
+            cursor.execute(
+                "SELECT timestamp, case_type, status, date_closed, group_id, num_victims, estimated_financial_damage, id "
+                "FROM cases WHERE case_number = %s FOR UPDATE",
+                (case_number,)
+            )
+            old_case = cursor.fetchone()
+
+            # คำนวณคะแนนใหม่แบบเดียวกับ rank_case (ใช้หลักฐานที่บันทึกไว้ ถ้าไม่ได้ส่งมา)
+            structured_evidence_data = data.get('structured_evidence')
+            if structured_evidence_data is None:
+                structured_evidence_data = []
+                if old_case:
+                    cursor.execute("SELECT evidence_type FROM structured_evidence WHERE case_id = %s", (old_case[7],))
+                    structured_evidence_data = [{'evidence_type': row[0]} for row in cursor.fetchall()]
+            case_details_filled = ml_service.derive_case_features(case_details, structured_evidence_data)
+            priority_score = ml_service.score_case(
+                model.pipeline, case_details_filled,
+                encoder=model.encoder,
+                forest=model.forest
+            )
+
+            if case_details.get('status') == 'ปิดคดี':
+                if not (old_case and old_case[3]):
+                    date_closed = current_time
+
+            update_fields = {
+                'last_updated': current_time,
+                'priority_score': float(priority_score),
+                'case_number': case_details.get('case_number'),
+                'case_name': case_details.get('case_name'),
+                'status': case_details.get('status'),
+                'description': case_details.get('description'),
+                'case_type': case_details.get('case_type')
+            }
+            if date_closed:
+                update_fields['date_closed'] = date_closed
         
-        update_fields = {k: v for k, v in update_fields.items() if v is not None}
-
-        if update_fields:
-            set_clause = ", ".join([f"{key} = %s" for key in update_fields.keys()])
-            params = list(update_fields.values()) + [case_number]
-            cursor.execute(f"UPDATE cases SET {set_clause} WHERE case_number = %s", tuple(params))
-
-        # Update assigned officers: delete old ones, add new ones
-        cursor.execute("DELETE FROM case_officers WHERE case_id = (SELECT id FROM cases WHERE case_number = %s)", (case_number,))
-        for officer in officers_data:
-            officer_id = officer.get('id')
-            if officer_id:
-                cursor.execute(
-                    "INSERT INTO case_officers (case_id, officer_id) VALUES ((SELECT id FROM cases WHERE case_number = %s), %s)", 
-                    (case_number, officer_id)
+            update_fields = {k: v for k, v in update_fields.items() if v is not None}
+
+            if update_fields:
+                set_clause = ", ".join([f"{key} = %s" for key in update_fields.keys()])
+                params = list(update_fields.values()) + [case_number]
+                cursor.execute(f"UPDATE cases SET {set_clause} WHERE case_number = %s", tuple(params))
+
+            if old_case:
+                old_timestamp, old_type, old_status, _, group_id, num_victims, damage, _ = old_case
+                new_status = update_fields.get('status', old_status)
+                stats_service.record_case_changed(
+                    cursor,
+                    (old_timestamp, old_type, old_status),
+                    (old_timestamp, update_fields.get('case_type', old_type), new_status)
+                )
+                group_summary_service.record_case_changed(
+                    cursor,
+                    group_id,
+                    (old_timestamp, old_status, num_victims, damage),
+                    (old_timestamp, new_status, num_victims, damage)
                 )
 
-        conn.commit()
-        conn.close()
+            # Update assigned officers: delete old ones, add new ones
+            cursor.execute("DELETE FROM case_officers WHERE case_id = (SELECT id FROM cases WHERE case_number = %s)", (case_number,))
+            for officer in officers_data:
+                officer_id = officer.get('id')
+                if officer_id:
+                    cursor.execute(
+                        "INSERT INTO case_officers (case_id, officer_id) VALUES ((SELECT id FROM cases WHERE case_number = %s), %s)", 
+                        (case_number, officer_id)
+                    )
+
+            conn.commit()
+        dashboard_service.invalidate_dashboard_cache()
         return jsonify({"message": f"Case {case_number} updated successfully."}), 200
 
     except Exception as e:
@@ -678,24 +620,36 @@ def update_case(case_number):
 @main_bp.route('/cases/<string:case_id>', methods=['DELETE'])
 def delete_case(case_id):
     try:
-        conn = get_db_conn()
-        cursor = conn.cursor()
-
-        cursor.execute("SELECT complainant_id FROM cases WHERE id = %s", (case_id,))
-        result = cursor.fetchone()
-        if not result:
-            conn.close()
-            return jsonify({"error": "Case not found"}), 404
+        with get_db_conn() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+
+            # ถอดคดีออกจากสรุปของกลุ่มก่อนลบ (ยังต้องอ่านแถวคดีและหลักฐานได้)
+            cursor.execute("SELECT group_id FROM cases WHERE id = %s FOR UPDATE", (case_id,))
+            grouped = cursor.fetchone()
+            if grouped and grouped['group_id']:
+                group_summary_service.remove_cases(cursor, grouped['group_id'], [case_id])
+            # ปล่อยไฟล์หลักฐาน (ลบไฟล์จริงหลัง commit เท่านั้น)
+            storage_cursor = conn.cursor()
+            orphaned_files = evidence_storage.delete_case_files(storage_cursor, current_app.config['UPLOAD_FOLDER'], case_id)
+            storage_cursor.close()
+
+            cursor.execute(
+                "DELETE FROM cases WHERE id = %s RETURNING complainant_id, timestamp, case_type, status",
+                (case_id,)
+            )
+            result = cursor.fetchone()
+            if not result:
+                return jsonify({"error": "Case not found"}), 404
         
-        complainant_id_to_delete = result['complainant_id']
-
-        cursor.execute("DELETE FROM cases WHERE id = %s", (case_id,))
+            complainant_id_to_delete = result['complainant_id']
+            stats_service.record_case_removed(cursor, result['timestamp'], result['case_type'], result['status'])
         
-        if complainant_id_to_delete:
-            cursor.execute("DELETE FROM complainants WHERE id = %s", (complainant_id_to_delete,))
+            if complainant_id_to_delete:
+                cursor.execute("DELETE FROM complainants WHERE id = %s", (complainant_id_to_delete,))
 
-        conn.commit()
-        conn.close()
+            conn.commit()
+        evidence_storage.collect_blobs(current_app.config['UPLOAD_FOLDER'], orphaned_files)
+        dashboard_service.invalidate_dashboard_cache()
         
         return jsonify({"message": f"Case {case_id} and associated data deleted successfully."}), 200
     except Exception as e:
@@ -708,6 +662,25 @@ def allowed_file(filename):
            filename.rsplit('.', 1)[1].lower() in current_app.config['ALLOWED_EXTENSIONS']
 
 # --- API for File Upload ---
+def _store_upload(case_id, original_filename, stream):
+    """Streams one file into the content-addressed store and records it for the case."""
+    root = current_app.config['UPLOAD_FOLDER']
+    started = time.perf_counter()
+    incoming = evidence_storage.ingest(root, stream)
+    try:
+        with get_db_conn() as conn:
+            cursor = conn.cursor()
+            stored = evidence_storage.store_evidence_file(cursor, root, case_id, original_filename, incoming)
+            conn.commit()
+            cursor.close()
+    except Exception:
+        evidence_storage.metrics.record_failure()
+        raise
+    finally:
+        incoming.close()
+    evidence_storage.metrics.record(stored['size_bytes'], time.perf_counter() - started, deduplicated=stored['deduplicated'])
+    return stored
+
 @main_bp.route('/cases/<string:case_id>/upload', methods=['POST'])
 def upload_file(case_id):
     if 'file' not in request.files:
@@ -718,83 +691,319 @@ def upload_file(case_id):
         return jsonify({"error": "No selected file"}), 400
 
     if file and allowed_file(file.filename):
-        original_filename = secure_filename(file.filename)
-        extension = original_filename.rsplit('.', 1)[1].lower()
-        stored_filename = f"{uuid.uuid4()}.{extension}"
-        
-        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], stored_filename)
-        file.save(file_path)
+        try:
+            stored = _store_upload(case_id, secure_filename(file.filename), file.stream)
+        except Exception as e:
+            current_app.logger.error(f"Failed to store upload for case {case_id}: {e}")
+            return jsonify({"error": "Failed to store file."}), 500
+        return jsonify({"message": "File uploaded successfully", **stored}), 201
+    else:
+        return jsonify({"error": "File type not allowed"}), 400
+
+@main_bp.route('/cases/<string:case_id>/upload', methods=['PUT'])
+def upload_file_raw(case_id):
+    """Streams the raw request body (no multipart parsing) as ?filename=<name>."""
+    filename = request.args.get('filename', '')
+    if not filename or not allowed_file(filename):
+        return jsonify({"error": "File type not allowed"}), 400
+    try:
+        stored = _store_upload(case_id, secure_filename(filename), request.stream)
+    except Exception as e:
+        current_app.logger.error(f"Failed to store upload for case {case_id}: {e}")
+        return jsonify({"error": "Failed to store file."}), 500
+    return jsonify({"message": "File uploaded successfully", **stored}), 201
+
+# --- Resumable uploads (large PDFs): create, PUT chunks with Content-Range, complete ---
+@main_bp.route('/cases/<string:case_id>/upload_sessions', methods=['POST'])
+def create_upload_session(case_id):
+    data = request.get_json() or {}
+    filename = data.get('filename', '')
+    total_bytes = data.get('size')
+    if not filename or not allowed_file(filename):
+        return jsonify({"error": "File type not allowed"}), 400
+    if not isinstance(total_bytes, int) or total_bytes <= 0:
+        return jsonify({"error": "size must be a positive integer."}), 400
+    try:
+        with get_db_conn() as conn:
+            cursor = conn.cursor()
+            session_id = evidence_storage.create_session(
+                cursor, current_app.config['UPLOAD_FOLDER'], case_id, secure_filename(filename), total_bytes
+            )
+            conn.commit()
+            cursor.close()
+        return jsonify({"upload_id": session_id, "received_bytes": 0, "chunk_size": evidence_storage.CHUNK_SIZE * 8}), 201
+    except Exception as e:
+        current_app.logger.error(f"Failed to create upload session for case {case_id}: {e}")
+        return jsonify({"error": "Failed to create upload session."}), 500
 
-        # Save file info to database
-        conn = get_db_conn()
+@main_bp.route('/upload_sessions/<string:upload_id>', methods=['GET'])
+def get_upload_session(upload_id):
+    """Where to resume: the client sends the next chunk from `received_bytes`."""
+    with get_db_conn() as conn:
         cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO evidence_files (id, case_id, original_filename, stored_filename, file_path, upload_timestamp)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (
-            str(uuid.uuid4()), case_id, original_filename, stored_filename, 
-            'uploads/', datetime.datetime.now().isoformat()
-        ))
-        conn.commit()
-        conn.close()
+        session = evidence_storage.get_session(cursor, upload_id)
+        cursor.close()
+    if not session:
+        return jsonify({"error": "Upload session not found"}), 404
+    return jsonify(session), 200
 
-        return jsonify({"message": "File uploaded successfully", "filename": stored_filename}), 201
-    else:
-        return jsonify({"error": "File type not allowed"}), 400
+@main_bp.route('/upload_sessions/<string:upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    content_range = request.headers.get('Content-Range', '')
+    try:
+        # "bytes <start>-<end>/<total>"
+        offset = int(content_range.split(' ', 1)[1].split('-', 1)[0])
+    except (IndexError, ValueError):
+        return jsonify({"error": "Content-Range header required (bytes <start>-<end>/<total>)."}), 400
+
+    started = time.perf_counter()
+    root = current_app.config['UPLOAD_FOLDER']
+    chunk_file = None
+    try:
+        with get_db_conn() as conn:
+            cursor = conn.cursor()
+            session = evidence_storage.get_session(cursor, upload_id)
+            cursor.close()
+        if not session:
+            return jsonify({"error": "Upload session not found"}), 404
+        # รับข้อมูลจาก client ให้เสร็จก่อน แล้วค่อยยืม connection (client ช้าไม่ควรถือ pool ไว้)
+        try:
+            chunk_file = evidence_storage.receive_chunk(root, session, offset, request.stream)
+        except ValueError as e:
+            return jsonify({"error": str(e), "received_bytes": session['received_bytes']}), 409
+        with get_db_conn() as conn:
+            cursor = conn.cursor()
+            try:
+                received = evidence_storage.append_chunk(cursor, root, upload_id, offset, chunk_file)
+            except ValueError as e:
+                conn.rollback()
+                current = evidence_storage.get_session(cursor, upload_id)
+                return jsonify({"error": str(e), "received_bytes": current['received_bytes'] if current else None}), 409
+            conn.commit()
+            cursor.close()
+    except Exception as e:
+        evidence_storage.metrics.record_failure()
+        current_app.logger.error(f"Failed to store chunk for upload {upload_id}: {e}")
+        return jsonify({"error": "Failed to store chunk."}), 500
+    finally:
+        if chunk_file is not None:
+            chunk_file.close()
+    evidence_storage.metrics.record(received - offset, time.perf_counter() - started, completed=False)
+    return jsonify({"upload_id": upload_id, "received_bytes": received, "total_bytes": session['total_bytes']}), 200
+
+@main_bp.route('/upload_sessions/<string:upload_id>/complete', methods=['POST'])
+def complete_upload_session(upload_id):
+    started = time.perf_counter()
+    try:
+        with get_db_conn() as conn:
+            cursor = conn.cursor()
+            session = evidence_storage.get_session(cursor, upload_id, for_update=True)
+            if not session:
+                return jsonify({"error": "Upload session not found"}), 404
+            try:
+                stored = evidence_storage.complete_session(cursor, current_app.config['UPLOAD_FOLDER'], session)
+            except ValueError as e:
+                conn.rollback()
+                return jsonify({"error": str(e), "received_bytes": session['received_bytes']}), 409
+            conn.commit()
+            cursor.close()
+    except Exception as e:
+        evidence_storage.metrics.record_failure()
+        current_app.logger.error(f"Failed to complete upload {upload_id}: {e}")
+        return jsonify({"error": "Failed to complete upload."}), 500
+    evidence_storage.metrics.record(0, time.perf_counter() - started, deduplicated=stored['deduplicated'])
+    return jsonify({"message": "File uploaded successfully", **stored}), 201
 
 # --- API to List Files for a Case ---
 @main_bp.route('/cases/<string:case_id>/files', methods=['GET'])
 def get_case_files(case_id):
-    conn = get_db_conn()
-    files = conn.execute("SELECT id, original_filename, upload_timestamp FROM evidence_files WHERE case_id = %s", (case_id,)).fetchall()
-    conn.close()
-    return jsonify([dict(row) for row in files]), 200
+    with get_db_conn() as conn:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute(
+            "SELECT id, original_filename, upload_timestamp, stored_filename, sha256 FROM evidence_files WHERE case_id = %s",
+            (case_id,)
+        )
+        files = cursor.fetchall()
+    result = []
+    for row in files:
+        item = {key: row[key] for key in ('id', 'original_filename', 'upload_timestamp', 'stored_filename')}
+        item['url'] = f"/uploads/{row['stored_filename']}"
+        # หน้ารายละเอียดคดีใช้ภาพย่อแทนการโหลดไฟล์ต้นฉบับ
+        item['thumbnail_url'] = f"/files/{row['id']}/preview?size=thumb" if row['sha256'] else None
+        result.append(item)
+    return jsonify(result), 200
 
 # --- API to Serve/Download a File ---
 @main_bp.route('/uploads/<path:filename>')
 def serve_file(filename):
-    return send_from_directory(current_app.config['UPLOAD_FOLDER'], filename)
+    return file_serving.serve(filename)
+
+# --- API to Serve a Thumbnail / First-Page Preview ---
+@main_bp.route('/files/<string:file_id>/preview', methods=['GET'])
+def serve_file_preview(file_id):
+    """?size=thumb|preview. 202 while the derivative is still being generated."""
+    size = request.args.get('size', 'thumb')
+    if size not in preview_service.SIZES:
+        return jsonify({"error": f"size must be one of {sorted(preview_service.SIZES)}"}), 400
+    with get_db_conn() as conn:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute("SELECT original_filename, file_path, sha256 FROM evidence_files WHERE id = %s", (file_id,))
+        row = cursor.fetchone()
+        if not row:
+            return jsonify({"error": "File not found"}), 404
+        if not row['sha256']:
+            return jsonify({"error": "No preview for files stored before content addressing; run migrate-evidence-files."}), 404
+
+        blob_path = os.path.join(current_app.config['UPLOAD_FOLDER'], row['file_path'])
+        if not os.path.exists(preview_service.derivative_path(blob_path, size)):
+            if not os.path.exists(blob_path) or preview_service.sniff_kind(blob_path) is None:
+                return jsonify({"error": "No preview available for this file type."}), 404
+            # Normally queued at upload; re-queue in case that job failed or predates previews
+            job_queue.enqueue(cursor, job_queue.GENERATE_PREVIEWS, blob_path)
+            conn.commit()
+            return jsonify({"status": "pending"}), 202
+    return file_serving.send_preview(row, size)
+
+# --- Evidence Export (zip/tar stream + manifest.json) ---
+def _export_response(case_ids, title, filename):
+    fmt = request.args.get('format', 'zip')
+    if fmt not in export_service.FORMATS:
+        return jsonify({"error": f"format must be one of {sorted(export_service.FORMATS)}"}), 400
+    with get_db_conn() as conn:
+        manifest, entries = export_service.load_export(conn, current_app.config['UPLOAD_FOLDER'], case_ids, title)
+    current_app.logger.info(f"Exporting {title}: {len(entries)} files, {manifest['total_bytes']} bytes")
+    return Response(
+        export_service.stream_archive(fmt, manifest, entries),
+        mimetype=export_service.FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt}"'},
+        direct_passthrough=True,
+    )
+
+@main_bp.route('/cases/<string:case_id>/export', methods=['GET'])
+def export_case(case_id):
+    try:
+        with get_db_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT case_number FROM cases WHERE id = %s", (case_id,))
+            row = cursor.fetchone()
+            cursor.close()
+        if not row:
+            return jsonify({"error": "Case not found"}), 404
+        return _export_response([case_id], f"case {row[0] or case_id}", secure_filename(f"case-{row[0] or case_id}"))
+    except Exception as e:
+        current_app.logger.error(f"Failed to export case {case_id}: {e}")
+        return jsonify({"error": "Failed to export case."}), 500
+
+@main_bp.route('/case_groups/<string:group_number>/export', methods=['GET'])
+def export_group(group_number):
+    try:
+        with get_db_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT c.id FROM case_groups cg JOIN cases c ON c.group_id = cg.id WHERE cg.group_number = %s",
+                (group_number,)
+            )
+            case_ids = [row[0] for row in cursor.fetchall()]
+            cursor.close()
+        if not case_ids:
+            return jsonify({"error": "Group not found"}), 404
+        return _export_response(case_ids, f"group {group_number}", secure_filename(f"group-{group_number}"))
+    except Exception as e:
+        current_app.logger.error(f"Failed to export group {group_number}: {e}")
+        return jsonify({"error": "Failed to export group."}), 500
 
 # --- API to Delete a File ---
 @main_bp.route('/files/<string:file_id>', methods=['DELETE'])
 def delete_file(file_id):
-    conn = get_db_conn()
-    cursor = conn.cursor()
-    
-    file_info = cursor.execute("SELECT stored_filename FROM evidence_files WHERE id = %s", (file_id,)).fetchone()
-    
-    if file_info:
-        # Delete file from filesystem
-        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], file_info['stored_filename'])
-        if os.path.exists(file_path):
-            os.remove(file_path)
-        
-        # Delete record from database
-        cursor.execute("DELETE FROM evidence_files WHERE id = %s", (file_id,))
+    with get_db_conn() as conn:
+        cursor = conn.cursor()
+        paths = evidence_storage.delete_evidence_file(cursor, current_app.config['UPLOAD_FOLDER'], file_id)
+        if paths is None:
+            return jsonify({"error": "File not found"}), 404
         conn.commit()
-        conn.close()
-        return jsonify({"message": "File deleted successfully"}), 200
-    else:
-        conn.close()
-        return jsonify({"error": "File not found"}), 404
+    evidence_storage.collect_blobs(current_app.config['UPLOAD_FOLDER'], paths)
+    return jsonify({"message": "File deleted successfully"}), 200
+
+@main_bp.route('/metrics/uploads', methods=['GET'])
+def get_upload_metrics():
+    return jsonify(evidence_storage.metrics.stats()), 200
+
+# --- Connection Pool Metrics ---
+@main_bp.route('/metrics/db_pool', methods=['GET'])
+def get_db_pool_metrics():
+    return jsonify(get_pool().stats()), 200
+
+@main_bp.route('/health/ready', methods=['GET'])
+def readiness():
+    """200 once this process has a model loaded; 503 while it is still loading (or failed)."""
+    status = current_app.extensions['ml_model'].status()
+    return jsonify(status), 200 if status['state'] == 'ready' else 503
+
+@main_bp.route('/metrics/jobs', methods=['GET'])
+def get_job_metrics():
+    try:
+        with get_db_conn() as conn:
+            stats = job_queue.queue_stats(conn)
+        return jsonify(stats), 200
+    except Exception as e:
+        current_app.logger.error(f"Failed to read job queue metrics: {e}")
+        return jsonify({"error": "Could not read job queue metrics."}), 500
 
 @main_bp.route('/retrain_model', methods=['POST'])
 def retrain_model():
-    ml_model_pipeline = current_app.config['ML_PIPELINE']
+    """Queues an offline training run (snapshot extraction + out-of-process fit); never fits here."""
     try:
-        conn = get_db_conn()
-        df_train = pd.read_sql_query("SELECT * FROM cases", conn)
-        conn.close()
-
-        if len(df_train) < 10:
-            return jsonify({"error": "Not enough data to retrain model. At least 10 cases required."}), 400
-        
-        X_train = df_train[ml_service.CATEGORICAL_FEATURES + ml_service.ORDINAL_FEATURES + ml_service.NUMERICAL_FEATURES + ml_service.BINARY_FEATURES]
-        y_train = df_train[ml_service.TARGET_COLUMN]
-        ml_model_pipeline.fit(X_train, y_train)
-        
-        ml_service.save_model(ml_model_pipeline, current_app.config['MODEL_PATH'])
-        return jsonify({"message": "Model retrained successfully."}), 200
+        with get_db_conn() as conn:
+            cursor = conn.cursor()
+            job_queue.enqueue(cursor, job_queue.TRAIN_MODEL, os.path.abspath(current_app.config['MODEL_REGISTRY_DIR']), max_attempts=1)
+            conn.commit()
+            cursor.close()
+        return jsonify({"message": "Model retraining queued."}), 202
     except Exception as e:
         current_app.logger.error(f"Model retraining failed: {e}")
-        return jsonify({"error": "Model retraining failed."}), 500
\ No newline at end of file
+        return jsonify({"error": "Model retraining failed."}), 500
+
+# --- Model Registry ---
+def _model_summary(metadata, active_version):
+    return {**metadata, "active": metadata.get('version') == active_version}
+
+@main_bp.route('/models', methods=['GET'])
+def list_models():
+    holder = current_app.extensions['ml_model']
+    try:
+        active = holder.registry.active_version()
+        return jsonify({
+            "active_version": active,
+            "serving_version": holder.current.version if holder.current else None,
+            "versions": [_model_summary(m, active) for m in holder.registry.list_versions() if m],
+        }), 200
+    except Exception as e:
+        current_app.logger.error(f"Failed to list model versions: {e}")
+        return jsonify({"error": "Could not list model versions."}), 500
+
+@main_bp.route('/models/<string:version>/activate', methods=['POST'])
+def activate_model(version):
+    """Points every process at `version`; this one swaps now, the others on their next poll."""
+    holder = current_app.extensions['ml_model']
+    try:
+        previous = holder.registry.activate(version)
+        holder.refresh()
+        return jsonify({"message": "Model activated.", "version": version, "previous": previous}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        current_app.logger.error(f"Failed to activate model {version}: {e}")
+        return jsonify({"error": "Could not activate model version."}), 500
+
+@main_bp.route('/models/rollback', methods=['POST'])
+def rollback_model():
+    holder = current_app.extensions['ml_model']
+    try:
+        version = holder.registry.rollback()
+        holder.refresh()
+        return jsonify({"message": "Model rolled back.", "version": version}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        current_app.logger.error(f"Model rollback failed: {e}")
+        return jsonify({"error": "Model rollback failed."}), 500
\ No newline at end of file
@@ -0,0 +1,71 @@
+# app/services/case_repository.py
+
+from collections import defaultdict
+
+# --- Listing ---
+# Officers are no longer aggregated per row with a correlated subquery; callers fetch
+# the page first and then attach officers for every case on it with one query.
+LISTING_FROM = "FROM cases c LEFT JOIN complainants comp ON c.complainant_id = comp.id"
+LISTING_SELECT = """
+    SELECT c.*,
+           CONCAT(comp.first_name, ' ', comp.last_name) as complainant_name
+"""
+# Columns maintained for the database's own use (search_service's trigram key), never returned by the API
+INTERNAL_COLUMNS = ('case_number_norm',)
+
+def public_case(row):
+    """A case row as the API returns it: a plain dict without INTERNAL_COLUMNS."""
+    return {key: value for key, value in dict(row).items() if key not in INTERNAL_COLUMNS}
+
+def fetch_officers_by_case(cursor, case_ids):
+    """Returns {case_id: [officer dict, ...]} for all `case_ids` in a single round trip."""
+    officers_by_case = defaultdict(list)
+    if not case_ids:
+        return officers_by_case
+    cursor.execute("""
+        SELECT co.case_id AS _case_id, o.*
+        FROM case_officers co
+        JOIN officers o ON o.id = co.officer_id
+        WHERE co.case_id = ANY(%s)
+        ORDER BY o.first_name, o.last_name
+    """, (list(case_ids),))
+    for row in cursor.fetchall():
+        officer = dict(row)
+        officers_by_case[officer.pop('_case_id')].append(officer)
+    return officers_by_case
+
+def attach_officer_names(cursor, rows):
+    """
+    Adds the comma-separated `officer_names` field to each listing row.
+    Costs one query regardless of page size.
+    """
+    rows = [public_case(row) for row in rows]
+    officers_by_case = fetch_officers_by_case(cursor, [row['id'] for row in rows])
+    for row in rows:
+        officers = officers_by_case.get(row['id'])
+        row['officer_names'] = ", ".join(
+            f"{o['first_name']} {o['last_name']}" for o in officers
+        ) if officers else None
+    return rows
+
+# --- Detail ---
+def get_case_detail(cursor, case_number):
+    """
+    Loads a case with its complainant and officers in two round trips:
+    case + complainant (joined), then officers. Returns None if the case does not exist.
+    """
+    cursor.execute("""
+        SELECT c.*,
+               CASE WHEN comp.id IS NULL THEN NULL ELSE row_to_json(comp) END AS _complainant
+        FROM cases c
+        LEFT JOIN complainants comp ON comp.id = c.complainant_id
+        WHERE c.case_number = %s
+    """, (case_number,))
+    case_data = cursor.fetchone()
+    if not case_data:
+        return None
+
+    case_dict = public_case(case_data)
+    case_dict['complainant'] = case_dict.pop('_complainant')
+    case_dict['officers'] = fetch_officers_by_case(cursor, [case_dict['id']]).get(case_dict['id'], [])
+    return case_dict
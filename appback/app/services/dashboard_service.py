@@ -0,0 +1,125 @@
+# app/services/dashboard_service.py
+
+from psycopg2.extras import RealDictCursor
+import threading
+import time
+from app.database import get_db_conn
+
+DEFAULT_CACHE_TTL = 15  # seconds
+
+# --- Single-statement aggregation ---
+# Counters are read from the case_daily_stats rollup (see stats_service), so their cost
+# grows with the number of days rather than the number of cases. Everything is folded
+# into one statement as JSON so the whole payload costs one round trip.
+DASHBOARD_QUERY = """
+    WITH summary AS (
+        SELECT
+            COALESCE(SUM(case_count), 0) AS total_cases,
+            COALESCE(SUM(case_count) FILTER (WHERE status = 'รับเรื่อง'), 0) AS pending_cases,
+            COALESCE(SUM(case_count) FILTER (WHERE status = 'กำลังสืบสวน'), 0) AS in_progress_cases,
+            COALESCE(SUM(case_count) FILTER (WHERE status = 'ปิดคดี'), 0) AS completed_cases,
+            COALESCE(SUM(case_count) FILTER (WHERE day = CURRENT_DATE), 0) AS cases_today
+        FROM case_daily_stats
+    ),
+    last_7_days AS (
+        SELECT day, SUM(case_count) AS count
+        FROM case_daily_stats
+        WHERE day >= CURRENT_DATE - INTERVAL '6 days'
+        GROUP BY day
+        HAVING SUM(case_count) > 0
+    ),
+    by_type AS (
+        SELECT case_type, SUM(case_count) AS count
+        FROM case_daily_stats
+        WHERE case_type <> ''
+        GROUP BY case_type
+        HAVING SUM(case_count) > 0
+    ),
+    monthly AS (
+        SELECT TO_CHAR(day, 'YYYY-MM') AS month, case_type, SUM(case_count) AS count
+        FROM case_daily_stats
+        WHERE case_type <> ''
+        GROUP BY month, case_type
+        HAVING SUM(case_count) > 0
+    ),
+    top_cases AS (
+        SELECT id, case_number, case_name, description, timestamp,
+               num_victims, estimated_financial_damage, priority_score
+        FROM cases
+        ORDER BY priority_score DESC
+        LIMIT 5
+    ),
+    top_accounts AS (
+        SELECT account_number, COUNT(*) AS case_count
+        FROM bank_accounts
+        GROUP BY account_number
+        ORDER BY case_count DESC
+        LIMIT 5
+    )
+    SELECT
+        (SELECT row_to_json(summary) FROM summary) AS summary_stats,
+        (SELECT COALESCE(json_agg(last_7_days ORDER BY day), '[]') FROM last_7_days) AS cases_last_7_days,
+        (SELECT COALESCE(json_object_agg(case_type, count), '{}') FROM by_type) AS cases_by_type,
+        (SELECT COALESCE(json_agg(monthly ORDER BY month), '[]') FROM monthly) AS monthly_rows,
+        (SELECT COALESCE(json_agg(top_cases ORDER BY priority_score DESC), '[]') FROM top_cases) AS top_5_priority_cases,
+        (SELECT COALESCE(json_agg(top_accounts ORDER BY case_count DESC), '[]') FROM top_accounts) AS top_5_accounts
+"""
+
+# --- Payload cache ---
+# Per-process cache of the assembled payload. Writes call invalidate_dashboard_cache();
+# the short TTL bounds staleness for writes made by other worker processes.
+_cache_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+_cache = {"payload": None, "expires_at": 0.0, "generation": 0}
+
+def invalidate_dashboard_cache():
+    """Drops the cached dashboard payload. Call after any write to `cases`."""
+    with _cache_lock:
+        _cache["payload"] = None
+        _cache["expires_at"] = 0.0
+        _cache["generation"] += 1
+
+def _build_dashboard_payload():
+    with get_db_conn() as conn:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute(DASHBOARD_QUERY)
+        row = cursor.fetchone()
+        cursor.close()
+
+    monthly_breakdown = {}
+    for item in row['monthly_rows']:
+        monthly_breakdown.setdefault(item['month'], {})[item['case_type']] = item['count']
+
+    return {
+        "summary_stats": row['summary_stats'],
+        "cases_last_7_days": row['cases_last_7_days'],
+        "cases_by_type": row['cases_by_type'],
+        "monthly_case_breakdown": monthly_breakdown,
+        "top_5_priority_cases": row['top_5_priority_cases'],
+        "top_5_accounts": row['top_5_accounts']
+    }
+
+def get_dashboard_stats(ttl=DEFAULT_CACHE_TTL):
+    """
+    Returns the dashboard payload, serving it from cache while it is younger than `ttl` seconds.
+    Concurrent misses are collapsed so only one request hits the database.
+    """
+    with _cache_lock:
+        if _cache["payload"] is not None and time.monotonic() < _cache["expires_at"]:
+            return _cache["payload"]
+
+    with _refresh_lock:
+        # Another thread may have refreshed the cache while we waited.
+        with _cache_lock:
+            if _cache["payload"] is not None and time.monotonic() < _cache["expires_at"]:
+                return _cache["payload"]
+            generation = _cache["generation"]
+
+        payload = _build_dashboard_payload()
+
+        with _cache_lock:
+            # Don't store a result that raced with an invalidation.
+            if ttl > 0 and _cache["generation"] == generation:
+                _cache["payload"] = payload
+                _cache["expires_at"] = time.monotonic() + ttl
+    return payload
@@ -0,0 +1,517 @@
+# app/services/evidence_storage.py
+#
+# Content-addressed evidence storage. Every uploaded file is streamed to disk in chunks
+# while its SHA-256 is computed, then stored once under its hash:
+#
+#     <UPLOAD_FOLDER>/objects/ab/cd/abcdef...   (two levels of hash sharding)
+#     <UPLOAD_FOLDER>/incoming/                 (uploads in progress, same filesystem)
+#
+# evidence_files rows reference the blob by sha256; evidence_blobs counts the references,
+# so the same screenshot attached to many linked cases occupies disk space once.
+
+from collections import deque
+import datetime
+import glob
+import hashlib
+import os
+import tempfile
+import threading
+import uuid
+from flask import Request, current_app
+from app.database import get_db_conn
+from app.services import job_queue, preview_service
+
+CHUNK_SIZE = 1024 * 1024
+
+SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS evidence_blobs (
+        sha256 TEXT PRIMARY KEY,
+        size_bytes BIGINT NOT NULL,
+        ref_count INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+
+    ALTER TABLE evidence_files ADD COLUMN IF NOT EXISTS sha256 TEXT;
+    ALTER TABLE evidence_files ADD COLUMN IF NOT EXISTS size_bytes BIGINT;
+    CREATE INDEX IF NOT EXISTS idx_evidence_files_sha256 ON evidence_files (sha256);
+    CREATE INDEX IF NOT EXISTS idx_evidence_files_stored_filename ON evidence_files (stored_filename);
+
+    -- Resumable uploads: chunks are appended to incoming/session-<id>.part in order
+    CREATE TABLE IF NOT EXISTS upload_sessions (
+        id TEXT PRIMARY KEY,
+        case_id TEXT NOT NULL,
+        original_filename TEXT NOT NULL,
+        total_bytes BIGINT NOT NULL,
+        received_bytes BIGINT NOT NULL DEFAULT 0,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+"""
+
+# --- Paths ---
+def relative_object_path(sha256):
+    return os.path.join('objects', sha256[:2], sha256[2:4], sha256)
+
+def object_path(root, sha256):
+    return os.path.join(root, relative_object_path(sha256))
+
+def incoming_dir(root):
+    path = os.path.join(root, 'incoming')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def session_part_path(root, session_id):
+    return os.path.join(incoming_dir(root), f"session-{session_id}.part")
+
+# --- Streaming writes ---
+class IncomingFile:
+    """
+    A temporary file in incoming/ that hashes everything written to it. Used directly as
+    Werkzeug's multipart stream (see StreamingRequest), so a form upload is written to disk
+    exactly once, and removed on close unless it was committed into the object store.
+    """
+
+    def __init__(self, root):
+        fd, self.path = tempfile.mkstemp(prefix='upload-', suffix='.part', dir=incoming_dir(root))
+        self._file = os.fdopen(fd, 'w+b')
+        self._hasher = hashlib.sha256()
+        self.size = 0
+        self.committed = False
+
+    def write(self, data):
+        self._hasher.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def copy_from(self, stream, chunk_size=CHUNK_SIZE):
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                return self
+            self.write(chunk)
+
+    def seek(self, *args):
+        return self._file.seek(*args)
+
+    def tell(self):
+        return self._file.tell()
+
+    def read(self, *args):
+        return self._file.read(*args)
+
+    def flush(self):
+        return self._file.flush()
+
+    def hexdigest(self):
+        return self._hasher.hexdigest()
+
+    def finish(self):
+        """Flushes the data to stable storage (evidence must survive a crash once acknowledged)."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+        if not self.committed and os.path.exists(self.path):
+            os.remove(self.path)
+
+class StreamingRequest(Request):
+    """Request class whose multipart file parts stream straight into IncomingFile."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return IncomingFile(current_app.config['UPLOAD_FOLDER'])
+
+def ingest(root, stream):
+    """Returns an IncomingFile holding `stream` (as-is if the stream already is one)."""
+    if isinstance(stream, IncomingFile):
+        return stream
+    return IncomingFile(root).copy_from(stream)
+
+# --- Object store ---
+def _place(root, source_path, sha256):
+    """Moves a finished file into the store; a copy that is already there wins."""
+    target = object_path(root, sha256)
+    if os.path.exists(target):
+        os.remove(source_path)
+        return False
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.replace(source_path, target)
+    return True
+
+def _lock_blob(cursor, sha256):
+    # Serializes adding a reference with collect_blobs' unreferenced-check-then-unlink; held
+    # until the caller's transaction ends.
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (sha256,))
+
+def commit_blob(cursor, root, source_path, sha256, size):
+    """
+    Adds a reference to blob `sha256`, moving `source_path` into the store if the blob is new.
+    Holds the blob's lock until the caller commits, so collect_blobs either finishes removing
+    an unreferenced copy first or sees the new reference and keeps the file. Returns True if
+    the content was already stored (deduplicated).
+
+    The file is placed before the caller commits; if the transaction rolls back it stays
+    behind without an evidence_blobs row until sweep_unreferenced_blobs removes it. Later
+    uploads of the same content reuse it, so "new content" (and its preview job) is decided
+    by the refcount row being created, not by the file being placed.
+    """
+    _lock_blob(cursor, sha256)
+    cursor.execute("""
+        INSERT INTO evidence_blobs (sha256, size_bytes, ref_count) VALUES (%s, %s, 1)
+        ON CONFLICT (sha256) DO UPDATE SET ref_count = evidence_blobs.ref_count + 1
+        RETURNING ref_count
+    """, (sha256, size))
+    ref_count = cursor.fetchone()[0]
+    previewable = preview_service.sniff_kind(source_path) is not None
+    _place(root, source_path, sha256)
+    if ref_count == 1 and previewable:
+        job_queue.enqueue(cursor, job_queue.GENERATE_PREVIEWS, object_path(root, sha256))
+    return ref_count > 1
+
+def release_blob(cursor, root, sha256):
+    """
+    Drops one reference. Returns the blob's path if that was the last one; the caller
+    passes it to collect_blobs only after committing, so a rollback never loses content.
+    """
+    cursor.execute(
+        "UPDATE evidence_blobs SET ref_count = ref_count - 1 WHERE sha256 = %s RETURNING ref_count",
+        (sha256,)
+    )
+    row = cursor.fetchone()
+    if row and row[0] <= 0:
+        cursor.execute("DELETE FROM evidence_blobs WHERE sha256 = %s", (sha256,))
+        return object_path(root, sha256)
+    return None
+
+def remove_files(paths):
+    """Removes files and any cached derivatives stored next to them (<path>.thumb.jpg, ...)."""
+    for path in paths:
+        if not path:
+            continue
+        for candidate in [path] + glob.glob(glob.escape(path) + '.*'):
+            if os.path.exists(candidate):
+                os.remove(candidate)
+
+def collect_blobs(root, paths):
+    """
+    Removes files released by a committed delete. Object-store blobs are only unlinked
+    under the blob's lock and after re-checking that no evidence_blobs row exists: a
+    concurrent upload of the same content may have referenced the blob again since the
+    delete committed. Legacy files (not content-addressed) are removed directly. Returns
+    the number of files removed.
+    """
+    removed = 0
+    for path in paths:
+        if not path:
+            continue
+        sha256 = os.path.basename(path)
+        if path != object_path(root, sha256):
+            remove_files([path])
+            removed += 1
+            continue
+        with get_db_conn() as conn:
+            cursor = conn.cursor()
+            _lock_blob(cursor, sha256)
+            cursor.execute("SELECT 1 FROM evidence_blobs WHERE sha256 = %s", (sha256,))
+            if cursor.fetchone() is None and os.path.exists(path):
+                remove_files([path])
+                removed += 1
+            conn.commit()
+            cursor.close()
+    return removed
+
+def sweep_unreferenced_blobs(root):
+    """
+    Garbage-collects the object store: every blob file without an evidence_blobs row (left
+    by a rolled-back upload, or by a crash between commit and collect_blobs) goes through
+    collect_blobs. Returns the number of blobs removed.
+    """
+    objects_dir = os.path.join(root, 'objects')
+    paths = [
+        path for path in glob.glob(os.path.join(objects_dir, '??', '??', '*'))
+        if '.' not in os.path.basename(path)  # skip cached derivatives (<sha256>.thumb.jpg)
+    ]
+    return collect_blobs(root, paths)
+
+def store_evidence_file(cursor, root, case_id, original_filename, incoming):
+    """
+    Commits a finished IncomingFile into the store and records the evidence_files row.
+    Runs on the caller's cursor; the caller commits.
+    """
+    incoming.finish()
+    sha256 = incoming.hexdigest()
+    deduplicated = commit_blob(cursor, root, incoming.path, sha256, incoming.size)
+    incoming.committed = True
+    return _insert_evidence_file(cursor, case_id, original_filename, sha256, incoming.size, deduplicated)
+
+def _insert_evidence_file(cursor, case_id, original_filename, sha256, size, deduplicated):
+    file_id = str(uuid.uuid4())
+    extension = original_filename.rsplit('.', 1)[1].lower() if '.' in original_filename else 'bin'
+    stored_filename = f"{uuid.uuid4()}.{extension}"
+    cursor.execute("""
+        INSERT INTO evidence_files (id, case_id, original_filename, stored_filename, file_path, upload_timestamp, sha256, size_bytes)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    """, (
+        file_id, case_id, original_filename, stored_filename,
+        relative_object_path(sha256), datetime.datetime.now().isoformat(), sha256, size
+    ))
+    return {
+        "id": file_id,
+        "filename": stored_filename,
+        "sha256": sha256,
+        "size_bytes": size,
+        "deduplicated": deduplicated,
+    }
+
+def _release_rows(cursor, root, rows):
+    paths = []
+    for stored_filename, sha256 in rows:
+        if sha256:
+            paths.append(release_blob(cursor, root, sha256))
+        else:
+            # ไฟล์รุ่นเก่าที่เก็บด้วยชื่อ UUID ตรงๆ ใน UPLOAD_FOLDER
+            paths.append(os.path.join(root, stored_filename))
+    return [path for path in paths if path]
+
+def delete_evidence_file(cursor, root, file_id):
+    """
+    Deletes an evidence_files row and releases its blob. Returns the paths to pass to
+    collect_blobs after commit, or None if there was no such row.
+    """
+    cursor.execute(
+        "DELETE FROM evidence_files WHERE id = %s RETURNING stored_filename, sha256",
+        (file_id,)
+    )
+    rows = cursor.fetchall()
+    if not rows:
+        return None
+    return _release_rows(cursor, root, rows)
+
+def delete_case_files(cursor, root, case_id):
+    """Same as delete_evidence_file for every file of a case (call before deleting the case)."""
+    cursor.execute(
+        "DELETE FROM evidence_files WHERE case_id = %s RETURNING stored_filename, sha256",
+        (case_id,)
+    )
+    return _release_rows(cursor, root, cursor.fetchall())
+
+# --- Resumable uploads ---
+# Chunks handled by this process keep their running hash here, so completing an upload
+# doesn't re-read the file; a session continued by another process is re-hashed from disk.
+_session_hashes = {}
+_session_lock = threading.Lock()
+
+def create_session(cursor, root, case_id, original_filename, total_bytes):
+    session_id = str(uuid.uuid4())
+    cursor.execute(
+        "INSERT INTO upload_sessions (id, case_id, original_filename, total_bytes) VALUES (%s, %s, %s, %s)",
+        (session_id, case_id, original_filename, total_bytes)
+    )
+    open(session_part_path(root, session_id), 'wb').close()
+    with _session_lock:
+        _session_hashes[session_id] = (0, hashlib.sha256())
+    return session_id
+
+def get_session(cursor, session_id, for_update=False):
+    cursor.execute(
+        "SELECT id, case_id, original_filename, total_bytes, received_bytes FROM upload_sessions WHERE id = %s"
+        + (" FOR UPDATE" if for_update else ""),
+        (session_id,)
+    )
+    row = cursor.fetchone()
+    if not row:
+        return None
+    return dict(zip(('id', 'case_id', 'original_filename', 'total_bytes', 'received_bytes'), row))
+
+def receive_chunk(root, session, offset, stream):
+    """
+    Streams a request body into its own IncomingFile, without holding a DB connection (slow
+    clients would otherwise pin pooled connections). `session` is an unlocked snapshot:
+    the offset is checked early here and again, atomically, by append_chunk.
+    """
+    if offset != session['received_bytes']:
+        raise ValueError(f"Expected offset {session['received_bytes']}, got {offset}.")
+    chunk_file = IncomingFile(root)
+    try:
+        while True:
+            data = stream.read(CHUNK_SIZE)
+            if not data:
+                break
+            if offset + chunk_file.size + len(data) > session['total_bytes']:
+                raise ValueError("Chunk goes past the declared upload size.")
+            chunk_file.write(data)
+        chunk_file.finish()
+    except Exception:
+        chunk_file.close()
+        raise
+    return chunk_file
+
+def append_chunk(cursor, root, session_id, offset, chunk_file):
+    """
+    Records a received chunk at `offset` and copies it into the session's part file. The
+    UPDATE only matches while received_bytes still equals `offset`, so of two racing
+    requests for the same offset exactly one wins. Returns the new received_bytes; the
+    caller commits and closes `chunk_file`.
+    """
+    cursor.execute("""
+        UPDATE upload_sessions SET received_bytes = received_bytes + %s, updated_at = now()
+        WHERE id = %s AND received_bytes = %s
+        RETURNING received_bytes
+    """, (chunk_file.size, session_id, offset))
+    row = cursor.fetchone()
+    if row is None:
+        raise ValueError(f"Offset {offset} is no longer the end of the upload; fetch the session and resume.")
+    received = row[0]
+
+    with _session_lock:
+        cached = _session_hashes.pop(session_id, None)
+    hasher = cached[1] if cached and cached[0] == offset else None
+    with open(session_part_path(root, session_id), 'r+b') as f, open(chunk_file.path, 'rb') as source:
+        f.truncate(offset)  # drop any bytes of an earlier attempt that never got recorded
+        f.seek(offset)
+        for data in iter(lambda: source.read(CHUNK_SIZE), b''):
+            f.write(data)
+            if hasher is not None:
+                hasher.update(data)
+        f.flush()
+        os.fsync(f.fileno())
+    if hasher is not None:
+        with _session_lock:
+            _session_hashes[session_id] = (received, hasher)
+    return received
+
+def _hash_file(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def complete_session(cursor, root, session):
+    """Moves a fully received session into the store and records its evidence_files row."""
+    if session['received_bytes'] != session['total_bytes']:
+        raise ValueError(f"Upload incomplete: {session['received_bytes']} of {session['total_bytes']} bytes received.")
+    with _session_lock:
+        cached = _session_hashes.pop(session['id'], None)
+    path = session_part_path(root, session['id'])
+    sha256 = cached[1].hexdigest() if cached and cached[0] == session['received_bytes'] else _hash_file(path)
+    deduplicated = commit_blob(cursor, root, path, sha256, session['total_bytes'])
+    cursor.execute("DELETE FROM upload_sessions WHERE id = %s", (session['id'],))
+    return _insert_evidence_file(cursor, session['case_id'], session['original_filename'],
+                                 sha256, session['total_bytes'], deduplicated)
+
+def purge_stale_sessions(conn, root, older_than_hours=24):
+    """Deletes upload sessions (and their partial files) that haven't received data recently."""
+    cursor = conn.cursor()
+    cursor.execute(
+        "DELETE FROM upload_sessions WHERE updated_at < now() - make_interval(hours => %s) RETURNING id",
+        (older_than_hours,)
+    )
+    session_ids = [row[0] for row in cursor.fetchall()]
+    conn.commit()
+    cursor.close()
+    for session_id in session_ids:
+        path = session_part_path(root, session_id)
+        if os.path.exists(path):
+            os.remove(path)
+        with _session_lock:
+            _session_hashes.pop(session_id, None)
+    return len(session_ids)
+
+# --- Legacy files ---
+def migrate_legacy_files(conn, root, batch_size=500):
+    """
+    Moves evidence stored under random UUID names into the object store, deduplicating
+    as it goes. Returns (files migrated, bytes freed by deduplication).
+    """
+    migrated, freed, last_id = 0, 0, ''
+    while True:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT id, stored_filename FROM evidence_files WHERE sha256 IS NULL AND id > %s "
+            "ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED",
+            (last_id, batch_size)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            cursor.close()
+            return migrated, freed
+        last_id = rows[-1][0]
+        moved = []
+        for file_id, stored_filename in rows:
+            legacy_path = os.path.join(root, stored_filename)
+            if not os.path.exists(legacy_path):
+                continue
+            size = os.path.getsize(legacy_path)
+            sha256 = _hash_file(legacy_path)
+            # Hard link into incoming/ so the legacy name survives until the rows are committed
+            link_path = os.path.join(incoming_dir(root), f"migrate-{file_id}.part")
+            if os.path.exists(link_path):
+                os.remove(link_path)
+            os.link(legacy_path, link_path)
+            if commit_blob(cursor, root, link_path, sha256, size):
+                freed += size
+            cursor.execute(
+                "UPDATE evidence_files SET sha256 = %s, size_bytes = %s, file_path = %s WHERE id = %s",
+                (sha256, size, relative_object_path(sha256), file_id)
+            )
+            moved.append(legacy_path)
+            migrated += 1
+        conn.commit()
+        cursor.close()
+        remove_files(moved)
+        if len(rows) < batch_size:
+            return migrated, freed
+
+# --- Metrics ---
+class UploadMetrics:
+    """In-process upload counters: volume, deduplication, throughput and latency percentiles."""
+
+    def __init__(self, window=500):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self.uploads = 0
+        self.chunks = 0
+        self.failures = 0
+        self.bytes_received = 0
+        self.bytes_deduplicated = 0
+        self.deduplicated_uploads = 0
+        self.seconds_total = 0.0
+
+    def record(self, size, elapsed, deduplicated=False, completed=True):
+        with self._lock:
+            if completed:
+                self.uploads += 1
+                self._latencies.append(elapsed)
+            else:
+                self.chunks += 1
+            self.bytes_received += size
+            self.seconds_total += elapsed
+            if deduplicated:
+                self.deduplicated_uploads += 1
+                self.bytes_deduplicated += size
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            def percentile(p):
+                return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 2) if latencies else None
+            return {
+                "uploads": self.uploads,
+                "chunks": self.chunks,
+                "failures": self.failures,
+                "bytes_received": self.bytes_received,
+                "bytes_deduplicated": self.bytes_deduplicated,
+                "deduplicated_uploads": self.deduplicated_uploads,
+                "throughput_mb_s": round(self.bytes_received / self.seconds_total / 1e6, 2) if self.seconds_total else None,
+                "latency_p50_ms": percentile(0.50),
+                "latency_p95_ms": percentile(0.95),
+            }
+
+metrics = UploadMetrics()
@@ -0,0 +1,215 @@
+# app/services/export_service.py
+#
+# Evidence exports for prosecutor handoff: one case or a whole case group as a zip or tar
+# stream, with manifest.json (cases, complainants, suspects, structured evidence, file
+# checksums) as the first entry. The archive is produced on the fly: each file is copied
+# in 1 MiB chunks straight into the response, with no temp files, and memory use doesn't
+# depend on file sizes. Only the metadata (a few hundred bytes per file) is held, so
+# group exports covering thousands of files are fine.
+#
+# Files are opened one at a time, just before their entry is written; an open descriptor
+# keeps the data readable even if the file is deleted meanwhile. A file that is already
+# gone by then (deleted after the manifest was built) is skipped and listed in a final
+# MISSING_ENTRY, so the archive stays valid instead of being cut off mid-response.
+
+import datetime
+import decimal
+import json
+import os
+import posixpath
+import tarfile
+import time
+import zipfile
+from psycopg2.extras import RealDictCursor
+from app.services import case_repository
+
+CHUNK_SIZE = 1024 * 1024
+FORMATS = {'zip': 'application/zip', 'tar': 'application/x-tar'}
+MISSING_ENTRY = 'missing_files.json'
+
+# --- Metadata ---
+def _json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    return str(value)
+
+def _rows_by(rows, key):
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(row[key], []).append(dict(row))
+    return grouped
+
+def _archive_name(case, file_row, used):
+    """cases/<case_number>/<original name>, de-duplicated within the case folder."""
+    folder = f"cases/{case['case_number'] or case['id']}"
+    stem, extension = os.path.splitext(file_row['original_filename'])
+    name, counter = posixpath.join(folder, file_row['original_filename']), 1
+    while name in used:
+        counter += 1
+        name = posixpath.join(folder, f"{stem} ({counter}){extension}")
+    used.add(name)
+    return name
+
+def load_export(conn, root, case_ids, title):
+    """
+    Loads everything the manifest needs with a handful of set-based queries and releases
+    the connection before any bytes are streamed. Returns (manifest, [(archive_name, path, size)]).
+    """
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    cursor.execute("""
+        SELECT c.*, CASE WHEN comp.id IS NULL THEN NULL ELSE row_to_json(comp) END AS complainant
+        FROM cases c
+        LEFT JOIN complainants comp ON comp.id = c.complainant_id
+        WHERE c.id = ANY(%s)
+        ORDER BY c.timestamp, c.id
+    """, (list(case_ids),))
+    cases = [case_repository.public_case(row) for row in cursor.fetchall()]
+    ids = [case['id'] for case in cases]
+    numbers = [case['case_number'] for case in cases if case['case_number']]
+
+    cursor.execute("SELECT * FROM suspests WHERE case_number = ANY(%s) ORDER BY created_at", (numbers,))
+    suspects = _rows_by(cursor.fetchall(), 'case_number')
+    cursor.execute(
+        "SELECT evidence_type, evidence_value, case_id FROM structured_evidence WHERE case_id = ANY(%s) ORDER BY evidence_type",
+        (ids,)
+    )
+    evidence = _rows_by(cursor.fetchall(), 'case_id')
+    cursor.execute("""
+        SELECT id, case_id, original_filename, stored_filename, file_path, sha256, size_bytes, upload_timestamp
+        FROM evidence_files WHERE case_id = ANY(%s) ORDER BY upload_timestamp, id
+    """, (ids,))
+    files = _rows_by(cursor.fetchall(), 'case_id')
+    cursor.close()
+
+    entries, used = [], {'manifest.json', MISSING_ENTRY}
+    for case in cases:
+        case['suspects'] = suspects.get(case['case_number'], [])
+        case['structured_evidence'] = [
+            {k: v for k, v in row.items() if k != 'case_id'} for row in evidence.get(case['id'], [])
+        ]
+        case['files'] = []
+        for file_row in files.get(case['id'], []):
+            relative_path = file_row['file_path'] if file_row['sha256'] else file_row['stored_filename']
+            path = os.path.join(root, relative_path)
+            size = os.path.getsize(path) if os.path.isfile(path) else None
+            name = _archive_name(case, file_row, used) if size is not None else None
+            case['files'].append({
+                "id": file_row['id'],
+                "original_filename": file_row['original_filename'],
+                "archive_path": name,
+                "sha256": file_row['sha256'],
+                "size_bytes": size,
+                "upload_timestamp": file_row['upload_timestamp'],
+                "missing": size is None,
+            })
+            if size is not None:
+                entries.append((name, path, size))
+
+    manifest = {
+        "export": title,
+        "generated_at": datetime.datetime.now().isoformat(),
+        "case_count": len(cases),
+        "file_count": len(entries),
+        "total_bytes": sum(size for _, _, size in entries),
+        "missing_files_entry": f"{MISSING_ENTRY} is appended if files were deleted while exporting",
+        "cases": cases,
+    }
+    return manifest, entries
+
+def _manifest_bytes(manifest):
+    return json.dumps(manifest, ensure_ascii=False, indent=2, default=_json_default).encode('utf-8')
+
+def _read_chunks(f):
+    with f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            yield chunk
+
+def _open_entries(entries, missing):
+    """Yields (name, open file, size) per entry, recording entries whose file is already gone."""
+    for name, path, size in entries:
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            missing.append({"archive_path": name, "size_bytes": size})
+            continue
+        yield name, f, size
+
+def _missing_bytes(missing):
+    return json.dumps({"missing_files": missing}, ensure_ascii=False, indent=2).encode('utf-8')
+
+# --- Zip ---
+class _Sink:
+    """Write-only, unseekable file object; zipfile then streams with data descriptors."""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+def stream_zip(manifest, entries):
+    now = time.localtime()[:6]
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', allowZip64=True) as archive:
+        archive.writestr(zipfile.ZipInfo('manifest.json', now), _manifest_bytes(manifest),
+                         compress_type=zipfile.ZIP_DEFLATED)
+        yield sink.drain()
+        missing = []
+        for name, f, size in _open_entries(entries, missing):
+            info = zipfile.ZipInfo(name, now)
+            info.compress_type = zipfile.ZIP_STORED  # images/PDFs are already compressed
+            with archive.open(info, 'w', force_zip64=size >= zipfile.ZIP64_LIMIT) as dest:
+                for chunk in _read_chunks(f):
+                    dest.write(chunk)
+                    yield sink.drain()
+            yield sink.drain()
+        if missing:
+            archive.writestr(zipfile.ZipInfo(MISSING_ENTRY, now), _missing_bytes(missing),
+                             compress_type=zipfile.ZIP_DEFLATED)
+    yield sink.drain()  # central directory
+
+# --- Tar ---
+def _tar_member(name, size):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(time.time())
+    info.mode = 0o644
+    return info.tobuf(format=tarfile.PAX_FORMAT)
+
+def _tar_padding(size):
+    return tarfile.NUL * ((tarfile.BLOCKSIZE - size % tarfile.BLOCKSIZE) % tarfile.BLOCKSIZE)
+
+def stream_tar(manifest, entries):
+    # Headers and padding are written by hand: tarfile.addfile copies a whole member
+    # before returning, which would buffer every file in memory.
+    data = _manifest_bytes(manifest)
+    yield _tar_member('manifest.json', len(data)) + data + _tar_padding(len(data))
+    missing = []
+    for name, f, size in _open_entries(entries, missing):
+        yield _tar_member(name, size)
+        written = 0
+        for chunk in _read_chunks(f):
+            written += len(chunk)
+            yield chunk
+        if written != size:
+            raise IOError(f"{name} changed size during export ({size} -> {written} bytes)")
+        yield _tar_padding(size)
+    if missing:
+        data = _missing_bytes(missing)
+        yield _tar_member(MISSING_ENTRY, len(data)) + data + _tar_padding(len(data))
+    yield tarfile.NUL * (tarfile.BLOCKSIZE * 2)
+
+def stream_archive(fmt, manifest, entries):
+    chunks = stream_zip(manifest, entries) if fmt == 'zip' else stream_tar(manifest, entries)
+    return (chunk for chunk in chunks if chunk)
@@ -0,0 +1,147 @@
+# app/services/feature_encoder.py
+
+import itertools
+import numpy as np
+from app.services import ml_service
+
+class FastFeatureEncoder:
+    """
+    Turns one case feature dict straight into the model's input vector, without pandas.
+    All parameters are copied from the fitted ColumnTransformer in the saved pipeline, and
+    the value handling mirrors ml_service.build_feature_frame (defaults, ordinal input
+    maps, str() for categories, `== True` for binaries), so the vector is bit-identical to
+    what the pipeline's preprocessor would produce.
+    """
+
+    def __init__(self, pipeline):
+        from sklearn.preprocessing import OneHotEncoder, OrdinalEncoder, StandardScaler
+
+        preprocessor = pipeline.named_steps['preprocessor']
+        self.regressor = pipeline.named_steps['regressor']
+        self.ordinal_maps = {column: (mapping, fallback) for column, mapping, fallback in ml_service.ORDINAL_INPUT_MAPS}
+
+        # Each block: (kind, columns, params); emitted in ColumnTransformer output order.
+        self.blocks = []
+        width = 0
+        for name, transformer, columns in preprocessor.transformers_:
+            if transformer == 'drop' or name == 'remainder':
+                continue
+            columns = list(columns)
+            if transformer == 'passthrough':
+                self.blocks.append(('passthrough', columns, None))
+                width += len(columns)
+            elif isinstance(transformer, OneHotEncoder):
+                if getattr(transformer, 'drop_idx_', None) is not None:
+                    raise ValueError("OneHotEncoder with drop= is not supported by the fast encoder.")
+                lookups = [{str(c): i for i, c in enumerate(categories)} for categories in transformer.categories_]
+                self.blocks.append(('onehot', columns, (lookups, transformer.handle_unknown)))
+                width += sum(len(lookup) for lookup in lookups)
+            elif isinstance(transformer, OrdinalEncoder):
+                lookups = [{str(c): float(i) for i, c in enumerate(categories)} for categories in transformer.categories_]
+                self.blocks.append(('ordinal', columns, lookups))
+                width += len(columns)
+            elif isinstance(transformer, StandardScaler):
+                mean = transformer.mean_ if transformer.with_mean else np.zeros(len(columns))
+                scale = transformer.scale_ if transformer.with_std else np.ones(len(columns))
+                self.blocks.append(('scale', columns, (np.asarray(mean, dtype=np.float64), np.asarray(scale, dtype=np.float64))))
+                width += len(columns)
+            else:
+                raise ValueError(f"Unsupported transformer for fast encoding: {transformer!r}")
+        self.width = width
+
+    def _value(self, features, column):
+        value = features[column] if column in features else ml_service.feature_default(column)
+        if column in self.ordinal_maps:
+            mapping, fallback = self.ordinal_maps[column]
+            value = mapping.get(value, fallback)
+        if column in ml_service.BINARY_FEATURES:
+            return 1.0 if value == True else 0.0
+        if column in ml_service.CATEGORICAL_FEATURES or column in ml_service.ORDINAL_FEATURES:
+            return str(value)
+        return value
+
+    def encode(self, features):
+        """Returns a (1, n_features) float64 array for one feature dict."""
+        vector = np.zeros(self.width, dtype=np.float64)
+        position = 0
+        for kind, columns, params in self.blocks:
+            if kind == 'onehot':
+                lookups, handle_unknown = params
+                for column, lookup in zip(columns, lookups):
+                    index = lookup.get(self._value(features, column))
+                    if index is not None:
+                        vector[position + index] = 1.0
+                    elif handle_unknown == 'error':
+                        raise ValueError(f"Found unknown categories in column {column} during transform")
+                    position += len(lookup)
+            elif kind == 'ordinal':
+                for column, lookup in zip(columns, params):
+                    category = self._value(features, column)
+                    if category not in lookup:
+                        raise ValueError(f"Found unknown categories ['{category}'] in column {column} during transform")
+                    vector[position] = lookup[category]
+                    position += 1
+            elif kind == 'scale':
+                mean, scale = params
+                raw = np.array([float(self._value(features, column)) for column in columns], dtype=np.float64)
+                vector[position:position + len(columns)] = (raw - mean) / scale
+                position += len(columns)
+            else:
+                for column in columns:
+                    vector[position] = float(self._value(features, column))
+                    position += 1
+        return vector.reshape(1, -1)
+
+    def predict(self, features, forest=None):
+        X = self.encode(features)
+        if forest is not None and not np.isnan(X).any():
+            return float(forest.predict(X)[0])
+        return float(self.regressor.predict(X)[0])
+
+# --- Verification ---
+def probe_cases():
+    """A deterministic spread of inputs covering every category, level and binary flag."""
+    case_types = ['Hacking', 'Scam', 'Phishing', 'Illegal Content', 'Cyberbullying', 'Unknown', None]
+    levels = [None, 'None', 1, '2', 3, '4', 5, 'High']
+    for i, (case_type, level) in enumerate(itertools.product(case_types, levels)):
+        yield {
+            'case_type': case_type,
+            'reputational_damage_level': level,
+            'technical_complexity_level': levels[(i + 3) % len(levels)],
+            'initial_evidence_clarity': levels[(i + 5) % len(levels)],
+            'estimated_financial_damage': (i * 137_911) % 20_000_000,
+            'num_victims': (i * 7) % 300,
+            'sensitive_data_compromised': i % 2 == 0,
+            'ongoing_threat': i % 3 == 0,
+            'risk_of_evidence_loss': i % 5 == 0,
+            'evidence_count': i % 11,
+            'has_actionable_evidence': i % 4 == 0,
+            'days_since_creation': 0,
+            'num_linked_cases': 0,
+            'is_grouped': False,
+        }
+
+def verify_against_pipeline(encoder, pipeline, cases=None):
+    """Returns True if the fast path reproduces pipeline.predict exactly on every probe case."""
+    cases = list(cases if cases is not None else probe_cases())
+    expected = pipeline.predict(ml_service.build_feature_frame(cases))
+    for features, want in zip(cases, expected):
+        try:
+            got = encoder.predict(features)
+        except ValueError:
+            return False
+        if got != float(want):
+            return False
+    return True
+
+def build_encoder(pipeline):
+    """Builds and verifies a fast encoder, or returns None if the pipeline can't be fast-pathed."""
+    try:
+        encoder = FastFeatureEncoder(pipeline)
+    except (AttributeError, KeyError, ValueError) as e:
+        print(f"Fast feature encoder unavailable: {e}")
+        return None
+    if not verify_against_pipeline(encoder, pipeline):
+        print("Fast feature encoder disagrees with the pipeline; using the DataFrame path.")
+        return None
+    return encoder
@@ -0,0 +1,171 @@
+# app/services/file_serving.py
+#
+# Evidence downloads. Stored blobs never change, so their SHA-256 is a strong ETag:
+# revalidation is answered with 304 before any file is opened, and Range requests are
+# served as 206 partial content. EVIDENCE_SENDFILE selects who moves the bytes:
+#
+#     'none'              Werkzeug; the file is handed to the server's wsgi.file_wrapper
+#                         (gunicorn uses sendfile(2), so the data isn't copied through Python)
+#     'x-sendfile'        Apache/lighttpd: X-Sendfile header with the absolute path
+#     'x-accel-redirect'  nginx: X-Accel-Redirect to EVIDENCE_ACCEL_PREFIX + relative path,
+#                         served from an `internal` location aliased to UPLOAD_FOLDER
+
+from concurrent.futures import ThreadPoolExecutor
+import mimetypes
+import os
+import random
+import statistics
+import time
+import unicodedata
+import urllib.request
+from urllib.parse import quote
+from urllib.error import HTTPError
+from flask import Response, current_app, request, send_file
+from psycopg2.extras import RealDictCursor
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+from app.database import get_db_conn
+
+CACHE_MAX_AGE = 7 * 24 * 3600  # content under a stored name never changes
+
+def resolve(cursor, stored_filename):
+    """Storage location of an evidence file by its public stored name, or None."""
+    cursor.execute(
+        "SELECT original_filename, file_path, sha256, size_bytes FROM evidence_files WHERE stored_filename = %s",
+        (stored_filename,)
+    )
+    return cursor.fetchone()
+
+def _not_modified(etag):
+    return etag is not None and request.if_none_match.contains(etag)
+
+def _clean_download_name(name):
+    # original_filename comes from the client: control characters (CR/LF) must never reach a header
+    return ''.join(ch for ch in name if unicodedata.category(ch) != 'Cc') or 'download'
+
+def _set_content_disposition(headers, download_name):
+    """inline; filename=<ASCII fallback>; filename*=UTF-8''<percent-encoded>, as send_file does."""
+    try:
+        download_name.encode('ascii')
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', download_name).encode('ascii', 'ignore').decode('ascii')
+        names = {'filename': simple or 'download', 'filename*': f"UTF-8''{quote(download_name, safe='!#$&+^`|~')}"}
+    else:
+        names = {'filename': download_name}
+    headers.set('Content-Disposition', 'inline', **names)  # quotes/escapes the values
+
+def _accel_response(relative_path, mimetype, etag, download_name):
+    prefix = current_app.config['EVIDENCE_ACCEL_PREFIX'].rstrip('/')
+    response = Response(mimetype=mimetype)
+    response.headers['X-Accel-Redirect'] = f"{prefix}/{relative_path.replace(os.sep, '/')}"
+    _set_content_disposition(response.headers, download_name)
+    if etag:
+        response.set_etag(etag)
+    return response
+
+def send_stored(relative_path, etag, mimetype, download_name):
+    """
+    Response for a file under UPLOAD_FOLDER: 304 on a matching If-None-Match, otherwise the
+    file (or the requested byte range) via the configured sendfile mode.
+    """
+    if _not_modified(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.cache_control.private = True
+        response.cache_control.max_age = CACHE_MAX_AGE
+        return response
+
+    path = safe_join(current_app.config['UPLOAD_FOLDER'], relative_path)
+    download_name = _clean_download_name(download_name)
+    if path is None or not os.path.isfile(path):
+        raise NotFound()
+
+    if current_app.config['EVIDENCE_SENDFILE'] == 'x-accel-redirect':
+        response = _accel_response(relative_path, mimetype, etag, download_name)
+    else:
+        # send_file handles If-None-Match, Range and If-Range (conditional=True); with
+        # USE_X_SENDFILE it only emits the X-Sendfile header and never opens the file.
+        response = send_file(
+            path, mimetype=mimetype, download_name=download_name,
+            etag=etag if etag else True, conditional=True, max_age=CACHE_MAX_AGE,
+        )
+    # Evidence is confidential: browsers may cache it, shared caches may not
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
+
+def send_evidence(stored_filename, row):
+    if row is None:
+        raise NotFound()  # only recorded evidence is served, never other files under UPLOAD_FOLDER
+    mimetype = mimetypes.guess_type(stored_filename)[0] or 'application/octet-stream'
+    if row['sha256']:
+        return send_stored(row['file_path'], row['sha256'], mimetype, row['original_filename'])
+    # ไฟล์รุ่นเก่า (ก่อนย้ายเข้า object store): ใช้ ETag ที่ Werkzeug สร้างจาก mtime/ขนาด
+    return send_stored(stored_filename, None, mimetype, stored_filename)
+
+def send_preview(row, size):
+    """A cached derivative of a content-addressed file (ETag: "<sha256>-<size>")."""
+    from app.services import preview_service
+
+    relative_path = preview_service.derivative_path(row['file_path'], size)
+    download_name = f"{row['original_filename'].rsplit('.', 1)[0]}.{size}.jpg"
+    return send_stored(relative_path, f"{row['sha256']}-{size}", 'image/jpeg', download_name)
+
+def serve(stored_filename):
+    with get_db_conn() as conn:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        row = resolve(cursor, stored_filename)
+        cursor.close()
+    return send_evidence(stored_filename, row)
+
+# --- Download benchmark ---
+def _fetch(url, headers):
+    started = time.perf_counter()
+    req = urllib.request.Request(url, headers=headers)
+    try:
+        with urllib.request.urlopen(req) as response:
+            status, etag = response.status, response.headers.get('ETag')
+            size = 0
+            for chunk in iter(lambda: response.read(256 * 1024), b''):
+                size += len(chunk)
+    except HTTPError as e:
+        status, etag, size = e.code, e.headers.get('ETag'), 0
+    return status, etag, size, time.perf_counter() - started
+
+def run_benchmark(url, concurrency=8, requests_per_mode=200, range_bytes=1024 * 1024, seed=7):
+    """
+    Downloads `url` from `concurrency` threads in three modes (full body, random byte
+    ranges, If-None-Match revalidation) and reports throughput and latency per mode.
+    """
+    status, etag, total_size, _ = _fetch(url, {})
+    if status != 200:
+        raise RuntimeError(f"{url} returned HTTP {status}")
+    rng = random.Random(seed)
+
+    def range_header():
+        start = rng.randrange(max(1, total_size - range_bytes))
+        return {'Range': f"bytes={start}-{start + range_bytes - 1}"}
+
+    modes = {
+        "full": lambda: {},
+        "range": range_header,
+        "revalidate": lambda: {'If-None-Match': etag} if etag else {},
+    }
+    results = []
+    for mode, headers_for in modes.items():
+        header_sets = [headers_for() for _ in range(requests_per_mode)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            outcomes = list(pool.map(lambda headers: _fetch(url, headers), header_sets))
+        elapsed = time.perf_counter() - started
+        latencies = sorted(o[3] for o in outcomes)
+        transferred = sum(o[2] for o in outcomes)
+        results.append({
+            "mode": mode,
+            "statuses": sorted({o[0] for o in outcomes}),
+            "requests_s": round(len(outcomes) / elapsed, 1),
+            "mb_s": round(transferred / elapsed / 1e6, 1),
+            "p50_ms": round(statistics.median(latencies) * 1000, 2),
+            "p95_ms": round(latencies[int(0.95 * (len(latencies) - 1))] * 1000, 2),
+        })
+    return {"file_bytes": total_size, "etag": etag, "concurrency": concurrency, "modes": results}
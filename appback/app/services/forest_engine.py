@@ -0,0 +1,152 @@
+# app/services/forest_engine.py
+
+import json
+import os
+import statistics
+import time
+import numpy as np
+
+ARRAY_FIELDS = ('feature', 'threshold', 'left', 'right', 'value', 'roots')
+
+class FlatForest:
+    """
+    A fitted RandomForestRegressor flattened into contiguous arrays
+    (feature, threshold, left, right, value) and evaluated with vectorized traversal:
+    every sample walks every tree at once, one tree level per step.
+
+    Leaves point to themselves with an +inf threshold, so the walk needs no leaf test and
+    simply runs for max_depth steps. Inputs are rounded to float32 and leaf values are
+    summed tree by tree in estimator order, exactly like sklearn, so results are bit-identical.
+    """
+
+    def __init__(self, regressor):
+        estimators = regressor.estimators_
+        if not estimators:
+            raise ValueError("Forest has no fitted estimators.")
+        if getattr(regressor, 'n_outputs_', 1) != 1:
+            raise ValueError("Only single-output forests are supported.")
+
+        features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for estimator in estimators:
+            tree = estimator.tree_
+            n_nodes = tree.node_count
+            node_ids = np.arange(n_nodes, dtype=np.intp) + offset
+            is_leaf = tree.children_left == -1
+
+            features.append(np.where(is_leaf, 0, tree.feature).astype(np.intp))
+            thresholds.append(np.where(is_leaf, np.inf, tree.threshold).astype(np.float64))
+            lefts.append(np.where(is_leaf, node_ids, tree.children_left + offset).astype(np.intp))
+            rights.append(np.where(is_leaf, node_ids, tree.children_right + offset).astype(np.intp))
+            values.append(tree.value[:, 0, 0].astype(np.float64))
+            roots.append(offset)
+
+            offset += n_nodes
+            max_depth = max(max_depth, tree.max_depth)
+
+        self.feature = np.ascontiguousarray(np.concatenate(features))
+        self.threshold = np.ascontiguousarray(np.concatenate(thresholds))
+        self.left = np.ascontiguousarray(np.concatenate(lefts))
+        self.right = np.ascontiguousarray(np.concatenate(rights))
+        self.value = np.ascontiguousarray(np.concatenate(values))
+        self.roots = np.asarray(roots, dtype=np.intp)
+        self.max_depth = max_depth
+        self.n_features = regressor.n_features_in_
+
+    # --- Persistence ---
+    def save(self, directory):
+        """Writes the arrays as plain .npy files so processes can memory-map one shared copy."""
+        os.makedirs(directory, exist_ok=True)
+        for name in ARRAY_FIELDS:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name), allow_pickle=False)
+        with open(os.path.join(directory, 'forest.json'), 'w') as f:
+            json.dump({'max_depth': int(self.max_depth), 'n_features': int(self.n_features)}, f)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """
+        Loads arrays written by save(). With mmap_mode='r' they are read-only views of the
+        page cache, so every worker process on the host shares the same physical pages.
+        """
+        forest = cls.__new__(cls)
+        for name in ARRAY_FIELDS:
+            setattr(forest, name, np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode, allow_pickle=False))
+        with open(os.path.join(directory, 'forest.json')) as f:
+            shape = json.load(f)
+        forest.max_depth = shape['max_depth']
+        forest.n_features = shape['n_features']
+        return forest
+
+    def apply(self, X):
+        """Returns the (n_samples, n_trees) array of leaf node ids."""
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f"Expected input with {self.n_features} features, got shape {X.shape}.")
+        rows = np.arange(X.shape[0], dtype=np.intp)[:, None]
+        nodes = np.broadcast_to(self.roots, (X.shape[0], len(self.roots))).copy()
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return nodes
+
+    def predict(self, X):
+        leaf_values = self.value[self.apply(X)]
+        predictions = np.zeros(leaf_values.shape[0], dtype=np.float64)
+        for t in range(leaf_values.shape[1]):  # same accumulation order as sklearn
+            predictions += leaf_values[:, t]
+        predictions /= leaf_values.shape[1]
+        return predictions
+
+def to_dense(X):
+    return X.toarray() if hasattr(X, 'toarray') else np.asarray(X)
+
+# --- Validation ---
+def verify_against_sklearn(forest, regressor, X):
+    """True if the flat forest reproduces regressor.predict bit-for-bit on X."""
+    return np.array_equal(forest.predict(X), regressor.predict(X))
+
+def build_forest(pipeline, probe_frame, random_rows=2000, seed=42):
+    """
+    Flattens the pipeline's forest and validates it on the transformed probe cases plus
+    random rows spread around every threshold. Returns None if anything disagrees.
+    """
+    regressor = pipeline.named_steps['regressor']
+    try:
+        forest = FlatForest(regressor)
+    except (AttributeError, ValueError) as e:
+        print(f"Flat forest backend unavailable: {e}")
+        return None
+
+    probe_X = to_dense(pipeline.named_steps['preprocessor'].transform(probe_frame))
+    rng = np.random.default_rng(seed)
+    thresholds = forest.threshold[np.isfinite(forest.threshold)]
+    random_X = rng.choice(thresholds, size=(random_rows, forest.n_features)) if thresholds.size else np.zeros((1, forest.n_features))
+    random_X = random_X + rng.normal(scale=1e-3, size=random_X.shape) * (rng.random(random_X.shape) < 0.5)
+
+    for X in (probe_X, random_X):
+        if not verify_against_sklearn(forest, regressor, X):
+            print("Flat forest disagrees with sklearn; keeping the sklearn backend.")
+            return None
+    return forest
+
+# --- Microbenchmark ---
+def _median_ms(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+def run_benchmark(pipeline, forest, frame_1, frame_10k, repeats=20):
+    """Median latency (ms) of pipeline.predict vs. preprocessor + flat forest, 1 row and 10k rows."""
+    preprocessor = pipeline.named_steps['preprocessor']
+    results = []
+    for label, frame in (("1 row", frame_1), (f"{len(frame_10k)} rows", frame_10k)):
+        results.append({
+            "batch": label,
+            "pipeline_predict_ms": round(_median_ms(lambda: pipeline.predict(frame), repeats), 3),
+            "flat_forest_ms": round(_median_ms(lambda: forest.predict(to_dense(preprocessor.transform(frame))), repeats), 3),
+        })
+    return results
@@ -0,0 +1,257 @@
+# app/services/group_summary_service.py
+
+from psycopg2.extras import RealDictCursor
+import time
+
+CLOSED_STATUS = 'ปิดคดี'
+PRIMARY_EVIDENCE_TYPE = 'BANK_ACCOUNT'
+
+# --- Summary schema ---
+# case_groups keeps running totals (victims, damage, first/latest timestamp over open cases);
+# group_evidence_counts keeps how many evidence rows of the group's cases carry each
+# normalized key. Both are adjusted by deltas when cases join, leave, close or reopen;
+# recompute_group / reconcile_all rebuild them from the base tables.
+SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS group_evidence_counts (
+        group_id TEXT NOT NULL,
+        evidence_type TEXT NOT NULL,
+        normalized_value TEXT NOT NULL,
+        evidence_count INTEGER NOT NULL,
+        PRIMARY KEY (group_id, evidence_type, normalized_value)
+    );
+    CREATE INDEX IF NOT EXISTS idx_group_evidence_counts_top
+        ON group_evidence_counts (group_id, evidence_type, evidence_count DESC, normalized_value);
+"""
+
+def _is_open(status):
+    return status != CLOSED_STATUS
+
+# --- Deltas ---
+def _refresh_primary_evidence(cursor, group_id):
+    cursor.execute("""
+        UPDATE case_groups SET primary_evidence_value = (
+            SELECT normalized_value FROM group_evidence_counts
+            WHERE group_id = %s AND evidence_type = %s
+            ORDER BY evidence_count DESC, normalized_value
+            LIMIT 1
+        )
+        WHERE id = %s
+    """, (group_id, PRIMARY_EVIDENCE_TYPE, group_id))
+
+def _refresh_bounds(cursor, group_id, exclude_case_ids=()):
+    """Re-reads first/latest timestamp after an open case left (served by the group/timestamp index)."""
+    cursor.execute("""
+        UPDATE case_groups SET
+            first_case_timestamp = b.first_case_timestamp,
+            latest_case_timestamp = b.latest_case_timestamp
+        FROM (
+            SELECT MIN(timestamp) AS first_case_timestamp, MAX(timestamp) AS latest_case_timestamp
+            FROM cases
+            WHERE group_id = %s AND status != %s AND id <> ALL(%s)
+        ) b
+        WHERE case_groups.id = %s
+    """, (group_id, CLOSED_STATUS, list(exclude_case_ids), group_id))
+
+def _apply_totals(cursor, group_id, sign, victims, damage, first_ts, last_ts, exclude_case_ids=()):
+    """Adds (sign=1) or subtracts (sign=-1) open-case totals; locks the group row."""
+    cursor.execute("""
+        UPDATE case_groups SET
+            total_victims = COALESCE(total_victims, 0) + %s,
+            total_damage = COALESCE(total_damage, 0) + %s,
+            first_case_timestamp = CASE WHEN %s > 0 THEN LEAST(first_case_timestamp, %s) ELSE first_case_timestamp END,
+            latest_case_timestamp = CASE WHEN %s > 0 THEN GREATEST(latest_case_timestamp, %s) ELSE latest_case_timestamp END
+        WHERE id = %s
+        RETURNING first_case_timestamp, latest_case_timestamp
+    """, (sign * (victims or 0), sign * (damage or 0), sign, first_ts, sign, last_ts, group_id))
+    bounds = cursor.fetchone()
+    if sign < 0 and bounds and first_ts is not None:
+        current_first, current_last = (bounds['first_case_timestamp'], bounds['latest_case_timestamp']) if isinstance(bounds, dict) else bounds
+        # Only a case sitting on a boundary can move it; everything else is O(1)
+        if (current_first is not None and first_ts <= current_first) or (current_last is not None and last_ts >= current_last):
+            _refresh_bounds(cursor, group_id, exclude_case_ids)
+
+def _apply_evidence(cursor, group_id, case_ids, sign):
+    cursor.execute("""
+        INSERT INTO group_evidence_counts (group_id, evidence_type, normalized_value, evidence_count)
+        SELECT %s, evidence_type, normalized_value, %s * COUNT(*)
+        FROM structured_evidence
+        WHERE case_id = ANY(%s) AND normalized_value <> ''
+        GROUP BY evidence_type, normalized_value
+        ON CONFLICT (group_id, evidence_type, normalized_value)
+        DO UPDATE SET evidence_count = group_evidence_counts.evidence_count + EXCLUDED.evidence_count
+    """, (group_id, sign, list(case_ids)))
+    if sign < 0:
+        cursor.execute("DELETE FROM group_evidence_counts WHERE group_id = %s AND evidence_count <= 0", (group_id,))
+    _refresh_primary_evidence(cursor, group_id)
+
+def _case_totals(cursor, case_ids):
+    cursor.execute("""
+        SELECT SUM(num_victims) AS victims, SUM(estimated_financial_damage) AS damage,
+               MIN(timestamp) AS first_ts, MAX(timestamp) AS last_ts
+        FROM cases WHERE id = ANY(%s) AND status != %s
+    """, (list(case_ids), CLOSED_STATUS))
+    row = cursor.fetchone()
+    return tuple(row.values()) if isinstance(row, dict) else tuple(row)
+
+def add_cases(cursor, group_id, case_ids):
+    """Adds the cases' contribution to a group's summary (the cases are already in the group)."""
+    if not group_id or not case_ids:
+        return
+    _apply_totals(cursor, group_id, 1, *_case_totals(cursor, case_ids))
+    _apply_evidence(cursor, group_id, case_ids, 1)
+
+def remove_cases(cursor, group_id, case_ids):
+    """
+    Removes the cases' contribution from a group's summary. Works both after the cases
+    left the group and just before they are deleted (their rows must still exist).
+    """
+    if not group_id or not case_ids:
+        return
+    _apply_totals(cursor, group_id, -1, *_case_totals(cursor, case_ids), exclude_case_ids=case_ids)
+    _apply_evidence(cursor, group_id, case_ids, -1)
+
+def move_cases(cursor, case_ids, group_id):
+    """
+    Sets group_id on the cases (None ungroups them) and moves their contribution between
+    the old and new group summaries. Cases already in the group are untouched.
+    Returns the number of cases moved.
+    """
+    cursor.execute("""
+        UPDATE cases c SET group_id = %s
+        FROM (
+            SELECT id, group_id AS old_group_id FROM cases
+            WHERE id = ANY(%s) AND group_id IS DISTINCT FROM %s
+            FOR UPDATE
+        ) o
+        WHERE c.id = o.id
+        RETURNING c.id, o.old_group_id
+    """, (group_id, list(case_ids), group_id))
+    by_old_group = {}
+    for row in cursor.fetchall():
+        moved_id, old_group_id = (row['id'], row['old_group_id']) if isinstance(row, dict) else row
+        by_old_group.setdefault(old_group_id, []).append(moved_id)
+
+    for old_group_id, moved in sorted(by_old_group.items(), key=lambda item: item[0] or ''):
+        remove_cases(cursor, old_group_id, moved)
+    add_cases(cursor, group_id, [case_id for moved in by_old_group.values() for case_id in moved])
+    return sum(len(moved) for moved in by_old_group.values())
+
+def record_case_changed(cursor, group_id, old, new):
+    """
+    Adjusts totals for an edit of one grouped case. `old` and `new` are
+    (timestamp, status, num_victims, estimated_financial_damage) tuples; call after the UPDATE.
+    """
+    if not group_id or old == new:
+        return
+    old_timestamp, old_status, old_victims, old_damage = old
+    new_timestamp, new_status, new_victims, new_damage = new
+    if _is_open(old_status):
+        _apply_totals(cursor, group_id, -1, old_victims, old_damage, old_timestamp, old_timestamp)
+    if _is_open(new_status):
+        _apply_totals(cursor, group_id, 1, new_victims, new_damage, new_timestamp, new_timestamp)
+
+def merge_into(cursor, survivor_id, merged_ids):
+    """Folds the summaries of groups being merged into the survivor's (before they are deleted)."""
+    merged_ids = list(merged_ids)
+    if not merged_ids:
+        return
+    cursor.execute("""
+        UPDATE case_groups g SET
+            total_victims = COALESCE(g.total_victims, 0) + m.total_victims,
+            total_damage = COALESCE(g.total_damage, 0) + m.total_damage,
+            first_case_timestamp = LEAST(g.first_case_timestamp, m.first_case_timestamp),
+            latest_case_timestamp = GREATEST(g.latest_case_timestamp, m.latest_case_timestamp)
+        FROM (
+            SELECT COALESCE(SUM(total_victims), 0) AS total_victims, COALESCE(SUM(total_damage), 0) AS total_damage,
+                   MIN(first_case_timestamp) AS first_case_timestamp, MAX(latest_case_timestamp) AS latest_case_timestamp
+            FROM case_groups WHERE id = ANY(%s)
+        ) m
+        WHERE g.id = %s
+    """, (merged_ids, survivor_id))
+    cursor.execute("""
+        INSERT INTO group_evidence_counts (group_id, evidence_type, normalized_value, evidence_count)
+        SELECT %s, evidence_type, normalized_value, SUM(evidence_count)
+        FROM group_evidence_counts
+        WHERE group_id = ANY(%s)
+        GROUP BY evidence_type, normalized_value
+        ON CONFLICT (group_id, evidence_type, normalized_value)
+        DO UPDATE SET evidence_count = group_evidence_counts.evidence_count + EXCLUDED.evidence_count
+    """, (survivor_id, merged_ids))
+    drop_groups(cursor, merged_ids)
+    _refresh_primary_evidence(cursor, survivor_id)
+
+def drop_groups(cursor, group_ids):
+    cursor.execute("DELETE FROM group_evidence_counts WHERE group_id = ANY(%s)", (list(group_ids),))
+
+# --- Reconciliation ---
+_RECOMPUTE_TOTALS_SQL = """
+    UPDATE case_groups g SET
+        first_case_timestamp = s.first_case_timestamp,
+        latest_case_timestamp = s.latest_case_timestamp,
+        total_victims = COALESCE(s.total_victims, 0),
+        total_damage = COALESCE(s.total_damage, 0)
+    FROM case_groups g2
+    LEFT JOIN (
+        SELECT group_id,
+               MIN(timestamp) AS first_case_timestamp,
+               MAX(timestamp) AS latest_case_timestamp,
+               SUM(num_victims) AS total_victims,
+               SUM(estimated_financial_damage) AS total_damage
+        FROM cases
+        WHERE status != %s AND group_id IS NOT NULL {case_filter}
+        GROUP BY group_id
+    ) s ON s.group_id = g2.id
+    WHERE g.id = g2.id {group_filter}
+"""
+
+_RECOMPUTE_EVIDENCE_SQL = """
+    INSERT INTO group_evidence_counts (group_id, evidence_type, normalized_value, evidence_count)
+    SELECT c.group_id, se.evidence_type, se.normalized_value, COUNT(*)
+    FROM structured_evidence se
+    JOIN cases c ON se.case_id = c.id
+    WHERE c.group_id IS NOT NULL AND se.normalized_value <> '' {case_filter}
+    GROUP BY c.group_id, se.evidence_type, se.normalized_value
+"""
+
+_RECOMPUTE_PRIMARY_SQL = """
+    UPDATE case_groups g SET primary_evidence_value = top.normalized_value
+    FROM case_groups g2
+    LEFT JOIN LATERAL (
+        SELECT normalized_value FROM group_evidence_counts
+        WHERE group_id = g2.id AND evidence_type = %s
+        ORDER BY evidence_count DESC, normalized_value
+        LIMIT 1
+    ) top ON TRUE
+    WHERE g.id = g2.id {group_filter}
+"""
+
+def recompute_group(cursor, group_id):
+    """Rebuilds one group's totals and evidence counts from the base tables."""
+    cursor.execute("SELECT id FROM case_groups WHERE id = %s FOR UPDATE", (group_id,))
+    cursor.execute(_RECOMPUTE_TOTALS_SQL.format(case_filter="AND group_id = %s", group_filter="AND g.id = %s"),
+                   (CLOSED_STATUS, group_id, group_id))
+    cursor.execute("DELETE FROM group_evidence_counts WHERE group_id = %s", (group_id,))
+    cursor.execute(_RECOMPUTE_EVIDENCE_SQL.format(case_filter="AND c.group_id = %s"), (group_id,))
+    _refresh_primary_evidence(cursor, group_id)
+
+def reconcile_all(conn):
+    """
+    Rebuilds every group summary and the whole evidence frequency table with set-based
+    statements in one transaction. Returns (groups updated, elapsed seconds).
+    """
+    started = time.perf_counter()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        cursor.execute("LOCK TABLE case_groups IN SHARE ROW EXCLUSIVE MODE")
+        cursor.execute(_RECOMPUTE_TOTALS_SQL.format(case_filter="", group_filter=""), (CLOSED_STATUS,))
+        updated = cursor.rowcount
+        cursor.execute("TRUNCATE group_evidence_counts")
+        cursor.execute(_RECOMPUTE_EVIDENCE_SQL.format(case_filter=""))
+        cursor.execute(_RECOMPUTE_PRIMARY_SQL.format(group_filter=""), (PRIMARY_EVIDENCE_TYPE,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return updated, time.perf_counter() - started
@@ -0,0 +1,320 @@
+# app/services/grouping_service.py
+
+from concurrent.futures import ThreadPoolExecutor
+from psycopg2.extras import RealDictCursor, execute_values
+import datetime
+import io
+import time
+import uuid
+from app.database import get_db_conn
+from app.services import job_queue, group_summary_service
+
+# Linking jobs hold this advisory lock shared; a full regroup holds it exclusively.
+REGROUP_LOCK_KEY = 7_130_001
+OPEN_CASE_FILTER = "c.status != 'ปิดคดี'"
+
+class UnionFind:
+    """Disjoint sets over arbitrary hashable keys (union by size, path halving)."""
+
+    def __init__(self):
+        self.index = {}
+        self.keys = []
+        self.parent = []
+        self.size = []
+
+    def add(self, key):
+        i = self.index.get(key)
+        if i is None:
+            i = len(self.keys)
+            self.index[key] = i
+            self.keys.append(key)
+            self.parent.append(i)
+            self.size.append(1)
+        return i
+
+    def find(self, i):
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, a, b):
+        ra, rb = self.find(self.add(a)), self.find(self.add(b))
+        if ra == rb:
+            return ra
+        if self.size[ra] < self.size[rb]:
+            ra, rb = rb, ra
+        self.parent[rb] = ra
+        self.size[ra] += self.size[rb]
+        return ra
+
+    def components(self):
+        """Yields lists of keys, one per set."""
+        members = {}
+        for i, key in enumerate(self.keys):
+            members.setdefault(self.find(i), []).append(key)
+        return members.values()
+
+# --- Group numbers ---
+# Group numbers (G###-YYYYMMDD) come from one counter row per day. Reserving bumps the row
+# with a single upsert, so there is no scan of case_groups and two transactions can never
+# receive the same number; the unique index is the backstop. The seed INSERT lifts each
+# day's counter to the highest number already in case_groups (idempotent).
+SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS group_number_counters (
+        day DATE PRIMARY KEY,
+        last_value INTEGER NOT NULL
+    );
+    INSERT INTO group_number_counters (day, last_value)
+    SELECT TO_DATE(SPLIT_PART(group_number, '-', 2), 'YYYYMMDD'),
+           MAX(SUBSTRING(SPLIT_PART(group_number, '-', 1) FROM 2)::INTEGER)
+    FROM case_groups
+    WHERE group_number ~ '^G[0-9]+-[0-9]{8}$'
+    GROUP BY 1
+    ON CONFLICT (day) DO UPDATE SET last_value = GREATEST(group_number_counters.last_value, EXCLUDED.last_value);
+    CREATE UNIQUE INDEX IF NOT EXISTS uq_case_groups_group_number ON case_groups (group_number);
+"""
+
+def format_group_number(day, seq):
+    return f"G{seq:03d}-{day.strftime('%Y%m%d')}"
+
+def reserve_group_numbers(cursor, count=1, day=None):
+    """
+    Reserves `count` consecutive group numbers for `day` (default today) on the caller's
+    transaction and returns them in order. The day's counter row stays locked until the
+    caller commits, so keep the transaction short after reserving.
+    """
+    if count < 1:
+        return []
+    day = day or datetime.date.today()
+    cursor.execute("""
+        INSERT INTO group_number_counters (day, last_value) VALUES (%s, %s)
+        ON CONFLICT (day) DO UPDATE SET last_value = group_number_counters.last_value + EXCLUDED.last_value
+        RETURNING last_value
+    """, (day, count))
+    row = cursor.fetchone()
+    last_value = row['last_value'] if isinstance(row, dict) else row[0]
+    return [format_group_number(day, seq) for seq in range(last_value - count + 1, last_value + 1)]
+
+STRESS_TEST_DAY = datetime.date(1900, 1, 1)  # counter row used only by the stress check
+
+def run_allocation_stress(threads=8, reservations=200, batch_size=1, day=STRESS_TEST_DAY):
+    """
+    Concurrency check for the allocator: `threads` workers each make `reservations`
+    committed reservations of `batch_size` numbers on their own pooled connection.
+    The counter row for `day` is removed afterwards. Returns (numbers issued, duplicates, elapsed).
+    """
+    def worker(_):
+        issued = []
+        with get_db_conn() as conn:
+            cursor = conn.cursor()
+            for _ in range(reservations):
+                issued.extend(reserve_group_numbers(cursor, batch_size, day))
+                conn.commit()
+            cursor.close()
+        return issued
+
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            numbers = [number for issued in executor.map(worker, range(threads)) for number in issued]
+    finally:
+        with get_db_conn() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM group_number_counters WHERE day = %s", (day,))
+            conn.commit()
+            cursor.close()
+    return len(numbers), len(numbers) - len(set(numbers)), time.perf_counter() - started
+
+# --- Group rows ---
+def _group_name(group_number, evidence_type=None, evidence_value=None):
+    if evidence_type:
+        return f"กลุ่มคดีเชื่อมโยงโดย '{evidence_type}: {evidence_value}'"
+    return f"กลุ่มคดี #{group_number}"
+
+def create_group(cursor, evidence_type=None, evidence_value=None):
+    """Inserts a new case group with a freshly reserved number and returns its id."""
+    new_group_number = reserve_group_numbers(cursor, 1)[0]
+    new_group_id = str(uuid.uuid4())
+    cursor.execute(
+        "INSERT INTO case_groups (id, group_number, group_name, created_timestamp) VALUES (%s, %s, %s, %s)",
+        (new_group_id, new_group_number, _group_name(new_group_number, evidence_type, evidence_value), datetime.datetime.now())
+    )
+    return new_group_id
+
+def create_groups(cursor, evidence_keys, page_size=1000):
+    """
+    Bulk version of create_group: one number reservation and multi-row INSERTs for all
+    groups. `evidence_keys` holds one (evidence_type, evidence_value) per group, either may
+    be None. Returns the new group ids in the same order.
+    """
+    numbers = reserve_group_numbers(cursor, len(evidence_keys))
+    now = datetime.datetime.now()
+    rows = [
+        (str(uuid.uuid4()), number, _group_name(number, *key), now)
+        for number, key in zip(numbers, evidence_keys)
+    ]
+    if rows:
+        execute_values(cursor, """
+            INSERT INTO case_groups (id, group_number, group_name, created_timestamp) VALUES %s
+        """, rows, page_size=page_size)
+    return [row[0] for row in rows]
+
+def _retire_groups(cursor, merge_map):
+    """Moves cases and suggestions of merged groups to their survivor, then deletes the merged groups."""
+    if not merge_map:
+        return
+    rows = list(merge_map.items())
+    execute_values(cursor, """
+        UPDATE cases c SET group_id = m.survivor_id
+        FROM (VALUES %s) AS m (group_id, survivor_id)
+        WHERE c.group_id = m.group_id
+    """, rows)
+    execute_values(cursor, """
+        UPDATE case_group_suggestions s SET suggested_group_id = m.survivor_id
+        FROM (VALUES %s) AS m (group_id, survivor_id)
+        WHERE s.suggested_group_id = m.group_id
+    """, rows)
+    group_summary_service.drop_groups(cursor, merge_map)
+    cursor.execute("DELETE FROM case_groups WHERE id = ANY(%s)", (list(merge_map),))
+
+def merge_groups(cursor, group_ids):
+    """
+    Merges the given groups into the oldest one, inside the caller's transaction (RealDictCursor).
+    Summaries are folded together, so the survivor needs no recompute.
+    Group rows are locked in a fixed order so concurrent merges can't deadlock. The caller
+    resolves `group_ids` from cases it has already locked, so none can be retired meanwhile.
+    Returns the surviving group id (None if no groups were given).
+    """
+    group_ids = sorted(set(group_ids))
+    if not group_ids:
+        return None
+    cursor.execute("SELECT id FROM case_groups WHERE id = ANY(%s) ORDER BY id FOR UPDATE", (group_ids,))
+    cursor.execute(
+        "SELECT id FROM case_groups WHERE id = ANY(%s) ORDER BY created_timestamp, id",
+        (group_ids,)
+    )
+    ordered = [row['id'] for row in cursor.fetchall()]
+    if not ordered:
+        return None
+    survivor_id = ordered[0]
+    group_summary_service.merge_into(cursor, survivor_id, ordered[1:])
+    _retire_groups(cursor, {group_id: survivor_id for group_id in ordered[1:]})
+    return survivor_id
+
+# --- Full regroup ---
+def _copy_rows(cursor, table, rows):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(row))
+        buffer.write('\n')
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} FROM STDIN", buffer)
+
+def regroup_all(conn, fetch_size=50_000):
+    """
+    Recomputes every case group from scratch with a union-find over the evidence graph
+    (open cases sharing a normalized evidence key) plus existing group memberships.
+    Overlapping groups are merged into their oldest member group, linked ungrouped cases
+    get new groups, and every changed group gets one summary job. Runs in one transaction.
+    Returns a dict of counts and elapsed seconds.
+    """
+    started = time.perf_counter()
+    uf = UnionFind()
+    component_key = {}
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", (REGROUP_LOCK_KEY,))
+
+        # 1. Evidence edges: rows arrive sorted by key, so each key's cases are contiguous
+        evidence = conn.cursor(name='regroup_evidence')
+        evidence.itersize = fetch_size
+        evidence.execute(f"""
+            SELECT se.evidence_type, se.normalized_value, se.case_id
+            FROM structured_evidence se
+            JOIN cases c ON se.case_id = c.id
+            WHERE {OPEN_CASE_FILTER} AND se.normalized_value <> ''
+            ORDER BY se.evidence_type, se.normalized_value
+        """)
+        evidence_rows = 0
+        previous_key, first_case = None, None
+        for evidence_type, normalized_value, linked_case_id in evidence:
+            evidence_rows += 1
+            key = (evidence_type, normalized_value)
+            if key != previous_key:
+                previous_key, first_case = key, linked_case_id
+                continue
+            if linked_case_id != first_case:
+                uf.union(first_case, linked_case_id)
+                component_key.setdefault(first_case, key)
+        evidence.close()
+
+        # 2. Membership edges: cases already in the same group stay together
+        members = conn.cursor(name='regroup_members')
+        members.itersize = fetch_size
+        members.execute("SELECT id, group_id FROM cases WHERE group_id IS NOT NULL")
+        case_group = {}
+        group_anchor = {}
+        for member_case_id, group_id in members:
+            case_group[member_case_id] = group_id
+            anchor = group_anchor.setdefault(group_id, member_case_id)
+            uf.union(anchor, member_case_id)
+        members.close()
+
+        cursor.execute("SELECT id, created_timestamp FROM case_groups")
+        group_age = {row['id']: (row['created_timestamp'] or datetime.datetime.min, row['id']) for row in cursor.fetchall()}
+
+        # 3. One surviving group per component; components without a group get new ones in bulk
+        assignments, merge_map, changed_groups = [], {}, set()
+        new_components = []
+        for component in uf.components():
+            if len(component) < 2:
+                continue
+            groups = {case_group[c] for c in component if c in case_group and case_group[c] in group_age}
+            if not groups:
+                new_components.append(component)
+                continue
+            survivor_id = min(groups, key=group_age.get)
+            for group_id in groups - {survivor_id}:
+                merge_map[group_id] = survivor_id
+                changed_groups.add(survivor_id)
+            for member_case_id in component:
+                if case_group.get(member_case_id) != survivor_id:
+                    assignments.append((member_case_id, survivor_id))
+                    changed_groups.add(survivor_id)
+
+        new_group_ids = create_groups(cursor, [
+            next((component_key[c] for c in component if c in component_key), (None, None))
+            for component in new_components
+        ])
+        for component, group_id in zip(new_components, new_group_ids):
+            assignments.extend((member_case_id, group_id) for member_case_id in component)
+            changed_groups.add(group_id)
+
+        # 4. Write: bulk-load assignments, apply them with one UPDATE, retire merged groups
+        cursor.execute("CREATE TEMP TABLE regroup_assignments (case_id TEXT, group_id TEXT) ON COMMIT DROP")
+        for i in range(0, len(assignments), fetch_size):
+            _copy_rows(cursor, 'regroup_assignments', assignments[i:i + fetch_size])
+        cursor.execute("""
+            UPDATE cases c SET group_id = a.group_id
+            FROM regroup_assignments a
+            WHERE c.id = a.case_id
+        """)
+        _retire_groups(cursor, merge_map)
+        job_queue.enqueue_many(cursor, job_queue.GROUP_SUMMARY, changed_groups)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    return {
+        "evidence_rows": evidence_rows,
+        "cases_moved": len(assignments),
+        "groups_created": len(new_group_ids),
+        "groups_merged": len(merge_map),
+        "groups_changed": len(changed_groups),
+        "elapsed": time.perf_counter() - started,
+    }
@@ -0,0 +1,308 @@
+# app/services/import_service.py
+#
+# Bulk import of historical cases (`flask import-cases`). Input is streamed, never read
+# whole:
+#
+#   JSONL  one /rank_case payload per line:
+#          {"case_details": {...}, "complainant": {...}, "officers": [...],
+#           "suspects": [...], "structured_evidence": [...]}
+#   CSV    one case per row; case fields by name, complainant_<field>, suspect_<field>
+#          (one suspect) and evidence_<TYPE> columns holding '|'-separated values,
+#          e.g. evidence_BANK_ACCOUNT, evidence_PHONE_NUMBER
+#
+# Optional case_details.timestamp (ISO 8601) and status keep the original report date and
+# state; closed cases ('ปิดคดี') get date_closed from case_details.date_closed or, failing
+# that, the timestamp. Each batch is validated with the same rules as the intake API,
+# scored with one vectorized predict call, COPYed into temp staging tables typed like the
+# real ones, moved into place with INSERT ... SELECT and committed together with its
+# linking and suggestion jobs. Rejected rows go to an error file (JSONL: line, error, record).
+
+import csv
+import datetime
+import io
+import json
+import time
+import psycopg2
+from app.services import ml_service, intake_service, job_queue
+
+CASE_COLUMNS = (
+    'id', 'case_number', 'case_name', 'timestamp', 'last_updated', 'date_closed', 'status', 'priority_score',
+    'case_type', 'description', 'estimated_financial_damage', 'num_victims',
+    'reputational_damage_level', 'sensitive_data_compromised', 'ongoing_threat',
+    'risk_of_evidence_loss', 'technical_complexity_level', 'initial_evidence_clarity',
+    'complainant_id', 'group_id', 'suspests',
+)
+COMPLAINANT_COLUMNS = ('id', 'first_name', 'last_name', 'phone_number', 'email', 'address', 'province', 'district', 'subdistrict', 'zipcode')
+OFFICER_COLUMNS = ('id', 'first_name', 'last_name', 'phone_number', 'email')
+CASE_OFFICER_COLUMNS = ('case_id', 'officer_id')
+SUSPECT_COLUMNS = (
+    'id', 'first_name', 'last_name', 'national_id', 'account', 'phone_number', 'email', 'address',
+    'province', 'district', 'subdistrict', 'zipcode', 'created_at', 'updated_at', 'case_number',
+)
+EVIDENCE_COLUMNS = ('id', 'case_id', 'case_number', 'evidence_type', 'evidence_value', 'normalized_value', 'created_timestamp')
+
+# staging table -> (target table, columns)
+STAGING_TABLES = {
+    'import_complainants': ('complainants', COMPLAINANT_COLUMNS),
+    'import_cases': ('cases', CASE_COLUMNS),
+    'import_officers': ('officers', OFFICER_COLUMNS),
+    'import_case_officers': ('case_officers', CASE_OFFICER_COLUMNS),
+    'import_suspects': ('suspests', SUSPECT_COLUMNS),
+    'import_evidence': ('structured_evidence', EVIDENCE_COLUMNS),
+}
+
+TRUE_STRINGS = {'1', 'true', 't', 'yes', 'y'}
+
+# --- Reading ---
+def _csv_payload(record):
+    case_details, complainant, suspect, evidence = {}, {}, {}, []
+    for key, value in record.items():
+        if key is None or value is None or value.strip() == '':
+            continue
+        value = value.strip()
+        if key.startswith('complainant_'):
+            complainant[key[len('complainant_'):]] = value
+        elif key.startswith('suspect_'):
+            suspect[key[len('suspect_'):]] = value
+        elif key.startswith('evidence_'):
+            evidence_type = key[len('evidence_'):].upper()
+            evidence.extend(
+                {'evidence_type': evidence_type, 'evidence_value': part.strip()}
+                for part in value.split('|') if part.strip()
+            )
+        elif key in ml_service.BINARY_FEATURES:
+            case_details[key] = value.lower() in TRUE_STRINGS
+        elif key in ml_service.NUMERICAL_FEATURES and value.lstrip('-').isdigit():
+            case_details[key] = int(value)  # anything else is left for validation to reject
+        else:
+            case_details[key] = value
+    return {
+        'case_details': case_details,
+        'complainant': complainant,
+        'suspects': [suspect] if suspect else [],
+        'structured_evidence': evidence,
+    }
+
+def iter_records(stream, fmt):
+    """Yields (line number, payload or None, error or None, raw record) without loading the file."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, _csv_payload(record), None, record
+    else:
+        for line_no, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield line_no, json.loads(line), None, None
+            except json.JSONDecodeError as e:
+                yield line_no, None, f"Invalid JSON: {e}", line.rstrip('\n')
+
+# --- Validation ---
+def _parse_timestamp(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    return datetime.datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+
+def prepare_record(payload, current_time):
+    """intake_service.prepare_case plus the checks a historical import needs."""
+    details = payload.get('case_details') if isinstance(payload, dict) else None
+    if not isinstance(details, dict) or not str(details.get('case_number') or '').strip():
+        raise ValueError("case_details.case_number is required.")
+    for ev in payload.get('structured_evidence') or []:
+        if not isinstance(ev, dict) or not ev.get('evidence_type') or not ev.get('evidence_value'):
+            raise ValueError("Every structured_evidence item needs evidence_type and evidence_value.")
+    for field in ('estimated_financial_damage', 'num_victims'):
+        if field in details:
+            try:
+                if int(details[field]) < 0:
+                    raise ValueError
+            except (TypeError, ValueError):
+                raise ValueError(f"{field} must be a non-negative integer.")
+
+    prepared = intake_service.prepare_case(payload, current_time)
+    if details.get('timestamp'):
+        try:
+            reported = _parse_timestamp(details['timestamp'])
+        except ValueError:
+            raise ValueError(f"Invalid timestamp {details['timestamp']!r} (expected ISO 8601).")
+        prepared['timestamp'] = reported
+        prepared['case_row'][3] = reported
+        prepared['case_row'][4] = reported
+    if details.get('status'):
+        prepared['case_row'][6] = details['status']
+        if details['status'] == 'ปิดคดี':
+            # ปิดคดีแล้ว: ใช้ date_closed ที่ส่งมา หรือวันที่รับแจ้ง เหมือนคดีที่ปิดผ่าน API
+            try:
+                closed = _parse_timestamp(details['date_closed']) if details.get('date_closed') else prepared['case_row'][3]
+            except ValueError:
+                raise ValueError(f"Invalid date_closed {details['date_closed']!r} (expected ISO 8601).")
+            prepared['case_row'][5] = closed
+    return prepared
+
+# --- Loading ---
+def _copy_value(value):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+def _copy(cursor, table, columns, rows):
+    if not rows:
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([_copy_value(value) for value in row])
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+def _load_batch(conn, batch):
+    """
+    Loads one batch of (line, prepared) in a single transaction. Cases whose case_number
+    already exists are skipped. Returns (inserted case ids, duplicate lines).
+    """
+    cursor = conn.cursor()
+    for staging, (target, _) in STAGING_TABLES.items():
+        cursor.execute(f"CREATE TEMP TABLE {staging} (LIKE {target} INCLUDING DEFAULTS) ON COMMIT DROP")
+    cursor.execute("ALTER TABLE import_cases ADD COLUMN _line BIGINT")
+
+    _copy(cursor, 'import_complainants', COMPLAINANT_COLUMNS, [p['complainant_row'] for _, p in batch])
+    _copy(cursor, 'import_cases', CASE_COLUMNS + ('_line',), [tuple(p['case_row']) + (line,) for line, p in batch])
+    _copy(cursor, 'import_officers', OFFICER_COLUMNS, [row for _, p in batch for row in p['officer_rows']])
+    _copy(cursor, 'import_case_officers', CASE_OFFICER_COLUMNS, [row for _, p in batch for row in p['case_officer_rows']])
+    _copy(cursor, 'import_suspects', SUSPECT_COLUMNS, [row for _, p in batch for row in p['suspect_rows']])
+    _copy(cursor, 'import_evidence', EVIDENCE_COLUMNS, [row for _, p in batch for row in p['evidence_rows']])
+
+    # รายงานที่เคยนำเข้าแล้ว (case_number ซ้ำ) ไม่นำเข้าซ้ำ
+    cursor.execute("""
+        DELETE FROM import_cases s USING cases c
+        WHERE c.case_number = s.case_number
+        RETURNING s._line
+    """)
+    duplicate_lines = [row[0] for row in cursor.fetchall()]
+
+    columns = ', '.join(COMPLAINANT_COLUMNS)
+    cursor.execute(f"""
+        INSERT INTO complainants ({columns})
+        SELECT {columns} FROM import_complainants
+        WHERE id IN (SELECT complainant_id FROM import_cases)
+    """)
+    columns = ', '.join(CASE_COLUMNS)
+    cursor.execute(f"INSERT INTO cases ({columns}) SELECT {columns} FROM import_cases RETURNING id")
+    case_ids = [row[0] for row in cursor.fetchall()]
+    columns = ', '.join(OFFICER_COLUMNS)
+    cursor.execute(f"""
+        INSERT INTO officers ({columns})
+        SELECT DISTINCT ON (o.id) {', '.join('o.' + c for c in OFFICER_COLUMNS)}
+        FROM import_officers o
+        JOIN import_case_officers co ON co.officer_id = o.id
+        JOIN import_cases s ON s.id = co.case_id
+        ON CONFLICT (id) DO NOTHING
+    """)
+    cursor.execute("""
+        INSERT INTO case_officers (case_id, officer_id)
+        SELECT co.case_id, co.officer_id FROM import_case_officers co JOIN import_cases s ON s.id = co.case_id
+    """)
+    for staging, target, target_columns in (
+        ('import_suspects', 'suspests', SUSPECT_COLUMNS),
+        ('import_evidence', 'structured_evidence', EVIDENCE_COLUMNS),
+    ):
+        columns = ', '.join(target_columns)
+        cursor.execute(f"""
+            INSERT INTO {target} ({columns})
+            SELECT {columns} FROM {staging}
+            WHERE case_number IN (SELECT case_number FROM import_cases)
+        """)
+
+    # Rollup counters for the whole batch in one statement (same rows stats_service.apply_delta keeps)
+    cursor.execute("""
+        INSERT INTO case_daily_stats (day, case_type, status, case_count)
+        SELECT timestamp::date, COALESCE(case_type, ''), COALESCE(status, ''), COUNT(*)
+        FROM import_cases GROUP BY 1, 2, 3
+        ON CONFLICT (day, case_type, status)
+        DO UPDATE SET case_count = case_daily_stats.case_count + EXCLUDED.case_count
+    """)
+
+    with_evidence = {p['case_id'] for _, p in batch if p['evidence_rows']}
+    job_queue.enqueue_many(cursor, job_queue.LINK_CASE, [case_id for case_id in case_ids if case_id in with_evidence])
+    job_queue.enqueue_many(cursor, job_queue.SUGGEST_GROUPS, case_ids)
+    conn.commit()
+    cursor.close()
+    return case_ids, duplicate_lines
+
+def _load_with_bisect(conn, batch, reject):
+    """
+    Loads a batch; if the database rejects its data (a value the staging types refuse, a
+    constraint violation), splits it in halves until the offending rows are isolated, so one
+    bad row costs O(log n) retries instead of the whole batch. Any other database error
+    (connection loss, lock timeout, missing table) fails the whole import. Returns the
+    number of cases inserted.
+    """
+    try:
+        case_ids, duplicate_lines = _load_batch(conn, batch)
+    except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+        conn.rollback()
+        if len(batch) == 1:
+            reject(batch[0][0], f"Rejected by the database: {(e.pgerror or str(e)).strip()}")
+            return 0
+        middle = len(batch) // 2
+        return _load_with_bisect(conn, batch[:middle], reject) + _load_with_bisect(conn, batch[middle:], reject)
+    for line in duplicate_lines:
+        reject(line, "case_number already exists.")
+    return len(case_ids)
+
+# --- Driver ---
+def run_import(conn, stream, fmt, pipeline, forest=None, batch_size=10_000, errors=None, progress=None):
+    """
+    Imports every record from `stream`. `errors` is a text file that receives one JSON line
+    per rejected record; `progress(stats)` is called after each batch. Returns the final stats.
+    """
+    started = time.perf_counter()
+    stats = {"read": 0, "imported": 0, "rejected": 0, "elapsed": 0.0, "rows_per_sec": 0.0}
+    raw_by_line = {}
+    seen_numbers = set()
+
+    def reject(line, message, raw=None):
+        stats["rejected"] += 1
+        if errors is not None:
+            record = raw if raw is not None else raw_by_line.get(line)
+            errors.write(json.dumps({"line": line, "error": message, "record": record}, ensure_ascii=False, default=str) + '\n')
+
+    def flush(batch):
+        if batch:
+            intake_service.score_prepared_cases(pipeline, [p for _, p in batch], forest=forest)
+            stats["imported"] += _load_with_bisect(conn, batch, reject)
+        raw_by_line.clear()
+        stats["elapsed"] = round(time.perf_counter() - started, 2)
+        stats["rows_per_sec"] = round(stats["read"] / stats["elapsed"], 1) if stats["elapsed"] else 0.0
+        if progress is not None:
+            progress(dict(stats))
+
+    batch = []
+    current_time = datetime.datetime.now()
+    for line, payload, error, raw in iter_records(stream, fmt):
+        stats["read"] += 1
+        if error is not None:
+            reject(line, error, raw)
+            continue
+        try:
+            prepared = prepare_record(payload, current_time)
+        except ValueError as e:
+            reject(line, str(e), raw if raw is not None else payload)
+            continue
+        if prepared['case_number'] in seen_numbers:
+            reject(line, "Duplicate case_number within the import file.", raw if raw is not None else payload)
+            continue
+        seen_numbers.add(prepared['case_number'])
+        raw_by_line[line] = raw if raw is not None else payload
+        batch.append((line, prepared))
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+            current_time = datetime.datetime.now()
+    flush(batch)
+    return stats
@@ -0,0 +1,174 @@
+# app/services/intake_service.py
+
+from collections import Counter
+from psycopg2.extras import execute_values
+import uuid
+from app.services import ml_service, stats_service
+from app.services.linking_service import normalize_text
+
+INITIAL_STATUS = 'รับเรื่อง'
+CASE_PRIORITY_INDEX = 7  # position of priority_score in the cases row tuple
+
+# --- Validation / row building ---
+def prepare_case(item, current_time):
+    """
+    Validates one intake payload ({case_details, complainant, officers, suspects,
+    structured_evidence}) and builds its feature dict plus every row it will insert.
+    Raises ValueError with a client-facing message if the payload is unusable.
+    """
+    if not isinstance(item, dict) or 'case_details' not in item or 'complainant' not in item:
+        raise ValueError("Invalid data format.")
+
+    case_details = item['case_details']
+    complainant_data = item['complainant']
+    officers_data = item.get('officers', [])
+    suspects_data = item.get('suspects', [])
+    structured_evidence_data = item.get('structured_evidence', [])
+
+    try:
+        case_id = str(uuid.uuid4())
+        complainant_id = str(uuid.uuid4())
+        case_number = case_details.get('case_number')
+        features = ml_service.derive_case_features(case_details, structured_evidence_data)
+
+        complainant_row = (
+            complainant_id,
+            complainant_data.get('first_name'),
+            complainant_data.get('last_name'),
+            complainant_data.get('phone_number'),
+            complainant_data.get('email'),
+            complainant_data.get('address'),
+            complainant_data.get('province'),
+            complainant_data.get('district'),
+            complainant_data.get('subdistrict'),
+            complainant_data.get('zipcode')
+        )
+        case_row = [
+            case_id,
+            case_number,
+            case_details.get('case_name'),
+            current_time,               # timestamp
+            current_time,               # last_updated
+            None,                       # date_closed (ยังไม่ปิดคดี)
+            INITIAL_STATUS,             # status
+            None,                       # priority_score, filled in after scoring
+            case_details.get('case_type'),
+            case_details.get('description'),
+            int(case_details.get('estimated_financial_damage', 0)),
+            int(case_details.get('num_victims', 0)),
+            case_details.get('reputational_damage_level'),
+            bool(features.get('sensitive_data_compromised', 0)),
+            bool(features.get('ongoing_threat', 0)),
+            bool(features.get('risk_of_evidence_loss', 0)),
+            case_details.get('technical_complexity_level'),
+            case_details.get('initial_evidence_clarity'),
+            complainant_id,
+            None,                       # group_id
+            None                        # suspests
+        ]
+
+        officer_rows, case_officer_rows = [], []
+        for officer in officers_data:
+            officer_id = officer.get('id', str(uuid.uuid4()))
+            officer_rows.append((officer_id, officer['first_name'], officer['last_name'], officer['phone_number'], officer.get('email')))
+            case_officer_rows.append((case_id, officer_id))
+
+        suspect_rows = [(
+            str(uuid.uuid4()),
+            suspect.get('first_name'),
+            suspect.get('last_name'),
+            suspect.get('national_id'),
+            suspect.get('account'),
+            suspect.get('phone_number'),
+            suspect.get('email'),
+            suspect.get('address'),
+            suspect.get('province'),
+            suspect.get('district'),
+            suspect.get('subdistrict'),
+            suspect.get('zipcode'),
+            current_time,
+            current_time,
+            case_number
+        ) for suspect in suspects_data]
+
+        evidence_rows = [(
+            str(uuid.uuid4()), case_id, case_number, ev.get('evidence_type'), ev.get('evidence_value'),
+            normalize_text(ev.get('evidence_value')), current_time
+        ) for ev in structured_evidence_data]
+    except (KeyError, TypeError, ValueError, AttributeError) as e:
+        raise ValueError(f"Invalid field value: {e}")
+
+    return {
+        "case_id": case_id,
+        "case_number": case_number,
+        "case_type": case_details.get('case_type'),
+        "timestamp": current_time,
+        "features": features,
+        "complainant_row": complainant_row,
+        "case_row": case_row,
+        "officer_rows": officer_rows,
+        "case_officer_rows": case_officer_rows,
+        "suspect_rows": suspect_rows,
+        "evidence_rows": evidence_rows,
+    }
+
+def score_prepared_cases(pipeline, prepared, forest=None):
+    """Scores every prepared case with one predict call and stores the score on its row."""
+    scores = ml_service.predict_priority(pipeline, [p['features'] for p in prepared], forest=forest)
+    for p, score in zip(prepared, scores):
+        p['priority_score'] = score
+        p['case_row'][CASE_PRIORITY_INDEX] = score
+    return scores
+
+# --- Bulk insert ---
+def insert_prepared_cases(cursor, prepared, page_size=500):
+    """
+    Writes all rows for the prepared cases with multi-row INSERTs on the caller's cursor
+    (one statement per table per `page_size` rows). The caller owns the transaction.
+    """
+    if not prepared:
+        return
+
+    execute_values(cursor, """
+        INSERT INTO complainants (
+            id, first_name, last_name, phone_number, email, address, province, district, subdistrict, zipcode
+        ) VALUES %s
+    """, [p['complainant_row'] for p in prepared], page_size=page_size)
+
+    execute_values(cursor, """
+        INSERT INTO cases (
+            id, case_number, case_name, timestamp, last_updated, date_closed, status, priority_score,
+            case_type, description, estimated_financial_damage, num_victims,
+            reputational_damage_level, sensitive_data_compromised, ongoing_threat,
+            risk_of_evidence_loss, technical_complexity_level, initial_evidence_clarity,
+            complainant_id, group_id, suspests
+        ) VALUES %s
+    """, [tuple(p['case_row']) for p in prepared], page_size=page_size)
+
+    officer_rows = [row for p in prepared for row in p['officer_rows']]
+    if officer_rows:
+        execute_values(cursor, """
+            INSERT INTO officers (id, first_name, last_name, phone_number, email) VALUES %s
+            ON CONFLICT (id) DO NOTHING
+        """, officer_rows, page_size=page_size)
+        execute_values(cursor, "INSERT INTO case_officers (case_id, officer_id) VALUES %s",
+                       [row for p in prepared for row in p['case_officer_rows']], page_size=page_size)
+
+    suspect_rows = [row for p in prepared for row in p['suspect_rows']]
+    if suspect_rows:
+        execute_values(cursor, """
+            INSERT INTO suspests (
+                id, first_name, last_name, national_id, account, phone_number, email, address, province, district, subdistrict, zipcode, created_at, updated_at, case_number
+            ) VALUES %s
+        """, suspect_rows, page_size=page_size)
+
+    evidence_rows = [row for p in prepared for row in p['evidence_rows']]
+    if evidence_rows:
+        execute_values(cursor, """
+            INSERT INTO structured_evidence (id, case_id, case_number, evidence_type, evidence_value, normalized_value, created_timestamp)
+            VALUES %s
+        """, evidence_rows, page_size=page_size)
+
+    buckets = Counter((p['timestamp'].date(), p['case_type'], INITIAL_STATUS) for p in prepared)
+    for (day, case_type, status), count in buckets.items():
+        stats_service.apply_delta(cursor, day, case_type, status, count)
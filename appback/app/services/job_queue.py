@@ -0,0 +1,285 @@
+# app/services/job_queue.py
+
+from psycopg2.extras import RealDictCursor, execute_values
+import threading
+import time
+import traceback
+from app.database import get_db_conn
+
+# --- Job types ---
+LINK_CASE = 'link_case'          # key: case id
+GROUP_SUMMARY = 'group_summary'  # key: group id
+SUGGEST_GROUPS = 'suggest_groups'  # key: case id
+TRAIN_MODEL = 'train_model'      # key: model registry directory
+GENERATE_PREVIEWS = 'generate_previews'  # key: evidence blob path
+
+DEFAULT_MAX_ATTEMPTS = 5
+HEARTBEAT_INTERVAL = 30  # seconds between heartbeats of a running job
+RUNNING_TIMEOUT = 300  # seconds without a heartbeat before a 'running' job is considered abandoned
+
+# Durable queue in Postgres. At most one *queued* job exists per (job_type, job_key), so
+# repeated requests for the same case/group collapse into one; a job that is already
+# running doesn't block a fresh one from being queued behind it.
+SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS background_jobs (
+        id BIGSERIAL PRIMARY KEY,
+        job_type TEXT NOT NULL,
+        job_key TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL DEFAULT 5,
+        run_after TIMESTAMP NOT NULL DEFAULT NOW(),
+        created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+        started_at TIMESTAMP,
+        heartbeat_at TIMESTAMP,
+        finished_at TIMESTAMP,
+        last_error TEXT
+    );
+    ALTER TABLE background_jobs ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP;
+    CREATE UNIQUE INDEX IF NOT EXISTS uq_background_jobs_queued
+        ON background_jobs (job_type, job_key) WHERE status = 'queued';
+    CREATE INDEX IF NOT EXISTS idx_background_jobs_ready
+        ON background_jobs (run_after, id) WHERE status = 'queued';
+"""
+
+def _handlers():
+    from app.services import linking_service, suggestion_service, training_service, preview_service
+    return {
+        LINK_CASE: linking_service.update_case_links,
+        GROUP_SUMMARY: linking_service.update_group_summary,
+        SUGGEST_GROUPS: suggestion_service.suggest_groups_for_case,
+        TRAIN_MODEL: training_service.run_training_job,
+        GENERATE_PREVIEWS: preview_service.generate_previews,
+    }
+
+# --- Producers ---
+def enqueue(cursor, job_type, job_key, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """Queues a job on the caller's cursor, so it commits atomically with the caller's write."""
+    enqueue_many(cursor, job_type, [job_key], max_attempts=max_attempts)
+
+def enqueue_many(cursor, job_type, job_keys, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    keys = list(dict.fromkeys(str(key) for key in job_keys if key))
+    if not keys:
+        return
+    execute_values(cursor, """
+        INSERT INTO background_jobs (job_type, job_key, max_attempts) VALUES %s
+        ON CONFLICT (job_type, job_key) WHERE status = 'queued' DO NOTHING
+    """, [(job_type, key, max_attempts) for key in keys])
+
+# --- Consumers ---
+def claim_jobs(conn, limit=10):
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    cursor.execute("""
+        UPDATE background_jobs SET status = 'running', started_at = NOW(), heartbeat_at = NOW(), attempts = attempts + 1
+        WHERE id IN (
+            SELECT id FROM background_jobs
+            WHERE status = 'queued' AND run_after <= NOW()
+            ORDER BY run_after, id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, job_type, job_key, attempts, max_attempts
+    """, (limit,))
+    jobs = cursor.fetchall()
+    conn.commit()
+    cursor.close()
+    return jobs
+
+def _finish(conn, job, error=None):
+    cursor = conn.cursor()
+    try:
+        if error is None:
+            cursor.execute(
+                "UPDATE background_jobs SET status = 'done', finished_at = NOW(), last_error = NULL WHERE id = %s",
+                (job['id'],)
+            )
+        elif job['attempts'] >= job['max_attempts']:
+            cursor.execute(
+                "UPDATE background_jobs SET status = 'failed', finished_at = NOW(), last_error = %s WHERE id = %s",
+                (error, job['id'])
+            )
+        else:
+            # Exponential backoff: 2, 4, 8, ... seconds (capped at 5 minutes)
+            delay = min(2 ** job['attempts'], 300)
+            cursor.execute("""
+                UPDATE background_jobs
+                SET status = 'queued', run_after = NOW() + %s * INTERVAL '1 second', last_error = %s
+                WHERE id = %s
+                  AND NOT EXISTS (
+                      SELECT 1 FROM background_jobs
+                      WHERE job_type = %s AND job_key = %s AND status = 'queued'
+                  )
+            """, (delay, error, job['id'], job['job_type'], job['job_key']))
+            if cursor.rowcount == 0:
+                # A newer queued job for the same key will redo this work.
+                cursor.execute(
+                    "UPDATE background_jobs SET status = 'superseded', finished_at = NOW(), last_error = %s WHERE id = %s",
+                    (error, job['id'])
+                )
+        conn.commit()
+    finally:
+        cursor.close()
+
+def requeue_stale_jobs(conn, timeout=RUNNING_TIMEOUT):
+    """
+    Puts 'running' jobs abandoned by a crashed worker back on the queue. A live worker
+    heartbeats its job every HEARTBEAT_INTERVAL, however long the job runs (training can
+    take an hour), so only jobs whose heartbeat has stopped are reaped.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE background_jobs j SET status = 'queued', run_after = NOW(), last_error = 'worker timed out'
+        WHERE j.status = 'running' AND COALESCE(j.heartbeat_at, j.started_at) < NOW() - %s * INTERVAL '1 second'
+          AND NOT EXISTS (
+              SELECT 1 FROM background_jobs q
+              WHERE q.job_type = j.job_type AND q.job_key = j.job_key AND q.status = 'queued'
+          )
+    """, (timeout,))
+    requeued = cursor.rowcount
+    conn.commit()
+    cursor.close()
+    return requeued
+
+def retry_failed_jobs(conn):
+    """Moves failed jobs back to the queue with a fresh attempt budget."""
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE background_jobs f SET status = 'queued', attempts = 0, run_after = NOW(), finished_at = NULL
+        WHERE f.status = 'failed'
+          AND NOT EXISTS (
+              SELECT 1 FROM background_jobs q
+              WHERE q.job_type = f.job_type AND q.job_key = f.job_key AND q.status = 'queued'
+          )
+    """)
+    requeued = cursor.rowcount
+    conn.commit()
+    cursor.close()
+    return requeued
+
+class _Heartbeat:
+    """Keeps a running job's heartbeat_at fresh from a side thread while its handler runs."""
+
+    def __init__(self, job_id, interval=HEARTBEAT_INTERVAL):
+        self.job_id = job_id
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._beat, name=f"job-heartbeat-{job_id}", daemon=True)
+
+    def _beat(self):
+        while not self._stop.wait(self.interval):
+            try:
+                with get_db_conn() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute(
+                        "UPDATE background_jobs SET heartbeat_at = NOW() WHERE id = %s AND status = 'running'",
+                        (self.job_id,)
+                    )
+                    conn.commit()
+                    cursor.close()
+            except Exception as e:
+                print(f"Heartbeat for job {self.job_id} failed: {e}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+def _run_job(handlers, job):
+    error = None
+    try:
+        handler = handlers.get(job['job_type'])
+        if handler is None:
+            raise ValueError(f"Unknown job type {job['job_type']}")
+        # Handlers borrow their own pooled connections.
+        with _Heartbeat(job['id']):
+            handler(job['job_key'])
+    except Exception as e:
+        error = f"{e}\n{traceback.format_exc()}"
+        print(f"Job {job['id']} ({job['job_type']} {job['job_key']}) failed: {e}")
+    with get_db_conn() as conn:
+        _finish(conn, job, error)
+
+def run_once(batch_size=10):
+    """
+    Processes up to `batch_size` ready jobs. Returns how many were processed. Jobs are
+    claimed one at a time, just before each runs, so a job never sits 'running' (and
+    reapable) behind slow jobs claimed in the same batch.
+    """
+    handlers = _handlers()
+    processed = 0
+    while processed < batch_size:
+        with get_db_conn() as conn:
+            jobs = claim_jobs(conn, limit=1)
+        if not jobs:
+            break
+        _run_job(handlers, jobs[0])
+        processed += 1
+    return processed
+
+# --- Worker pool ---
+class WorkerPool:
+    """Background threads that poll the queue; safe to run in many processes (SKIP LOCKED)."""
+
+    def __init__(self, threads=2, batch_size=10, poll_interval=1.0):
+        self.threads = threads
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._workers = []
+
+    def _loop(self, index):
+        last_reap = 0.0
+        while not self._stop.is_set():
+            try:
+                if index == 0 and time.monotonic() - last_reap > RUNNING_TIMEOUT / 2:
+                    with get_db_conn() as conn:
+                        requeue_stale_jobs(conn)
+                    last_reap = time.monotonic()
+                if run_once(self.batch_size) == 0:
+                    self._stop.wait(self.poll_interval)
+            except Exception as e:
+                print(f"Job worker error: {e}")
+                self._stop.wait(self.poll_interval * 5)
+
+    def start(self):
+        for index in range(self.threads):
+            worker = threading.Thread(target=self._loop, args=(index,), name=f"job-worker-{index}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        for worker in self._workers:
+            worker.join(timeout)
+
+# --- Metrics ---
+def queue_stats(conn):
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    cursor.execute("""
+        SELECT
+            COUNT(*) FILTER (WHERE status = 'queued') AS queued,
+            COUNT(*) FILTER (WHERE status = 'queued' AND run_after <= NOW()) AS ready,
+            COUNT(*) FILTER (WHERE status = 'running') AS running,
+            COUNT(*) FILTER (WHERE status = 'failed') AS failed,
+            -- jobs backed off into the future aren't late yet, so they don't count towards lag
+            COALESCE(EXTRACT(EPOCH FROM NOW() - MIN(created_at) FILTER (
+                WHERE status = 'queued' AND run_after <= NOW()
+            )), 0) AS lag_seconds
+        FROM background_jobs
+        WHERE status IN ('queued', 'running', 'failed')
+    """)
+    stats = dict(cursor.fetchone())
+    cursor.execute("""
+        SELECT job_type, COUNT(*) AS queued
+        FROM background_jobs WHERE status = 'queued'
+        GROUP BY job_type
+    """)
+    stats['queued_by_type'] = {row['job_type']: row['queued'] for row in cursor.fetchall()}
+    stats['lag_seconds'] = float(stats['lag_seconds'])
+    cursor.close()
+    return stats
@@ -1,175 +1,161 @@
 # app/services/linking_service.py
 
-import psycopg2
-from psycopg2.extras import RealDictCursor
-import uuid
-import datetime
+from psycopg2.extras import RealDictCursor, execute_values
 import re
-import os
-from collections import Counter
+from app.database import get_db_conn
+from app.services import grouping_service, group_summary_service
+
+# --- Evidence key schema ---
+# normalized_value is written by normalize_text() at insert time (and by the backfill), so
+# linking is an index probe on (evidence_type, normalized_value) instead of a table scan.
+SCHEMA_SQL = """
+    ALTER TABLE structured_evidence ADD COLUMN IF NOT EXISTS normalized_value TEXT;
+    -- Linking, summaries and exports join on case_id; fill it for rows written with only case_number
+    UPDATE structured_evidence se SET case_id = c.id
+        FROM cases c WHERE se.case_id IS NULL AND se.case_number = c.case_number;
+    CREATE INDEX IF NOT EXISTS idx_structured_evidence_type_norm
+        ON structured_evidence (evidence_type, normalized_value);
+"""
 
 # --- Helper Functions ---
-def get_db_conn():
-    """Establishes a connection to the PostgreSQL database."""
-    db_url = os.environ.get('DATABASE_URL')
-    if not db_url:
-        raise Exception("DATABASE_URL environment variable is not set.")
-    conn = psycopg2.connect(db_url)
-    return conn
-
 def normalize_text(text: str) -> str:
     """A general normalization function."""
     if not text: return ""
     text = re.sub(r'^(นาย|นาง|นางสาว|ด\.ช\.?|ด\.ญ\.?)', '', text).strip()
     return re.sub(r'[\s\-]', '', text).lower()
 
-# --- Main Service Functions ---
-def update_group_summary(group_id: str):
+def backfill_normalized_values(conn, batch_size=5000):
     """
-    Calculates and updates summary statistics for a given case group using PostgreSQL.
+    Fills structured_evidence.normalized_value for rows written before the column existed.
+    Walks the table in id order and commits per batch. Returns the number of rows updated.
     """
-    conn = get_db_conn()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
+    cursor = conn.cursor()
+    updated = 0
+    last_id = ''
     try:
-        # 1. Calculate summary data from active cases in the group
-        cursor.execute("""
-            SELECT
-                MIN(timestamp) as first_case_timestamp,
-                MAX(timestamp) as latest_case_timestamp,
-                SUM(num_victims) as total_victims,
-                SUM(estimated_financial_damage) as total_damage
-            FROM cases
-            WHERE group_id = %s AND status != 'ปิดคดี'
-        """, (group_id,))
-        summary_data = cursor.fetchone()
-
-        # 2. Find the most frequently used bank account in the group
-        cursor.execute("""
-            SELECT evidence_value FROM structured_evidence
-            WHERE case_id IN (SELECT id FROM cases WHERE group_id = %s)
-            AND evidence_type = 'BANK_ACCOUNT'
-        """, (group_id,))
-        evidence_rows = cursor.fetchall()
-
-        primary_evidence = None
-        if evidence_rows:
-            account_counts = Counter(normalize_text(row['evidence_value']) for row in evidence_rows)
-            if account_counts:
-                primary_evidence = account_counts.most_common(1)[0][0]
-
-        # 3. Update the case_groups table
-        if summary_data:
+        while True:
             cursor.execute("""
-                UPDATE case_groups SET
-                    first_case_timestamp = %s,
-                    latest_case_timestamp = %s,
-                    total_victims = %s,
-                    total_damage = %s,
-                    primary_evidence_value = %s
-                WHERE id = %s
-            """, (
-                summary_data['first_case_timestamp'],
-                summary_data['latest_case_timestamp'],
-                summary_data['total_victims'] or 0,
-                summary_data['total_damage'] or 0,
-                primary_evidence,
-                group_id
-            ))
-        
-        conn.commit()
-        print(f"✅ Group summary updated for group {group_id}.")
-    except Exception as e:
-        print(f"Error updating group summary: {e}")
-        conn.rollback()
+                SELECT id, evidence_value FROM structured_evidence
+                WHERE id > %s AND normalized_value IS NULL
+                ORDER BY id LIMIT %s
+            """, (last_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            execute_values(cursor, """
+                UPDATE structured_evidence se SET normalized_value = v.normalized_value
+                FROM (VALUES %s) AS v (id, normalized_value)
+                WHERE se.id = v.id
+            """, [(row[0], normalize_text(row[1])) for row in rows], page_size=batch_size)
+            conn.commit()
+            updated += len(rows)
+            last_id = rows[-1][0]
     finally:
         cursor.close()
-        conn.close()
+    return updated
 
-def update_case_links(case_id: str):
+# --- Main Service Functions ---
+def update_group_summary(group_id: str):
     """
-    Finds and updates links for a case, then triggers a group summary update.
-    (PostgreSQL Version)
+    Rebuilds summary statistics for a given case group from the base tables (reconciliation).
+    Day-to-day changes are applied as deltas by group_summary_service; this runs as a
+    GROUP_SUMMARY job (e.g. after a full regroup). Errors are re-raised so the worker can retry.
     """
-    conn = get_db_conn()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    with get_db_conn() as conn:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
     
-    try:
-        new_case_evidence = cursor.execute(
-            "SELECT evidence_type, evidence_value FROM structured_evidence WHERE case_id = %s", (case_id,)
-        ).fetchall()
-
-        if not new_case_evidence:
-            return
-
-        linked_case_ids = {case_id}
-        primary_evidence = None
-
-        for evidence in new_case_evidence:
-            norm_value = normalize_text(evidence['evidence_value'])
-            
-            cursor.execute("""
-                SELECT se.case_id FROM structured_evidence se
-                JOIN cases c ON se.case_id = c.id
-                WHERE se.evidence_type = %s 
-                  AND REPLACE(REPLACE(se.evidence_value, '-', ''), ' ', '') = %s
-                  AND c.status != 'ปิดคดี' 
-            """, (evidence['evidence_type'], norm_value))
-            
-            for row in cursor.fetchall():
-                if not primary_evidence:
-                    primary_evidence = evidence
-                linked_case_ids.add(row['case_id'])
-
-        if len(linked_case_ids) < 2:
-            return
-
-        cursor.execute(
-            "SELECT group_id FROM cases WHERE id = ANY(%s) AND group_id IS NOT NULL",
-            (list(linked_case_ids),)
-        )
-        existing_groups = cursor.fetchall()
+        try:
+            group_summary_service.recompute_group(cursor, group_id)
+            conn.commit()
+            print(f"✅ Group summary updated for group {group_id}.")
+        except Exception as e:
+            print(f"Error updating group summary: {e}")
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+def find_evidence_matches(cursor, evidence_rows):
+    """
+    Looks up every open case sharing any of the given evidence items, in one query.
+    Returns rows of (case_id, group_id, evidence_type, normalized_value), one per matching
+    evidence row, including the rows of the case the evidence came from.
+    """
+    keys = {
+        (evidence['evidence_type'], normalize_text(evidence['evidence_value']))
+        for evidence in evidence_rows
+    }
+    keys = [key for key in keys if key[1]]
+    if not keys:
+        return []
+    cursor.execute("""
+        SELECT se.case_id, c.group_id, se.evidence_type, se.normalized_value
+        FROM UNNEST(%s::text[], %s::text[]) AS k (evidence_type, normalized_value)
+        JOIN structured_evidence se
+          ON se.evidence_type = k.evidence_type AND se.normalized_value = k.normalized_value
+        JOIN cases c ON se.case_id = c.id
+        WHERE c.status != 'ปิดคดี'
+    """, ([key[0] for key in keys], [key[1] for key in keys]))
+    return cursor.fetchall()
 
-        existing_group_id = None
-        if existing_groups:
-            existing_group_id = existing_groups[0]['group_id']
-        else:
-            new_group_id = str(uuid.uuid4())
-            
-            today_str = datetime.date.today().strftime('%Y%m%d')
-            like_pattern = f"G%-%{today_str}"
+def update_case_links(case_id: str):
+    """
+    Finds and updates links for a case, keeping the group summary in step.
+    (PostgreSQL Version) Runs as a LINK_CASE job; errors are re-raised so the worker can retry.
+    """
+    with get_db_conn() as conn:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+    
+        try:
+            # Waits while a full regroup (grouping_service.regroup_all) is running
+            cursor.execute("SELECT pg_advisory_xact_lock_shared(%s)", (grouping_service.REGROUP_LOCK_KEY,))
             cursor.execute(
-                "SELECT group_number FROM case_groups WHERE group_number LIKE %s ORDER BY group_number DESC LIMIT 1",
-                (like_pattern,)
+                "SELECT evidence_type, evidence_value FROM structured_evidence WHERE case_id = %s", (case_id,)
             )
-            last_group_row = cursor.fetchone()
-            
-            new_seq = int(last_group_row['group_number'].split('-')[0].replace('G', '')) + 1 if last_group_row else 1
-            new_group_number = f"G{new_seq:03d}-{today_str}"
-
-            group_name = f"กลุ่มคดีเชื่อมโยงโดย '{primary_evidence['evidence_type']}: {primary_evidence['evidence_value']}'" if primary_evidence else f"กลุ่มคดี #{new_group_number}"
-
+            new_case_evidence = cursor.fetchall()
+
+            if not new_case_evidence:
+                return
+
+            matches = find_evidence_matches(cursor, new_case_evidence)
+            linked_case_ids = {case_id} | {row['case_id'] for row in matches}
+            if len(linked_case_ids) < 2:
+                return
+
+            # Name the group after the first evidence item (in the case's own order) shared with another case
+            matched_keys = {(row['evidence_type'], row['normalized_value']) for row in matches if row['case_id'] != case_id}
+            primary_evidence = next((
+                evidence for evidence in new_case_evidence
+                if (evidence['evidence_type'], normalize_text(evidence['evidence_value'])) in matched_keys
+            ), None)
+            # The group ids in `matches` may be stale: another job can merge or retire those
+            # groups before we lock them. Lock the linked cases (id order, like every other
+            # linking job) and read their current groups; retiring a group rewrites its cases,
+            # so it can't change them under us from here on.
             cursor.execute(
-                "INSERT INTO case_groups (id, group_number, group_name, created_timestamp) VALUES (%s, %s, %s, %s)",
-                (new_group_id, new_group_number, group_name, datetime.datetime.now())
+                "SELECT id, group_id FROM cases WHERE id = ANY(%s) ORDER BY id FOR UPDATE",
+                (sorted(linked_case_ids),)
             )
-            existing_group_id = new_group_id
-
-        # Update all linked cases
-        update_query = "UPDATE cases SET group_id = %s WHERE id = ANY(%s)"
-        cursor.execute(update_query, (existing_group_id, list(linked_case_ids)))
-        
-        conn.commit()
+            existing_group_ids = {row['group_id'] for row in cursor.fetchall() if row['group_id'] is not None}
+
+            # Overlapping groups are merged into the oldest; otherwise a new group is created
+            existing_group_id = grouping_service.merge_groups(cursor, existing_group_ids)
+            if existing_group_id is None:
+                existing_group_id = grouping_service.create_group(
+                    cursor,
+                    primary_evidence['evidence_type'] if primary_evidence else None,
+                    primary_evidence['evidence_value'] if primary_evidence else None,
+                )
+
+            # Update all linked cases; the group summary is adjusted by the same delta
+            group_summary_service.move_cases(cursor, linked_case_ids, existing_group_id)
         
-        # Trigger summary update for the affected group
-        if existing_group_id:
-            update_group_summary(existing_group_id)
-
-        print(f"Case linking complete for group {existing_group_id}.")
-        
-    except Exception as e:
-        print(f"Error during case linking: {e}")
-        conn.rollback()
-    finally:
-        cursor.close()
-        conn.close()
\ No newline at end of file
+            conn.commit()
+            print(f"Case linking complete for group {existing_group_id}.")
+
+        except Exception as e:
+            print(f"Error during case linking: {e}")
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
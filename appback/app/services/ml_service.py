@@ -1,15 +1,12 @@
 # app/services/ml_service.py
 
-import pandas as pd
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from sklearn.pipeline import Pipeline
-from sklearn.preprocessing import OneHotEncoder, OrdinalEncoder, StandardScaler
-from sklearn.compose import ColumnTransformer
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.feature_extraction.text import TfidfVectorizer
-import joblib
+# pandas, sklearn and joblib are imported inside the functions that need them, so importing
+# the app (and every forked worker) doesn't pay for the ML stack until a model is loaded.
+import numpy as np
+import hashlib
+import json
 import os
+from app.database import get_db_conn
 
 # --- 1. Define All Features for the Model ---
 CATEGORICAL_FEATURES = ['case_type']
@@ -28,125 +25,255 @@ REPUTATIONAL_DAMAGE_ORDER = ['None', 'Low', 'Medium', 'High', 'Critical']
 TECHNICAL_COMPLEXITY_ORDER = ['Low', 'Medium', 'High', 'Very High', 'Extreme']
 INITIAL_EVIDENCE_ORDER = ['None', 'Low', 'Medium', 'High', 'Very High']
 
-# --- Helper Function for DB Connection (Corrected) ---
-def get_db_conn():
-    db_url = os.environ.get('DATABASE_URL')
-    if not db_url:
-        raise Exception("DATABASE_URL environment variable is not set.")
-    return psycopg2.connect(db_url)
+ALL_FEATURES = CATEGORICAL_FEATURES + ORDINAL_FEATURES + NUMERICAL_FEATURES + BINARY_FEATURES
+
+# Intake forms send ordinal levels as 1-5 (string or int); map them onto the trained categories.
+REPUTATIONAL_DAMAGE_MAP = {
+    "1": "Low", "2": "Medium", "3": "High", "4": "Critical", "None": "None", None: "None",
+    1: "Low", 2: "Medium", 3: "High", 4: "Critical"
+}
+TECHNICAL_COMPLEXITY_MAP = {
+    "1": "Low", "2": "Medium", "3": "High", "4": "Very High", "5": "Extreme", "None": "Low", None: "Low",
+    1: "Low", 2: "Medium", 3: "High", 4: "Very High", 5: "Extreme"
+}
+EVIDENCE_CLARITY_MAP = {
+    "1": "Low", "2": "Medium", "3": "High", "4": "Very High", "None": "None", None: "None",
+    1: "Low", 2: "Medium", 3: "High", 4: "Very High"
+}
+# (column, mapping, fallback for unmapped values)
+ORDINAL_INPUT_MAPS = [
+    ('reputational_damage_level', REPUTATIONAL_DAMAGE_MAP, "Low"),
+    ('technical_complexity_level', TECHNICAL_COMPLEXITY_MAP, "Low"),
+    ('initial_evidence_clarity', EVIDENCE_CLARITY_MAP, "Medium"),
+]
+
+# --- Feature Preparation for Scoring ---
+def derive_case_features(case_details, structured_evidence):
+    """Adds the derived features a brand-new case is scored with."""
+    features = dict(case_details)
+    features['evidence_count'] = len(structured_evidence)
+    features['has_actionable_evidence'] = any(
+        (ev.get('evidence_type') or '').upper() in ['BANK_ACCOUNT', 'PHONE_NUMBER']
+        for ev in structured_evidence
+    )
+    features['days_since_creation'] = 0  # New case
+    features['num_linked_cases'] = 0     # New case, no links yet
+    features['is_grouped'] = False       # New case, not grouped yet
+    return features
+
+def feature_default(feature):
+    if feature in BINARY_FEATURES or feature in NUMERICAL_FEATURES:
+        return 0
+    return 'None'
+
+def build_feature_frame(feature_dicts):
+    """
+    Builds one model-ready DataFrame for any number of cases (column-wise, no per-row loops).
+    Missing features get the same defaults as the single-case intake path.
+    """
+    import pandas as pd
+
+    records = [
+        {f: (d[f] if f in d else feature_default(f)) for f in ALL_FEATURES}
+        for d in feature_dicts
+    ]
+    input_df = pd.DataFrame.from_records(records, columns=ALL_FEATURES)
+
+    for column, mapping, fallback in ORDINAL_INPUT_MAPS:
+        input_df[column] = input_df[column].map(mapping).fillna(fallback)
+    for col in CATEGORICAL_FEATURES + ORDINAL_FEATURES:
+        input_df[col] = input_df[col].astype(str)
+    for col in BINARY_FEATURES:
+        input_df[col] = input_df[col].eq(True).astype(int)
+    return input_df
+
+def predict_priority(pipeline, feature_dicts, forest=None):
+    """
+    Scores a batch of cases with a single predict call; scores are clipped to [0, 100].
+    `forest` is an optional forest_engine.FlatForest used in place of sklearn's predict.
+    """
+    if not feature_dicts:
+        return []
+    input_df = build_feature_frame(feature_dicts)
+    if forest is not None:
+        X = pipeline.named_steps['preprocessor'].transform(input_df)
+        X = X.toarray() if hasattr(X, 'toarray') else X
+        # The flat forest has no missing-value routing; let sklearn handle NaNs.
+        scores = forest.predict(X) if not np.isnan(X).any() else pipeline.named_steps['regressor'].predict(X)
+    else:
+        scores = pipeline.predict(input_df)
+    return [float(max(0, min(100, score))) for score in scores]
+
+def score_case(pipeline, feature_dict, encoder=None, forest=None):
+    """
+    Scores a single case. Uses the pandas-free fast encoder when one is available and
+    falls back to the DataFrame path for inputs it can't encode.
+    """
+    if encoder is not None:
+        try:
+            return float(max(0, min(100, encoder.predict(feature_dict, forest=forest))))
+        except (TypeError, ValueError):
+            pass
+    return predict_priority(pipeline, [feature_dict], forest=forest)[0]
 
 # --- Functions to Save and Load the Model ---
 def save_model(pipeline, path):
+    import joblib
     print(f"Saving model to {path}...")
     joblib.dump(pipeline, path)
     print("Model saved successfully.")
 
-def load_model(path):
+def load_model(path, mmap_mode=None):
+    """Loads a pipeline; mmap_mode='r' maps its numpy arrays from the file instead of copying them."""
+    import joblib
     if not os.path.exists(path):
         print(f"Model file not found at {path}. A new model will be trained.")
         return None
     print(f"Loading model from {path}...")
-    return joblib.load(path)
+    return joblib.load(path, mmap_mode=mmap_mode)
 
-# --- Main Function to Train the Model ---
-def train_ml_model():
-    df_train = None
-    MINIMUM_RECORDS_FOR_TRAINING = 10
-
-    try:
-        conn = get_db_conn()
-        query = """
-            WITH GroupStats AS (
-                SELECT group_id, COUNT(id) as num_linked_cases
-                FROM cases
-                WHERE group_id IS NOT NULL AND status != 'ปิดคดี'
-                GROUP BY group_id
-            )
-            SELECT
-                COALESCE(c.verified_score, c.priority_score) as priority_score,
-                c.case_type,
-                c.estimated_financial_damage,
-                c.num_victims,
-                c.reputational_damage_level,
-                c.sensitive_data_compromised,
-                c.ongoing_threat,
-                c.risk_of_evidence_loss,
-                c.technical_complexity_level,
-                c.initial_evidence_clarity,
-                COALESCE(ef.evidence_count, 0) as evidence_count,
-                COALESCE(se.has_actionable_evidence, FALSE) as has_actionable_evidence,
-                EXTRACT(DAY FROM (NOW() - c.timestamp)) as days_since_creation,
-                COALESCE(gs.num_linked_cases, 0) as num_linked_cases,
-                (CASE WHEN c.group_id IS NOT NULL THEN TRUE ELSE FALSE END) as is_grouped
-            FROM cases c
-            LEFT JOIN (SELECT case_id, COUNT(id) as evidence_count FROM evidence_files GROUP BY case_id) ef ON c.id = ef.case_id
-            LEFT JOIN (SELECT case_id, TRUE as has_actionable_evidence FROM structured_evidence WHERE evidence_type IN ('BANK_ACCOUNT', 'PHONE_NUMBER') GROUP BY case_id) se ON c.id = se.case_id
-            LEFT JOIN GroupStats gs ON c.group_id = gs.group_id
-            WHERE c.verified_score IS NOT NULL
-        """
-        db_df = pd.read_sql_query(query, conn)
-        conn.close()
-
-        if len(db_df) >= MINIMUM_RECORDS_FOR_TRAINING:
-            print(f"Training model with {len(db_df)} HUMAN-VERIFIED records from PostgreSQL...")
-            df_train = db_df
-        else:
-            print(f"Not enough verified data ({len(db_df)} records). Falling back to sample data.")
-            df_train = None
-    except Exception as e:
-        print(f"Failed to load training data from PostgreSQL: {e}")
-        df_train = None
-
-    if df_train is None or len(df_train) < MINIMUM_RECORDS_FOR_TRAINING:
-        print("Using hardcoded sample data for training.")
-        # ข้อมูลตัวอย่างยังคงเป็นข้อความดิบ
-        data = {
-            'case_type': ['Hacking', 'Scam', 'Phishing', 'Illegal Content', 'Scam', 'Hacking', 'Cyberbullying', 'Unknown'],
-            'estimated_financial_damage': [15000000, 120000, 8500000, 0, 45000, 5000, 0, 100],
-            'num_victims': [1, 1, 250, 1, 80, 1, 1, 0],
-            'reputational_damage_level': ['Critical', 'Low', 'High', 'High', 'None', 'Low', 'Medium', 'None'],
-            'sensitive_data_compromised': [True, False, True, False, False, False, True, False],
-            'ongoing_threat': [True, True, True, True, False, False, True, False],
-            'risk_of_evidence_loss': [True, True, False, False, True, True, False, False],
-            'technical_complexity_level': ['Extreme', 'Medium', 'High', 'Low', 'Low', 'Medium', 'Low', 'Low'],
-            'initial_evidence_clarity': ['High', 'Low', 'High', 'Very High', 'Medium', 'Low', 'Very High', 'None'],
-            'evidence_count': [5, 2, 10, 1, 3, 0, 4, 0],
-            'has_actionable_evidence': [True, True, True, False, True, False, True, False],
-            'priority_score': [98, 85, 95, 58, 64, 45, 75, 10],
-            'days_since_creation': [15, 3, 45, 90, 5, 2, 30, 1],
-            'num_linked_cases': [2, 0, 4, 0, 0, 1, 0, 0],
-            'is_grouped': [True, False, True, False, False, True, False, False]
-        }
-        df_train = pd.DataFrame(data)
-
-        print("Cleaning and preparing training data...")
-        # เติมค่าว่างในฟีเจอร์ข้อความด้วย 'none' หรือ 'unknown'
-        for col in TEXT_FEATURES:
-            df_train[col] = df_train[col].fillna('none').astype(str)
-        
-        # (ส่วนการทำความสะอาดข้อมูล Numerical และ Binary เหมือนเดิม)
-        for col in NUMERICAL_FEATURES:
-            df_train[col] = pd.to_numeric(df_train[col], errors='coerce').fillna(0)
-        for col in BINARY_FEATURES:
-            df_train[col] = df_train[col].fillna(False).astype(int)
-
-        preprocessor = ColumnTransformer(
+# --- Training Data ---
+# Feature query for human-verified cases; same features the intake path derives.
+TRAINING_QUERY = """
+    WITH GroupStats AS (
+        SELECT group_id, COUNT(id) as num_linked_cases
+        FROM cases
+        WHERE group_id IS NOT NULL AND status != 'ปิดคดี'
+        GROUP BY group_id
+    )
+    SELECT
+        COALESCE(c.verified_score, c.priority_score) as priority_score,
+        c.case_type,
+        c.estimated_financial_damage,
+        c.num_victims,
+        c.reputational_damage_level,
+        c.sensitive_data_compromised,
+        c.ongoing_threat,
+        c.risk_of_evidence_loss,
+        c.technical_complexity_level,
+        c.initial_evidence_clarity,
+        COALESCE(ef.evidence_count, 0) as evidence_count,
+        COALESCE(se.has_actionable_evidence, FALSE) as has_actionable_evidence,
+        EXTRACT(DAY FROM (NOW() - c.timestamp)) as days_since_creation,
+        COALESCE(gs.num_linked_cases, 0) as num_linked_cases,
+        (CASE WHEN c.group_id IS NOT NULL THEN TRUE ELSE FALSE END) as is_grouped
+    FROM cases c
+    LEFT JOIN (SELECT case_id, COUNT(id) as evidence_count FROM evidence_files GROUP BY case_id) ef ON c.id = ef.case_id
+    LEFT JOIN (SELECT case_id, TRUE as has_actionable_evidence FROM structured_evidence WHERE evidence_type IN ('BANK_ACCOUNT', 'PHONE_NUMBER') GROUP BY case_id) se ON c.id = se.case_id
+    LEFT JOIN GroupStats gs ON c.group_id = gs.group_id
+    WHERE c.verified_score IS NOT NULL
+"""
+MINIMUM_RECORDS_FOR_TRAINING = 10
+
+# ข้อมูลตัวอย่าง (ใช้เมื่อยังไม่มีข้อมูลที่ตรวจสอบแล้วพอ)
+SAMPLE_TRAINING_DATA = {
+    'case_type': ['Hacking', 'Scam', 'Phishing', 'Illegal Content', 'Scam', 'Hacking', 'Cyberbullying', 'Unknown'],
+    'estimated_financial_damage': [15000000, 120000, 8500000, 0, 45000, 5000, 0, 100],
+    'num_victims': [1, 1, 250, 1, 80, 1, 1, 0],
+    'reputational_damage_level': ['Critical', 'Low', 'High', 'High', 'None', 'Low', 'Medium', 'None'],
+    'sensitive_data_compromised': [True, False, True, False, False, False, True, False],
+    'ongoing_threat': [True, True, True, True, False, False, True, False],
+    'risk_of_evidence_loss': [True, True, False, False, True, True, False, False],
+    'technical_complexity_level': ['Extreme', 'Medium', 'High', 'Low', 'Low', 'Medium', 'Low', 'Low'],
+    'initial_evidence_clarity': ['High', 'Low', 'High', 'Very High', 'Medium', 'Low', 'Very High', 'None'],
+    'evidence_count': [5, 2, 10, 1, 3, 0, 4, 0],
+    'has_actionable_evidence': [True, True, True, False, True, False, True, False],
+    'priority_score': [98, 85, 95, 58, 64, 45, 75, 10],
+    'days_since_creation': [15, 3, 45, 90, 5, 2, 30, 1],
+    'num_linked_cases': [2, 0, 4, 0, 0, 1, 0, 0],
+    'is_grouped': [True, False, True, False, False, True, False, False]
+}
+
+ORDINAL_ORDERS = {
+    'reputational_damage_level': REPUTATIONAL_DAMAGE_ORDER,
+    'technical_complexity_level': TECHNICAL_COMPLEXITY_ORDER,
+    'initial_evidence_clarity': INITIAL_EVIDENCE_ORDER,
+}
+
+def feature_schema_hash():
+    """Fingerprint of the feature layout; a saved model is only usable if this matches."""
+    schema = {
+        'categorical': CATEGORICAL_FEATURES,
+        'ordinal': ORDINAL_FEATURES,
+        'numerical': NUMERICAL_FEATURES,
+        'binary': BINARY_FEATURES,
+        'ordinal_orders': ORDINAL_ORDERS,
+        'target': TARGET_COLUMN,
+    }
+    return hashlib.sha256(json.dumps(schema, sort_keys=True).encode('utf-8')).hexdigest()
+
+def prepare_training_frame(df_train):
+    """Cleans a training DataFrame into the types the pipeline is fitted on."""
+    import pandas as pd
+
+    df_train = df_train.copy()
+    # ค่าระดับที่บันทึกเป็นตัวเลข 1-5 แปลงเป็นชื่อระดับ (ค่าที่เป็นชื่ออยู่แล้วคงไว้)
+    for column, mapping, fallback in ORDINAL_INPUT_MAPS:
+        valid = df_train[column].isin(ORDINAL_ORDERS[column])
+        df_train[column] = df_train[column].where(valid, df_train[column].map(mapping).fillna(fallback))
+    for col in CATEGORICAL_FEATURES + ORDINAL_FEATURES:
+        df_train[col] = df_train[col].fillna('none').astype(str)
+    for col in NUMERICAL_FEATURES:
+        df_train[col] = pd.to_numeric(df_train[col], errors='coerce').fillna(0)
+    for col in BINARY_FEATURES:
+        df_train[col] = df_train[col].fillna(False).astype(int)
+    df_train[TARGET_COLUMN] = pd.to_numeric(df_train[TARGET_COLUMN], errors='coerce').fillna(0)
+    return df_train
+
+def build_pipeline():
+    """An unfitted preprocessing + RandomForest pipeline."""
+    from sklearn.compose import ColumnTransformer
+    from sklearn.ensemble import RandomForestRegressor
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import OneHotEncoder, OrdinalEncoder, StandardScaler
+
+    preprocessor = ColumnTransformer(
         transformers=[
             ('cat', OneHotEncoder(handle_unknown='ignore'), CATEGORICAL_FEATURES),
             ('ord', OrdinalEncoder(categories=[REPUTATIONAL_DAMAGE_ORDER, TECHNICAL_COMPLEXITY_ORDER, INITIAL_EVIDENCE_ORDER]), ORDINAL_FEATURES),
             ('num', StandardScaler(), NUMERICAL_FEATURES),
-            ('bin', 'passthrough', BINARY_FEATURES) # <<< แก้ไขโดยการแยก Binary ออกมา
+            ('bin', 'passthrough', BINARY_FEATURES)
         ],
         remainder='drop'
     )
+    model = RandomForestRegressor(n_estimators=100, random_state=42)
+    return Pipeline(steps=[('preprocessor', preprocessor), ('regressor', model)])
+
+def fit_pipeline(df_train):
+    """Cleans the data and fits a fresh pipeline on it."""
+    df_train = prepare_training_frame(df_train)
+    pipeline = build_pipeline()
+    pipeline.fit(df_train[ALL_FEATURES], df_train[TARGET_COLUMN])
+    return pipeline
+
+# --- Main Function to Train the Model ---
+def train_ml_model(use_database=True):
+    """
+    Trains on human-verified cases from PostgreSQL, falling back to the sample data.
+    With use_database=False (app startup) it never touches the database; run the
+    offline training job (training_service) for a model fitted on real data.
+    """
+    import pandas as pd
 
-        # --- 5. สร้างและฝึกสอนโมเดล (เหมือนเดิม) ---
-        model = RandomForestRegressor(n_estimators=100, random_state=42)
-        pipeline = Pipeline(steps=[('preprocessor', preprocessor), ('regressor', model)])
+    df_train = None
 
-        X_train = df_train.drop(TARGET_COLUMN, axis=1)
-        y_train = df_train[TARGET_COLUMN]
+    if use_database:
+        try:
+            with get_db_conn() as conn:
+                db_df = pd.read_sql_query(TRAINING_QUERY, conn)
+
+            if len(db_df) >= MINIMUM_RECORDS_FOR_TRAINING:
+                print(f"Training model with {len(db_df)} HUMAN-VERIFIED records from PostgreSQL...")
+                df_train = db_df
+            else:
+                print(f"Not enough verified data ({len(db_df)} records). Falling back to sample data.")
+        except Exception as e:
+            print(f"Failed to load training data from PostgreSQL: {e}")
+
+    if df_train is None:
+        print("Using hardcoded sample data for training.")
+        df_train = pd.DataFrame(SAMPLE_TRAINING_DATA)
 
-        pipeline.fit(X_train, y_train)
-        print("✅ RandomForest Model trained successfully.")
+    pipeline = fit_pipeline(df_train)
+    print("✅ RandomForest Model trained successfully.")
     return pipeline
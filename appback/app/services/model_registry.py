@@ -0,0 +1,308 @@
+# app/services/model_registry.py
+
+from collections import namedtuple
+import datetime
+import fcntl
+import json
+import os
+import secrets
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from app.services import ml_service, feature_encoder, forest_engine
+
+MODEL_FILE = 'model.joblib'
+METADATA_FILE = 'metadata.json'
+FOREST_DIR = 'forest'
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class ModelRegistry:
+    """
+    Versioned model artifacts on disk:
+
+        <root>/versions/<version>/model.joblib + metadata.json (+ forest/*.npy)
+        <root>/CURRENT          active version (replaced atomically with os.replace)
+        <root>/history.jsonl    one line per activation or rollback, replayed by rollback()
+
+    A version directory is written under a temporary name and renamed into place, so
+    readers never see a partial artifact. Artifacts are stored uncompressed so they can be
+    memory-mapped: forest/ holds the validated flat forest as raw .npy arrays.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.versions_dir = os.path.join(self.root, 'versions')
+        self.pointer_path = os.path.join(self.root, 'CURRENT')
+        self.history_path = os.path.join(self.root, 'history.jsonl')
+        os.makedirs(self.versions_dir, exist_ok=True)
+
+    def version_dir(self, version):
+        return os.path.join(self.versions_dir, version)
+
+    def model_path(self, version):
+        return os.path.join(self.version_dir(version), MODEL_FILE)
+
+    # --- Writing ---
+    def publish(self, pipeline, metadata=None, activate=True):
+        """Stores a fitted pipeline as a new version and optionally activates it. Returns the version."""
+        import joblib
+
+        version = f"{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}-{secrets.token_hex(3)}"
+        metadata = dict(metadata or {})
+        metadata.setdefault('feature_schema_hash', ml_service.feature_schema_hash())
+        metadata.update({'version': version, 'created_at': datetime.datetime.now().isoformat()})
+
+        tmp_dir = os.path.join(self.versions_dir, f".tmp-{version}")
+        os.makedirs(tmp_dir)
+        try:
+            joblib.dump(pipeline, os.path.join(tmp_dir, MODEL_FILE))
+            forest = forest_engine.build_forest(pipeline, ml_service.build_feature_frame(feature_encoder.probe_cases()))
+            if forest is not None:
+                forest.save(os.path.join(tmp_dir, FOREST_DIR))
+            metadata['flat_forest'] = forest is not None
+            with open(os.path.join(tmp_dir, METADATA_FILE), 'w') as f:
+                json.dump(metadata, f, indent=2)
+            os.rename(tmp_dir, self.version_dir(version))
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        if activate:
+            self.activate(version)
+        return version
+
+    def activate(self, version, action='activate'):
+        """Points CURRENT at `version` after checking it matches this code's feature schema."""
+        metadata = self.metadata(version)
+        if metadata is None:
+            raise ValueError(f"Unknown model version {version}")
+        if metadata.get('feature_schema_hash') != ml_service.feature_schema_hash():
+            raise ValueError(f"Model version {version} was trained on a different feature schema")
+        previous = self.active_version()
+        tmp_pointer = f"{self.pointer_path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        with open(tmp_pointer, 'w') as f:
+            f.write(version)
+        os.replace(tmp_pointer, self.pointer_path)
+        with open(self.history_path, 'a') as f:
+            f.write(json.dumps({'version': version, 'previous': previous, 'action': action,
+                                'activated_at': datetime.datetime.now().isoformat()}) + '\n')
+        return previous
+
+    def _activation_stack(self):
+        """
+        Replays history into a stack of activations: an activation pushes its version, a
+        rollback pops one. Repeated rollbacks therefore keep walking back (v3 -> v2 -> v1)
+        instead of bouncing between the last two versions.
+        """
+        stack = []
+        if os.path.exists(self.history_path):
+            with open(self.history_path) as f:
+                for line in f:
+                    entry = json.loads(line)
+                    if entry.get('action') == 'rollback':
+                        if stack:
+                            stack.pop()
+                    elif not stack or stack[-1] != entry['version']:
+                        stack.append(entry['version'])
+        current = self.active_version()
+        if current is not None and (not stack or stack[-1] != current):
+            stack.append(current)  # CURRENT was changed outside activate()
+        return stack
+
+    def rollback(self):
+        """Re-activates the version that was active before the current one. Returns it."""
+        stack = self._activation_stack()
+        if len(stack) < 2:
+            raise ValueError("No earlier model version to roll back to")
+        previous = stack[-2]
+        self.activate(previous, action='rollback')
+        return previous
+
+    # --- Reading ---
+    def active_version(self):
+        try:
+            with open(self.pointer_path) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def metadata(self, version):
+        try:
+            with open(os.path.join(self.version_dir(version), METADATA_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def list_versions(self):
+        versions = [v for v in os.listdir(self.versions_dir) if not v.startswith('.')]
+        return [self.metadata(v) for v in sorted(versions, reverse=True)]
+
+    def load(self, version, mmap_mode='r'):
+        """Loads a version's pipeline; numpy arrays are mapped from the file, not copied."""
+        import joblib
+        return joblib.load(self.model_path(version), mmap_mode=mmap_mode)
+
+    def load_forest(self, version, mmap_mode='r'):
+        """The version's stored flat forest (shared page-cache views), or None if it has none."""
+        directory = os.path.join(self.version_dir(version), FOREST_DIR)
+        if not os.path.isdir(directory):
+            return None
+        return forest_engine.FlatForest.load(directory, mmap_mode=mmap_mode)
+
+# --- Per-process holder ---
+ModelBundle = namedtuple('ModelBundle', ['version', 'pipeline', 'encoder', 'forest', 'metadata'])
+
+class ModelHolder:
+    """
+    The model a process serves from. Requests read `current` once and use that bundle
+    throughout, and a reload builds a complete new bundle before swapping the reference,
+    so no request ever sees a half-loaded or half-trained model.
+
+    Loading normally happens on a background thread started with the first request, and
+    `state` ('not_loaded', 'loading', 'ready', 'failed') backs the readiness endpoint.
+    """
+
+    def __init__(self, registry, backend='sklearn', poll_interval=30.0, legacy_path=None):
+        self.registry = registry
+        self.backend = backend
+        self.poll_interval = poll_interval
+        self.legacy_path = legacy_path
+        self.current = None
+        self.state = 'not_loaded'
+        self.error = None
+        self.load_seconds = None
+        self._reload_lock = threading.Lock()
+        self._thread = None
+
+    def _build(self, version):
+        pipeline = self.registry.load(version)
+        encoder = feature_encoder.build_encoder(pipeline)
+        forest = None
+        if self.backend == 'flat':
+            forest = self.registry.load_forest(version)
+            if forest is None:
+                forest = forest_engine.build_forest(pipeline, ml_service.build_feature_frame(feature_encoder.probe_cases()))
+        return ModelBundle(version, pipeline, encoder, forest, self.registry.metadata(version))
+
+    def refresh(self):
+        """Loads the active version if it differs from the one being served. Returns True on swap."""
+        with self._reload_lock:
+            version = self.registry.active_version()
+            if version is None or (self.current is not None and self.current.version == version):
+                return False
+            bundle = self._build(version)
+            self.current = bundle
+            self.state = 'ready'
+            print(f"Serving model version {version}.")
+            return True
+
+    def ensure_loaded(self):
+        """Synchronously loads the active version (seeding an empty registry first). Returns the bundle."""
+        if self.current is not None:
+            return self.current
+        self.state = 'loading'
+        started = time.perf_counter()
+        try:
+            bootstrap(self.registry, legacy_path=self.legacy_path)
+            self.refresh()
+        except Exception as e:
+            self.state, self.error = 'failed', str(e)
+            raise
+        self.load_seconds = round(time.perf_counter() - started, 3)
+        self.state, self.error = 'ready', None
+        return self.current
+
+    def _run(self):
+        try:
+            self.ensure_loaded()
+        except Exception as e:
+            print(f"Model load failed: {e}")
+        while self.poll_interval > 0:
+            time.sleep(self.poll_interval)
+            try:
+                if self.current is None:
+                    self.ensure_loaded()
+                else:
+                    self.refresh()
+            except Exception as e:
+                print(f"Model reload failed: {e}")
+
+    def start(self):
+        """Loads (if needed) and then polls for new versions on a daemon thread."""
+        if self._thread is None:
+            if self.current is None:
+                self.state = 'loading'
+            self._thread = threading.Thread(target=self._run, name='model-loader', daemon=True)
+            self._thread.start()
+        return self
+
+    def status(self):
+        return {
+            "state": self.state,
+            "version": self.current.version if self.current else None,
+            "load_seconds": self.load_seconds,
+            "error": self.error,
+        }
+
+def bootstrap(registry, legacy_path=None):
+    """
+    Makes sure the registry has an active version: imports a legacy single-file model if
+    one exists, otherwise publishes a model trained on the built-in sample data.
+    """
+    if registry.active_version() is not None:
+        return registry.active_version()
+    # Pre-fork workers start together: only the first one to get the lock seeds the registry,
+    # the others wait and then find its version active.
+    with open(os.path.join(registry.root, '.bootstrap.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            if registry.active_version() is not None:
+                return registry.active_version()
+            pipeline = ml_service.load_model(legacy_path) if legacy_path else None
+            source = 'legacy' if pipeline is not None else 'sample'
+            if pipeline is None:
+                pipeline = ml_service.train_ml_model(use_database=False)
+            return registry.publish(pipeline, {'source': source}, activate=True)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+# --- Startup benchmark ---
+_STARTUP_PROBES = {
+    "import_app_s": "import app",
+    "create_app_s": "from app import create_app; create_app()",
+    "create_app_and_load_s": "from app import create_app; create_app().extensions['ml_model'].ensure_loaded()",
+}
+
+def _time_child(code, env):
+    script = f"import time; t = time.perf_counter(); {code}; print(time.perf_counter() - t)"
+    result = subprocess.run([sys.executable, '-c', script], cwd=APP_ROOT, env=env,
+                            capture_output=True, text=True, timeout=600)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip()[-2000:])
+    return float(result.stdout.strip().splitlines()[-1])
+
+def run_startup_benchmark(registry, repeats=3):
+    """
+    Median cold-start timings, each in a fresh interpreter: importing the app, create_app()
+    and create_app() plus a synchronous model load; then in-process load time of the active
+    version copied into memory vs. memory-mapped.
+    """
+    import statistics
+
+    env = dict(os.environ, MODEL_REGISTRY_DIR=registry.root)
+    results = {}
+    for key, code in _STARTUP_PROBES.items():
+        results[key] = round(statistics.median(_time_child(code, env) for _ in range(repeats)), 3)
+
+    version = registry.active_version()
+    if version is not None:
+        for key, mmap_mode in (("load_copy_s", None), ("load_mmap_s", 'r')):
+            timings = []
+            for _ in range(repeats):
+                started = time.perf_counter()
+                registry.load(version, mmap_mode=mmap_mode)
+                registry.load_forest(version, mmap_mode=mmap_mode)
+                timings.append(time.perf_counter() - started)
+            results[key] = round(statistics.median(timings), 4)
+    return results
@@ -0,0 +1,95 @@
+# app/services/pagination.py
+
+import base64
+import datetime
+import decimal
+import json
+import threading
+import time
+
+DEFAULT_PAGE_SIZE = 12
+MAX_PAGE_SIZE = 100
+COUNT_CACHE_TTL = 30  # seconds
+
+# Indexes that serve the keyset orderings below without a sort step.
+SCHEMA_SQL = """
+    CREATE INDEX IF NOT EXISTS idx_cases_priority_id ON cases (priority_score DESC, id DESC);
+    CREATE INDEX IF NOT EXISTS idx_cases_group_timestamp_id ON cases (group_id, timestamp DESC, id DESC);
+"""
+
+# --- Opaque keyset cursors ---
+# A cursor is the sort key of the last row on the page, tagged with the ordering it
+# belongs to so a cursor from one listing can't be replayed against another.
+def _cursor_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)  # exact; Postgres coerces the literal back to numeric
+    return value
+
+def encode_cursor(kind, values):
+    payload = [kind] + [_cursor_value(v) for v in values]
+    raw = json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(token, kind):
+    """Returns the sort-key values for `kind`, [] for an empty token, or raises ValueError."""
+    if not token:
+        return []
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        payload = json.loads(raw.decode('utf-8'))
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Malformed cursor.") from e
+    if not isinstance(payload, list) or len(payload) != 3 or payload[0] != kind:
+        raise ValueError("Cursor does not belong to this listing.")
+    if kind == 'timestamp':
+        return [datetime.datetime.fromisoformat(payload[1]), payload[2]]
+    return payload[1:]
+
+def get_page_size(args, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    limit = args.get('limit', default=default, type=int)
+    return max(1, min(limit or default, maximum))
+
+# --- Total counts ---
+_count_cache = {}
+_count_lock = threading.Lock()
+
+def _estimated_table_rows(cursor, table):
+    cursor.execute("SELECT reltuples::bigint AS estimate FROM pg_class WHERE oid = %s::regclass", (table,))
+    row = cursor.fetchone()
+    estimate = row['estimate'] if row else -1
+    # reltuples is -1 (or 0) until the table has been vacuumed/analyzed once.
+    return estimate if estimate and estimate > 0 else None
+
+def count_rows(cursor, from_where, params, mode='exact', table=None, ttl=COUNT_CACHE_TTL):
+    """
+    Counts rows for a listing. Returns (total, is_estimate).
+      mode='exact'  - always COUNT(*)
+      mode='approx' - planner estimate for unfiltered listings, otherwise a COUNT(*) cached for `ttl` seconds
+      mode='none'   - skip counting entirely
+    """
+    if mode == 'none':
+        return None, False
+
+    if mode == 'approx':
+        if table and not params:
+            estimate = _estimated_table_rows(cursor, table)
+            if estimate is not None:
+                return estimate, True
+        key = (from_where, tuple(params))
+        with _count_lock:
+            cached = _count_cache.get(key)
+        if cached and cached[1] > time.monotonic():
+            return cached[0], True
+
+    cursor.execute(f"SELECT COUNT(*) AS count {from_where}", tuple(params))
+    total = cursor.fetchone()['count']
+
+    if mode == 'approx':
+        with _count_lock:
+            now = time.monotonic()
+            for stale_key in [k for k, v in _count_cache.items() if v[1] <= now]:
+                del _count_cache[stale_key]
+            _count_cache[(from_where, tuple(params))] = (total, now + ttl)
+    return total, False
@@ -0,0 +1,110 @@
+# app/services/preview_service.py
+#
+# Derivatives for image/PDF evidence: a small thumbnail and a larger preview (for PDFs, of
+# the first page), rendered once per stored blob and cached next to it:
+#
+#     objects/ab/cd/<sha256>.thumb.jpg
+#     objects/ab/cd/<sha256>.preview.jpg
+#
+# Rendering runs in a process pool (decoding is CPU-bound and holds the GIL), driven by
+# GENERATE_PREVIEWS jobs queued when new content is stored. The job key is the blob's path.
+
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import threading
+
+SIZES = {'thumb': 256, 'preview': 1024}
+JPEG_QUALITY = 80
+RENDER_TIMEOUT = 120  # seconds per file
+MAX_PROCESSES = int(os.environ.get('PREVIEW_PROCESSES', min(2, os.cpu_count() or 1)))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the parent has DB connections and worker threads
+            _pool = ProcessPoolExecutor(max_workers=MAX_PROCESSES, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+def derivative_path(blob_path, size):
+    return f"{blob_path}.{size}.jpg"
+
+def sniff_kind(path):
+    """'image', 'pdf' or None, from the file's magic bytes (the stored blob has no extension)."""
+    with open(path, 'rb') as f:
+        head = f.read(8)
+    if head.startswith(b'%PDF'):
+        return 'pdf'
+    if head.startswith(b'\x89PNG') or head.startswith(b'\xff\xd8\xff'):
+        return 'image'
+    return None
+
+# --- Rendering (runs in the pool's processes) ---
+def _open_image(path):
+    from PIL import Image, ImageOps
+
+    image = Image.open(path)
+    # JPEG can decode at 1/2, 1/4 or 1/8 scale directly: much faster for camera-size photos
+    image.draft('RGB', (SIZES['preview'], SIZES['preview']))
+    return ImageOps.exif_transpose(image).convert('RGB')
+
+def _render_pdf_page(path):
+    import pypdfium2 as pdfium
+
+    pdf = pdfium.PdfDocument(path)
+    try:
+        page = pdf[0]
+        width, height = page.get_size()
+        scale = SIZES['preview'] / max(width, height, 1)
+        return page.render(scale=scale).to_pil().convert('RGB')
+    finally:
+        pdf.close()
+
+def render_derivatives(blob_path):
+    """Writes every missing derivative of one blob. Returns the sizes written."""
+    kind = sniff_kind(blob_path)
+    if kind is None:
+        return []
+    image = _render_pdf_page(blob_path) if kind == 'pdf' else _open_image(blob_path)
+
+    written = []
+    for size, bound in sorted(SIZES.items(), key=lambda item: -item[1]):
+        target = derivative_path(blob_path, size)
+        if os.path.exists(target):
+            continue
+        image.thumbnail((bound, bound))  # in place; largest first, so each step only shrinks
+        tmp_path = f"{target}.tmp-{os.getpid()}"
+        image.save(tmp_path, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+        os.replace(tmp_path, target)
+        written.append(size)
+    return written
+
+# --- Job handler ---
+def has_derivatives(blob_path):
+    return all(os.path.exists(derivative_path(blob_path, size)) for size in SIZES)
+
+def generate_previews(blob_path: str):
+    """GENERATE_PREVIEWS job handler: renders in the process pool and waits for it."""
+    if not os.path.exists(blob_path) or has_derivatives(blob_path):
+        return
+    _get_pool().submit(render_derivatives, blob_path).result(timeout=RENDER_TIMEOUT)
+
+def enqueue_all(conn, root):
+    """Queues preview generation for every stored blob that is missing a derivative."""
+    from app.services import evidence_storage, job_queue
+
+    cursor = conn.cursor(name='preview_backfill')
+    cursor.itersize = 5000
+    cursor.execute("SELECT sha256 FROM evidence_blobs")
+    paths = [evidence_storage.object_path(root, sha256) for (sha256,) in cursor]
+    cursor.close()
+    missing = [path for path in paths if os.path.exists(path) and not has_derivatives(path) and sniff_kind(path)]
+    write_cursor = conn.cursor()
+    job_queue.enqueue_many(write_cursor, job_queue.GENERATE_PREVIEWS, missing)
+    conn.commit()
+    write_cursor.close()
+    return len(missing)
@@ -0,0 +1,91 @@
+# app/services/search_service.py
+
+import statistics
+import time
+
+# --- Search schema ---
+# Thai has no word boundaries, so Postgres full-text dictionaries can't tokenize case names.
+# Trigram (pg_trgm) GIN indexes are character based: they work for Thai and Latin text alike
+# and serve ILIKE '%term%' as well as similarity ranking.
+SCHEMA_SQL = """
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+    ALTER TABLE cases ADD COLUMN IF NOT EXISTS case_number_norm TEXT
+        GENERATED ALWAYS AS (REPLACE(case_number, '-', '')) STORED;
+    CREATE INDEX IF NOT EXISTS idx_cases_case_number_norm_trgm ON cases USING gin (case_number_norm gin_trgm_ops);
+    CREATE INDEX IF NOT EXISTS idx_cases_case_name_trgm ON cases USING gin (case_name gin_trgm_ops);
+"""
+
+def normalize_case_number(value: str) -> str:
+    """Same normalization as the generated `case_number_norm` column."""
+    return (value or '').replace('-', '')
+
+def _like_pattern(term: str) -> str:
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+def build_search_clause(term: str, alias: str = ''):
+    """
+    Returns (sql, params) for an index-backed match on case number or case name.
+    `alias` is the table prefix used by the calling query, e.g. 'c.'.
+    """
+    sql = f" AND ({alias}case_number_norm ILIKE %s OR {alias}case_name ILIKE %s)"
+    return sql, [_like_pattern(normalize_case_number(term)), _like_pattern(term)]
+
+def build_rank_expression(term: str, alias: str = ''):
+    """Returns (sql, params) for a relevance score in [0, 1], higher is better."""
+    sql = (f"GREATEST(word_similarity(%s, {alias}case_name), "
+           f"similarity(%s, {alias}case_number_norm))")
+    return sql, [term, normalize_case_number(term)]
+
+# --- Benchmark ---
+BENCH_NAMES = ['หลอกลงทุน', 'แฮกบัญชี', 'ฟิชชิ่ง', 'ขายของออนไลน์', 'แชร์ลูกโซ่', 'Romance Scam']
+
+def _time_queries(cursor, terms):
+    timings = []
+    for term in terms:
+        sql, params = build_search_clause(term)
+        started = time.perf_counter()
+        cursor.execute(f"SELECT id FROM bench_cases WHERE TRUE{sql} LIMIT 12", params)
+        cursor.fetchall()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+def run_benchmark(conn, sizes=(10_000, 100_000, 1_000_000), samples=20):
+    """
+    Measures median search latency (ms) with and without the trigram indexes on a
+    synthetic temp table of each size. Nothing is written to the real tables.
+    """
+    results = []
+    cursor = conn.cursor()
+    try:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for size in sizes:
+            cursor.execute("DROP TABLE IF EXISTS bench_cases")
+            cursor.execute("""
+                CREATE TEMP TABLE bench_cases AS
+                SELECT i AS id,
+                       'CC-' || lpad(i::text, 8, '0') AS case_number,
+                       (%s::text[])[1 + i %% %s] || ' ' || substr(md5(i::text), 1, 8) AS case_name
+                FROM generate_series(1, %s) AS i
+            """, (BENCH_NAMES, len(BENCH_NAMES), size))
+            cursor.execute("ALTER TABLE bench_cases ADD COLUMN case_number_norm TEXT")
+            cursor.execute("UPDATE bench_cases SET case_number_norm = REPLACE(case_number, '-', '')")
+            cursor.execute("ANALYZE bench_cases")
+
+            cursor.execute("SELECT case_number, case_name FROM bench_cases ORDER BY random() LIMIT %s", (samples,))
+            terms = []
+            for case_number, case_name in cursor.fetchall():
+                terms.extend([case_number[-6:], case_name.split(' ')[-1][:5]])
+
+            seq_ms = _time_queries(cursor, terms)
+
+            cursor.execute("CREATE INDEX ON bench_cases USING gin (case_number_norm gin_trgm_ops)")
+            cursor.execute("CREATE INDEX ON bench_cases USING gin (case_name gin_trgm_ops)")
+            cursor.execute("ANALYZE bench_cases")
+            indexed_ms = _time_queries(cursor, terms)
+
+            results.append({"rows": size, "seq_scan_ms": round(seq_ms, 3), "trigram_index_ms": round(indexed_ms, 3)})
+    finally:
+        conn.rollback()  # temp tables go away with the transaction
+        cursor.close()
+    return results
@@ -0,0 +1,105 @@
+# app/services/similarity_service.py
+
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import re
+import statistics
+import threading
+import time
+import numpy as np
+
+NGRAM = 3
+N_FEATURES = 2 ** 20
+# Below this the pool's pickling costs more than it saves. Kept under
+# suggestion_service.MAX_CANDIDATES so full candidate sets are counted in parallel.
+PARALLEL_MIN_CANDIDATES = 1_000
+MAX_PROCESSES = int(os.environ.get('SIMILARITY_PROCESSES', min(4, os.cpu_count() or 1)))
+
+_counter = None
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the parent has DB connections and worker threads
+            _pool = ProcessPoolExecutor(max_workers=MAX_PROCESSES, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+def _get_counter():
+    # Stateless char n-gram counter: every process produces identical columns, so chunks
+    # counted in parallel can be stacked and IDF-weighted together. Built on first use so
+    # importing this module doesn't pull in sklearn.
+    global _counter
+    if _counter is None:
+        from sklearn.feature_extraction.text import HashingVectorizer
+        _counter = HashingVectorizer(
+            analyzer='char', ngram_range=(NGRAM, NGRAM), lowercase=True,
+            preprocessor=lambda text: re.sub(r'\s+', '', (text or '').lower()),
+            alternate_sign=False, norm=None, n_features=N_FEATURES,
+        )
+    return _counter
+
+def count_ngrams(texts):
+    """Sparse (len(texts), N_FEATURES) matrix of character n-gram counts."""
+    return _get_counter().transform(texts)
+
+def _count_candidates(texts, processes):
+    import scipy.sparse as sp
+    if processes > 1 and len(texts) >= PARALLEL_MIN_CANDIDATES:
+        chunk_size = -(-len(texts) // processes)  # one chunk per process
+        chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+        return sp.vstack(list(_get_pool().map(count_ngrams, chunks)), format='csr')
+    return count_ngrams(texts)
+
+def similarity_scores(query_text, candidate_texts, processes=MAX_PROCESSES):
+    """
+    Cosine similarity of TF-IDF char n-gram vectors between one query and every candidate,
+    computed as one sparse matrix-vector product. IDF is fitted on query + candidates.
+    """
+    import scipy.sparse as sp
+    from sklearn.feature_extraction.text import TfidfTransformer
+
+    if not candidate_texts:
+        return np.zeros(0)
+    counts = sp.vstack([count_ngrams([query_text]), _count_candidates(list(candidate_texts), processes)], format='csr')
+    weighted = TfidfTransformer(norm='l2', smooth_idf=True, sublinear_tf=True).fit_transform(counts)
+    return np.asarray((weighted[1:] @ weighted[0].T).todense()).ravel()
+
+def top_groups(query_text, candidate_texts, candidate_groups, top_k=3, threshold=0.0, processes=MAX_PROCESSES):
+    """
+    Scores the query against all candidates at once and returns up to `top_k`
+    [(group_id, score)] where a group's score is the mean similarity of its candidates.
+    """
+    scores = similarity_scores(query_text, candidate_texts, processes=processes)
+    if scores.size == 0:
+        return []
+    group_ids, codes = np.unique(np.asarray(candidate_groups, dtype=object), return_inverse=True)
+    means = np.bincount(codes, weights=scores) / np.bincount(codes)
+    order = np.argsort(-means, kind='stable')[:top_k]
+    return [(group_ids[i], float(means[i])) for i in order if means[i] >= threshold]
+
+# --- Microbenchmark ---
+def run_benchmark(texts, query_texts, processes=MAX_PROCESSES):
+    """Median ms per query: pairwise Python Jaccard loop vs. batched TF-IDF (serial / process pool)."""
+    from app.services.suggestion_service import jaccard, shingles
+
+    def pairwise(query):
+        query_grams = shingles(query)
+        return [jaccard(query_grams, shingles(text)) for text in texts]
+
+    results = {}
+    for label, fn in (
+        ("pairwise_loop_ms", pairwise),
+        ("tfidf_serial_ms", lambda query: similarity_scores(query, texts, processes=1)),
+        ("tfidf_pool_ms", lambda query: similarity_scores(query, texts, processes=processes)),
+    ):
+        timings = []
+        for query in query_texts:
+            started = time.perf_counter()
+            fn(query)
+            timings.append((time.perf_counter() - started) * 1000)
+        results[label] = round(statistics.median(timings), 3)
+    return results
@@ -0,0 +1,74 @@
+# app/services/stats_service.py
+
+import time
+
+# --- Rollup counters: one row per (day, case_type, status) ---
+# case_type/status are stored as '' when NULL so they can be part of the primary key.
+SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS case_daily_stats (
+        day DATE NOT NULL,
+        case_type TEXT NOT NULL DEFAULT '',
+        status TEXT NOT NULL DEFAULT '',
+        case_count BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, case_type, status)
+    )
+"""
+
+def _key(day, case_type, status):
+    if hasattr(day, 'date'):
+        day = day.date()
+    return day, case_type or '', status or ''
+
+def apply_delta(cursor, day, case_type, status, delta):
+    """
+    Adds `delta` to the counter for (day, case_type, status).
+    Runs on the caller's cursor so it commits or rolls back with the write it describes.
+    """
+    if not delta:
+        return
+    cursor.execute("""
+        INSERT INTO case_daily_stats (day, case_type, status, case_count)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (day, case_type, status)
+        DO UPDATE SET case_count = case_daily_stats.case_count + EXCLUDED.case_count
+    """, (*_key(day, case_type, status), delta))
+
+def record_case_added(cursor, day, case_type, status):
+    apply_delta(cursor, day, case_type, status, 1)
+
+def record_case_removed(cursor, day, case_type, status):
+    apply_delta(cursor, day, case_type, status, -1)
+
+def record_case_changed(cursor, old, new):
+    """`old` and `new` are (day, case_type, status) tuples; no-op when the bucket is unchanged."""
+    if _key(*old) == _key(*new):
+        return
+    record_case_removed(cursor, *old)
+    record_case_added(cursor, *new)
+
+def rebuild_stats(conn):
+    """
+    Recomputes every counter from `cases` in one transaction.
+    Writers are blocked (SHARE lock) for the duration so the result is exact.
+    Returns the number of rollup rows and the elapsed seconds.
+    """
+    started = time.monotonic()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(SCHEMA_SQL)
+        cursor.execute("LOCK TABLE cases IN SHARE MODE")
+        cursor.execute("DELETE FROM case_daily_stats")
+        cursor.execute("""
+            INSERT INTO case_daily_stats (day, case_type, status, case_count)
+            SELECT timestamp::date, COALESCE(case_type, ''), COALESCE(status, ''), COUNT(id)
+            FROM cases
+            GROUP BY 1, 2, 3
+        """)
+        row_count = cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return row_count, time.monotonic() - started
@@ -0,0 +1,251 @@
+# app/services/suggestion_service.py
+
+from psycopg2.extras import RealDictCursor, execute_values
+import hashlib
+import random
+import re
+import statistics
+import time
+import uuid
+import zlib
+import numpy as np
+from app.database import get_db_conn
+from app.services import similarity_service
+
+# --- MinHash-LSH parameters ---
+NGRAM = 3
+NUM_PERM = 64
+BANDS = 16                        # 16 bands x 4 rows: candidates start around Jaccard 0.5
+ROWS = NUM_PERM // BANDS
+MAX_CANDIDATES = 2000             # strongest bucket overlaps kept per query
+# Minimum group score to suggest, on TF-IDF cosine (rank_groups), not on Jaccard. For two
+# equal-size n-gram sets cosine = 2J / (1 + J), so the old Jaccard cutoff of 0.5 is about
+# 0.67; IDF down-weights shared boilerplate n-grams ("โอนเงิน", "facebook"), hence 0.6.
+SUGGESTION_COSINE_THRESHOLD = 0.6
+TOP_K = 3                         # suggestions written per case
+
+# Multiply-shift hash family: h(x) = (a*x + b) mod 2^64 >> 32, a odd
+_rng = np.random.default_rng(20240601)
+_A = (_rng.integers(1, 2**63, NUM_PERM, dtype=np.uint64) | np.uint64(1))[:, None]
+_B = _rng.integers(0, 2**63, NUM_PERM, dtype=np.uint64)[:, None]
+
+# Persistent LSH index: one bucket key per (case, band). Lookups probe (band, bucket).
+SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS case_lsh_buckets (
+        case_id TEXT NOT NULL,
+        band SMALLINT NOT NULL,
+        bucket BIGINT NOT NULL,
+        PRIMARY KEY (case_id, band)
+    );
+    CREATE INDEX IF NOT EXISTS idx_case_lsh_buckets_lookup ON case_lsh_buckets (band, bucket);
+"""
+
+# --- Signatures ---
+def case_text(case_name, description):
+    return f"{case_name or ''} {description or ''}"
+
+def shingles(text):
+    """Character n-grams of the lowercased text with whitespace removed (works for Thai too)."""
+    text = re.sub(r'\s+', '', (text or '').lower())
+    if len(text) < NGRAM:
+        return {text} if text else set()
+    return {text[i:i + NGRAM] for i in range(len(text) - NGRAM + 1)}
+
+def minhash_signature(grams):
+    """(NUM_PERM,) uint64 MinHash signature, or None for empty input."""
+    if not grams:
+        return None
+    hashed = np.fromiter((zlib.crc32(g.encode('utf-8')) for g in grams), dtype=np.uint64, count=len(grams))
+    with np.errstate(over='ignore'):
+        return ((_A * hashed[None, :] + _B) >> np.uint64(32)).min(axis=1)
+
+def band_keys(signature):
+    """One signed 64-bit bucket key per band."""
+    keys = []
+    for band in range(BANDS):
+        digest = hashlib.blake2b(signature[band * ROWS:(band + 1) * ROWS].tobytes(), digest_size=8).digest()
+        keys.append(int.from_bytes(digest, 'big', signed=True))
+    return keys
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+# --- Scoring ---
+def rank_groups(query_text, candidates, top_k=TOP_K, threshold=SUGGESTION_COSINE_THRESHOLD):
+    """
+    Exact scoring of the narrowed candidate set in one batch (TF-IDF char n-grams, sparse
+    dot product; see similarity_service). `candidates` are dicts with group_id, case_name
+    and description. Returns [(group_id, score)] best first.
+    """
+    if not candidates:
+        return []
+    return similarity_service.top_groups(
+        query_text,
+        [case_text(c['case_name'], c['description']) for c in candidates],
+        [c['group_id'] for c in candidates],
+        top_k=top_k, threshold=threshold,
+    )
+
+# --- Persistent index ---
+def index_case(cursor, case_id, keys):
+    execute_values(cursor, """
+        INSERT INTO case_lsh_buckets (case_id, band, bucket) VALUES %s
+        ON CONFLICT (case_id, band) DO UPDATE SET bucket = EXCLUDED.bucket
+    """, [(case_id, band, key) for band, key in enumerate(keys)])
+
+def find_candidates(cursor, case_id, keys, exclude_group_id=None, limit=MAX_CANDIDATES):
+    """Grouped cases sharing at least one LSH bucket with the case, most shared bands first."""
+    cursor.execute("""
+        SELECT c.id, c.group_id, c.case_name, c.description
+        FROM UNNEST(%s::smallint[], %s::bigint[]) AS k (band, bucket)
+        JOIN case_lsh_buckets b ON b.band = k.band AND b.bucket = k.bucket
+        JOIN cases c ON c.id = b.case_id
+        WHERE b.case_id <> %s AND c.group_id IS NOT NULL AND c.group_id IS DISTINCT FROM %s
+        GROUP BY c.id, c.group_id, c.case_name, c.description
+        ORDER BY COUNT(*) DESC
+        LIMIT %s
+    """, (list(range(len(keys))), keys, case_id, exclude_group_id, limit))
+    return cursor.fetchall()
+
+def write_suggestions(cursor, case_id, ranked):
+    """Replaces the case's pending suggestions with the ranked list."""
+    cursor.execute("DELETE FROM case_group_suggestions WHERE case_id = %s AND status = 'pending'", (case_id,))
+    if ranked:
+        execute_values(cursor, """
+            INSERT INTO case_group_suggestions (id, case_id, suggested_group_id, ml_score, status) VALUES %s
+        """, [(str(uuid.uuid4()), case_id, group_id, float(score), 'pending') for group_id, score in ranked])
+
+def suggest_groups_for_case(case_id: str):
+    """
+    Indexes the case (incremental LSH update) and writes its ranked group suggestions.
+    Runs as a SUGGEST_GROUPS job; errors are re-raised so the worker can retry.
+    """
+    with get_db_conn() as conn:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        try:
+            cursor.execute("SELECT id, group_id, case_name, description FROM cases WHERE id = %s", (case_id,))
+            case = cursor.fetchone()
+            if not case:
+                return
+            text = case_text(case['case_name'], case['description'])
+            signature = minhash_signature(shingles(text))
+            if signature is None:
+                return
+            keys = band_keys(signature)
+            index_case(cursor, case_id, keys)
+
+            candidates = find_candidates(cursor, case_id, keys, exclude_group_id=case['group_id'])
+            write_suggestions(cursor, case_id, rank_groups(text, candidates))
+            conn.commit()
+        except Exception as e:
+            print(f"Error suggesting groups for case {case_id}: {e}")
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+def rebuild_index(conn, batch_size=5000):
+    """(Re)computes LSH buckets for every case, streaming in batches. Returns cases indexed."""
+    read = conn.cursor(name='lsh_rebuild')
+    read.itersize = batch_size
+    write = conn.cursor()
+    indexed = 0
+    try:
+        read.execute("SELECT id, case_name, description FROM cases")
+        rows = []
+        for case_id, case_name, description in read:
+            signature = minhash_signature(shingles(case_text(case_name, description)))
+            if signature is None:
+                continue
+            rows.extend((case_id, band, key) for band, key in enumerate(band_keys(signature)))
+            indexed += 1
+            if len(rows) >= batch_size * BANDS:
+                _write_buckets(write, rows)
+                rows = []
+        _write_buckets(write, rows)
+        read.close()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        write.close()
+    return indexed
+
+def _write_buckets(cursor, rows):
+    if rows:
+        execute_values(cursor, """
+            INSERT INTO case_lsh_buckets (case_id, band, bucket) VALUES %s
+            ON CONFLICT (case_id, band) DO UPDATE SET bucket = EXCLUDED.bucket
+        """, rows, page_size=5000)
+
+# --- Benchmark (in memory, no database) ---
+BENCH_WORDS = ['หลอกลงทุน', 'แฮกบัญชี', 'ฟิชชิ่ง', 'ขายของออนไลน์', 'แชร์ลูกโซ่', 'Romance Scam',
+               'โอนเงิน', 'ธนาคาร', 'เพจปลอม', 'คริปโต', 'แอปกู้เงิน', 'SMS', 'บัญชีม้า', 'LINE']
+
+class MemoryLSHIndex:
+    """Same banding as the database index, held in dicts; used by the benchmark."""
+
+    def __init__(self):
+        self.buckets = [dict() for _ in range(BANDS)]
+
+    def add(self, item_id, keys):
+        for band, key in enumerate(keys):
+            self.buckets[band].setdefault(key, []).append(item_id)
+
+    def query(self, keys, limit=MAX_CANDIDATES):
+        hits = {}
+        for band, key in enumerate(keys):
+            for item_id in self.buckets[band].get(key, ()):
+                hits[item_id] = hits.get(item_id, 0) + 1
+        return sorted(hits, key=hits.get, reverse=True)[:limit]
+
+def _bench_case(rng, i):
+    words = rng.sample(BENCH_WORDS, 3)
+    return {
+        'id': i,
+        'group_id': f"G{i % 5000}",
+        'case_name': f"{words[0]} {words[1]} {rng.randint(1, 500)}",
+        'description': f"{words[2]} ผู้เสียหาย {rng.randint(1, 99)} ราย ติดต่อผ่าน {rng.choice(BENCH_WORDS)}",
+    }
+
+def run_benchmark(n_cases=100_000, queries=20, seed=7):
+    """
+    Builds an LSH index over `n_cases` synthetic cases, then compares per-query latency of
+    LSH candidates + exact scoring against exact scoring of every case.
+    """
+    rng = random.Random(seed)
+    cases = [_bench_case(rng, i) for i in range(n_cases)]
+
+    started = time.perf_counter()
+    index = MemoryLSHIndex()
+    for case in cases:
+        index.add(case['id'], band_keys(minhash_signature(shingles(case_text(case['case_name'], case['description'])))))
+    build_seconds = time.perf_counter() - started
+
+    probes = [_bench_case(rng, n_cases + i) for i in range(queries)]
+    lsh_ms, brute_ms, candidate_counts, agree = [], [], [], 0
+    for probe in probes:
+        query_text = case_text(probe['case_name'], probe['description'])
+
+        started = time.perf_counter()
+        candidate_ids = index.query(band_keys(minhash_signature(shingles(query_text))))
+        lsh_result = rank_groups(query_text, [cases[i] for i in candidate_ids])
+        lsh_ms.append((time.perf_counter() - started) * 1000)
+        candidate_counts.append(len(candidate_ids))
+
+        started = time.perf_counter()
+        brute_result = rank_groups(query_text, cases)
+        brute_ms.append((time.perf_counter() - started) * 1000)
+        agree += bool(lsh_result) == bool(brute_result) and (not lsh_result or lsh_result[0][0] == brute_result[0][0])
+
+    return {
+        "cases": n_cases,
+        "index_build_s": round(build_seconds, 2),
+        "lsh_query_ms": round(statistics.median(lsh_ms), 3),
+        "brute_force_ms": round(statistics.median(brute_ms), 3),
+        "median_candidates": statistics.median(candidate_counts),
+        "top1_agreement": round(agree / queries, 3),
+    }
@@ -0,0 +1,197 @@
+# app/services/training_service.py
+#
+# Offline training: features are extracted from PostgreSQL in chunks into a columnar
+# snapshot (one .npy file per column per chunk), and the model is fitted from that snapshot
+# in a separate Python process and published to the model registry as a new version.
+# Nothing here runs inside a Flask request.
+#
+#     python -m app.services.training_service <snapshot_dir> <registry_dir>
+#
+# trains from an existing snapshot and prints the stage report as JSON.
+
+import datetime
+import json
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+from app.database import get_db_conn
+
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+TRAIN_TIMEOUT = 3600  # seconds
+
+def _column_dtypes():
+    from app.services import ml_service
+    dtypes = {}
+    for column in ml_service.CATEGORICAL_FEATURES + ml_service.ORDINAL_FEATURES:
+        dtypes[column] = str
+    for column in ml_service.NUMERICAL_FEATURES + [ml_service.TARGET_COLUMN]:
+        dtypes[column] = np.float64
+    for column in ml_service.BINARY_FEATURES:
+        dtypes[column] = np.bool_
+    return dtypes
+
+def _to_array(values, dtype):
+    if dtype is str:
+        return np.array(['None' if v is None else str(v) for v in values], dtype=str)
+    if dtype is np.bool_:
+        return np.array([bool(v) for v in values], dtype=np.bool_)
+    return np.array([np.nan if v is None else float(v) for v in values], dtype=np.float64)
+
+# --- Stage 1: extraction ---
+def extract_snapshot(conn, snapshot_dir, chunk_size=50_000):
+    """
+    Streams ml_service.TRAINING_QUERY through a server-side cursor and writes each chunk as
+    part-NNNNN/<column>.npy. Returns the manifest (also saved as manifest.json).
+    """
+    from app.services import ml_service
+
+    started = time.perf_counter()
+    dtypes = _column_dtypes()
+    os.makedirs(snapshot_dir, exist_ok=True)
+    cursor = conn.cursor(name='training_snapshot')
+    cursor.itersize = chunk_size
+    rows, parts = 0, 0
+    try:
+        cursor.execute(ml_service.TRAINING_QUERY)
+        columns = None
+        while True:
+            chunk = cursor.fetchmany(chunk_size)
+            if columns is None:
+                columns = [d[0] for d in cursor.description]
+            if not chunk:
+                break
+            part_dir = os.path.join(snapshot_dir, f"part-{parts:05d}")
+            os.makedirs(part_dir, exist_ok=True)
+            for i, column in enumerate(columns):
+                np.save(os.path.join(part_dir, f"{column}.npy"),
+                        _to_array([row[i] for row in chunk], dtypes.get(column, np.float64)),
+                        allow_pickle=False)
+            rows += len(chunk)
+            parts += 1
+    finally:
+        cursor.close()
+        conn.rollback()
+
+    manifest = {
+        "columns": columns,
+        "rows": rows,
+        "parts": parts,
+        "created_at": datetime.datetime.now().isoformat(),
+        "extract_s": round(time.perf_counter() - started, 3),
+    }
+    with open(os.path.join(snapshot_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+def load_snapshot(snapshot_dir):
+    """Reads a snapshot back into a DataFrame (memory-mapped column files, concatenated)."""
+    import pandas as pd
+
+    with open(os.path.join(snapshot_dir, 'manifest.json')) as f:
+        manifest = json.load(f)
+    data = {}
+    for column in manifest['columns']:
+        pieces = [
+            np.load(os.path.join(snapshot_dir, f"part-{part:05d}", f"{column}.npy"), mmap_mode='r', allow_pickle=False)
+            for part in range(manifest['parts'])
+        ]
+        data[column] = np.concatenate(pieces) if pieces else np.array([])
+    return pd.DataFrame(data, columns=manifest['columns'])
+
+# --- Stage 2: fitting (runs in the child process) ---
+def train_from_snapshot(snapshot_dir, registry_dir, holdout=0.2, seed=42, activate=True):
+    """
+    Fits a pipeline on the snapshot, measures holdout error, then refits on all rows and
+    publishes it to the registry (activated unless told otherwise). Returns the stage report.
+    """
+    from app.services import ml_service, model_registry
+
+    report = {"snapshot": snapshot_dir, "registry": registry_dir}
+    started = time.perf_counter()
+    df = load_snapshot(snapshot_dir)
+    report["load_s"] = round(time.perf_counter() - started, 3)
+    report["rows"] = len(df)
+    if len(df) < ml_service.MINIMUM_RECORDS_FOR_TRAINING:
+        report["status"] = "skipped"
+        report["reason"] = f"Not enough verified data ({len(df)} records)."
+        return report
+
+    started = time.perf_counter()
+    df = ml_service.prepare_training_frame(df)
+    report["prepare_s"] = round(time.perf_counter() - started, 3)
+
+    if len(df) >= 50:
+        started = time.perf_counter()
+        shuffled = df.sample(frac=1.0, random_state=seed)
+        cut = int(len(shuffled) * (1 - holdout))
+        train, test = shuffled.iloc[:cut], shuffled.iloc[cut:]
+        probe = ml_service.build_pipeline().fit(train[ml_service.ALL_FEATURES], train[ml_service.TARGET_COLUMN])
+        errors = probe.predict(test[ml_service.ALL_FEATURES]) - test[ml_service.TARGET_COLUMN].to_numpy()
+        variance = float(np.var(test[ml_service.TARGET_COLUMN].to_numpy()))
+        report["metrics"] = {
+            "holdout_rows": len(test),
+            "mae": round(float(np.mean(np.abs(errors))), 4),
+            "r2": round(1 - float(np.mean(errors ** 2)) / variance, 4) if variance > 0 else None,
+        }
+        report["evaluate_s"] = round(time.perf_counter() - started, 3)
+
+    started = time.perf_counter()
+    pipeline = ml_service.build_pipeline()
+    pipeline.fit(df[ml_service.ALL_FEATURES], df[ml_service.TARGET_COLUMN])
+    report["fit_s"] = round(time.perf_counter() - started, 3)
+
+    started = time.perf_counter()
+    registry = model_registry.ModelRegistry(registry_dir)
+    report["version"] = registry.publish(pipeline, {
+        "source": "training",
+        "training_rows": len(df),
+        "metrics": report.get("metrics"),
+        "snapshot": snapshot_dir,
+        "fit_s": report["fit_s"],
+    }, activate=activate)
+    report["save_s"] = round(time.perf_counter() - started, 3)
+    report["status"] = "trained"
+    return report
+
+# --- Orchestration ---
+def snapshot_dir_for(registry_dir):
+    stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+    return os.path.join(os.path.abspath(registry_dir), 'training_snapshots', stamp)
+
+def run_training(registry_dir, snapshot_dir=None, chunk_size=50_000):
+    """
+    Extracts a fresh snapshot (unless one is given), then trains in a child process.
+    Returns the combined stage report; it is also written to <snapshot>/training_report.json.
+    """
+    started = time.perf_counter()
+    report = {}
+    if snapshot_dir is None:
+        snapshot_dir = snapshot_dir_for(registry_dir)
+        with get_db_conn() as conn:
+            manifest = extract_snapshot(conn, snapshot_dir, chunk_size=chunk_size)
+        report["extract_s"] = manifest["extract_s"]
+
+    result = subprocess.run(
+        [sys.executable, '-m', 'app.services.training_service', snapshot_dir, os.path.abspath(registry_dir)],
+        cwd=APP_ROOT, capture_output=True, text=True, timeout=TRAIN_TIMEOUT,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Training process failed: {result.stderr.strip()[-2000:]}")
+    report.update(json.loads(result.stdout.strip().splitlines()[-1]))
+    report["total_s"] = round(time.perf_counter() - started, 3)
+
+    with open(os.path.join(snapshot_dir, 'training_report.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Training finished: {json.dumps(report)}")
+    return report
+
+def run_training_job(registry_dir: str):
+    """TRAIN_MODEL job handler (job key is the model registry directory)."""
+    run_training(registry_dir)
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit("usage: python -m app.services.training_service <snapshot_dir> <registry_dir>")
+    print(json.dumps(train_from_snapshot(sys.argv[1], sys.argv[2])))
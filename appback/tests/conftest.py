@@ -0,0 +1,21 @@
+# tests/conftest.py
+import os
+import sys
+
+# Make `app` importable when pytest is run from appback/ or from the repository root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+
+@pytest.fixture(scope='session')
+def db_pool():
+    """
+    The app's connection pool on DATABASE_URL (a scratch database with `flask init-schema`
+    applied). Tests that need PostgreSQL are skipped when it isn't set.
+    """
+    if not os.environ.get('DATABASE_URL'):
+        pytest.skip("DATABASE_URL is not set")
+    pytest.importorskip('psycopg2')
+    from app.database import init_pool
+    return init_pool(os.environ['DATABASE_URL'], min_size=1, max_size=20)
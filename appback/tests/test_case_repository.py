@@ -0,0 +1,87 @@
+# tests/test_case_repository.py
+#
+# Query-count regression tests: the case list and detail paths must not go back to one
+# query per row (N+1). Run from appback/: python -m pytest -q
+
+import importlib.util
+import os
+import pytest
+
+# case_repository only needs the standard library; load it directly so the test doesn't
+# pull in the Flask app and database pool through app/__init__.py.
+_PATH = os.path.join(os.path.dirname(__file__), '..', 'app', 'services', 'case_repository.py')
+_spec = importlib.util.spec_from_file_location('case_repository', _PATH)
+case_repository = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(case_repository)
+
+
+class CountingCursor:
+    """Stands in for a RealDictCursor: counts execute() calls and replays canned results."""
+
+    def __init__(self, results):
+        self._results = list(results)
+        self._current = None
+        self.queries = 0
+
+    def execute(self, sql, params=None):
+        self.queries += 1
+        self._current = self._results.pop(0) if self._results else []
+
+    def fetchall(self):
+        return self._current
+
+    def fetchone(self):
+        return self._current[0] if self._current else None
+
+
+def _officers(case_ids, per_case=2):
+    return [
+        {'_case_id': case_id, 'id': f"{case_id}-o{i}", 'first_name': f"Officer{i}", 'last_name': case_id}
+        for case_id in case_ids for i in range(per_case)
+    ]
+
+
+@pytest.mark.parametrize('row_count', [1, 25, 500])
+def test_attach_officer_names_issues_one_query(row_count):
+    rows = [{'id': f"case-{i}"} for i in range(row_count)]
+    cursor = CountingCursor([_officers([row['id'] for row in rows])])
+
+    result = case_repository.attach_officer_names(cursor, rows)
+
+    assert cursor.queries == 1
+    assert len(result) == row_count
+    assert result[0]['officer_names'] == "Officer0 case-0, Officer1 case-0"
+
+
+def test_attach_officer_names_empty_page_issues_no_query():
+    cursor = CountingCursor([])
+    assert case_repository.attach_officer_names(cursor, []) == []
+    assert cursor.queries == 0
+
+
+@pytest.mark.parametrize('officer_count', [0, 1, 40])
+def test_get_case_detail_issues_two_queries(officer_count):
+    case_row = {'id': 'case-1', 'case_number': 'CC-001', '_complainant': {'id': 'comp-1'}}
+    cursor = CountingCursor([[case_row], _officers(['case-1'], per_case=officer_count)])
+
+    detail = case_repository.get_case_detail(cursor, 'CC-001')
+
+    assert cursor.queries == 2
+    assert detail['complainant'] == {'id': 'comp-1'}
+    assert len(detail['officers']) == officer_count
+
+
+def test_get_case_detail_missing_case_stops_after_one_query():
+    cursor = CountingCursor([[]])
+    assert case_repository.get_case_detail(cursor, 'missing') is None
+    assert cursor.queries == 1
+
+
+def test_internal_columns_are_not_returned():
+    rows = [{'id': 'case-1', 'case_number': 'CC-001', 'case_number_norm': 'CC001'}]
+    listed = case_repository.attach_officer_names(CountingCursor([[]]), rows)
+    assert 'case_number_norm' not in listed[0]
+
+    case_row = {'id': 'case-1', 'case_number': 'CC-001', 'case_number_norm': 'CC001', '_complainant': None}
+    detail = case_repository.get_case_detail(CountingCursor([[case_row], []]), 'CC-001')
+    assert 'case_number_norm' not in detail
@@ -0,0 +1,22 @@
+# tests/test_group_numbers.py
+#
+# Concurrent group number allocation must never hand out the same number twice.
+
+import pytest
+
+pytest.importorskip('flask')
+pytest.importorskip('psycopg2')
+
+from app.services import grouping_service
+
+
+def test_concurrent_reservations_issue_unique_numbers(db_pool):
+    issued, duplicates, _ = grouping_service.run_allocation_stress(threads=8, reservations=50, batch_size=1)
+    assert issued == 8 * 50
+    assert duplicates == 0
+
+
+def test_concurrent_batch_reservations_issue_unique_numbers(db_pool):
+    issued, duplicates, _ = grouping_service.run_allocation_stress(threads=4, reservations=20, batch_size=25)
+    assert issued == 4 * 20 * 25
+    assert duplicates == 0
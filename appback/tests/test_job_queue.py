@@ -0,0 +1,142 @@
+# tests/test_job_queue.py
+#
+# Claim / retry / backoff / stale-requeue behaviour of the Postgres job queue. Jobs use
+# 'test_*' job types and are deleted afterwards; run against a scratch database.
+
+import pytest
+
+pytest.importorskip('flask')
+pytest.importorskip('psycopg2')
+
+from psycopg2.extras import RealDictCursor
+from app.services import job_queue
+
+
+@pytest.fixture
+def queue(db_pool):
+    def cleanup():
+        with db_pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM background_jobs WHERE job_type LIKE 'test\\_%'")
+            conn.commit()
+            cursor.close()
+
+    cleanup()
+    yield db_pool
+    cleanup()
+
+
+def _enqueue(pool, job_type, keys, max_attempts=job_queue.DEFAULT_MAX_ATTEMPTS):
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        job_queue.enqueue_many(cursor, job_type, keys, max_attempts=max_attempts)
+        conn.commit()
+        cursor.close()
+
+
+def _job(pool, job_type, key):
+    with pool.connection() as conn:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute("""
+            SELECT *, EXTRACT(EPOCH FROM run_after - NOW()) AS delay_seconds
+            FROM background_jobs WHERE job_type = %s AND job_key = %s
+            ORDER BY id DESC LIMIT 1
+        """, (job_type, key))
+        row = cursor.fetchone()
+        conn.commit()
+        cursor.close()
+    return row
+
+
+def _claim(pool, job_type, limit=10):
+    with pool.connection() as conn:
+        return [job for job in job_queue.claim_jobs(conn, limit=limit) if job['job_type'] == job_type]
+
+
+def test_enqueue_collapses_duplicate_queued_jobs(queue):
+    _enqueue(queue, 'test_dedupe', ['a', 'a', 'b'])
+    _enqueue(queue, 'test_dedupe', ['a'])
+    assert sorted(job['job_key'] for job in _claim(queue, 'test_dedupe')) == ['a', 'b']
+
+
+def test_claim_skips_rows_locked_by_another_worker(queue):
+    _enqueue(queue, 'test_claim', ['locked', 'free'])
+    with queue.connection() as holder:
+        cursor = holder.cursor()
+        cursor.execute(
+            "SELECT id FROM background_jobs WHERE job_type = 'test_claim' AND job_key = 'locked' FOR UPDATE"
+        )
+        claimed = _claim(queue, 'test_claim')
+        assert [job['job_key'] for job in claimed] == ['free']
+        holder.rollback()
+        cursor.close()
+
+    assert [job['job_key'] for job in _claim(queue, 'test_claim')] == ['locked']
+    assert _claim(queue, 'test_claim') == []
+
+
+def test_failed_job_is_retried_with_exponential_backoff(queue):
+    _enqueue(queue, 'test_backoff', ['k'])
+    job = _claim(queue, 'test_backoff')[0]
+    assert job['attempts'] == 1
+    with queue.connection() as conn:
+        job_queue._finish(conn, job, error='boom')
+
+    row = _job(queue, 'test_backoff', 'k')
+    assert row['status'] == 'queued' and row['last_error'] == 'boom'
+    assert 1 < float(row['delay_seconds']) <= 2 ** job['attempts']
+    assert _claim(queue, 'test_backoff') == []  # not ready until the backoff has passed
+
+
+def test_job_fails_permanently_after_max_attempts(queue):
+    _enqueue(queue, 'test_exhausted', ['k'], max_attempts=1)
+    job = _claim(queue, 'test_exhausted')[0]
+    with queue.connection() as conn:
+        job_queue._finish(conn, job, error='boom')
+    assert _job(queue, 'test_exhausted', 'k')['status'] == 'failed'
+
+
+def test_retry_is_superseded_by_a_newer_queued_job(queue):
+    _enqueue(queue, 'test_superseded', ['k'])
+    job = _claim(queue, 'test_superseded')[0]
+    _enqueue(queue, 'test_superseded', ['k'])  # queued again while running
+    with queue.connection() as conn:
+        job_queue._finish(conn, job, error='boom')
+        cursor = conn.cursor()
+        cursor.execute("SELECT status FROM background_jobs WHERE id = %s", (job['id'],))
+        assert cursor.fetchone()[0] == 'superseded'
+        conn.commit()
+        cursor.close()
+
+
+def test_requeue_stale_jobs_only_reaps_jobs_without_a_heartbeat(queue):
+    _enqueue(queue, 'test_stale', ['dead', 'alive'])
+    claimed = {job['job_key']: job for job in _claim(queue, 'test_stale')}
+    with queue.connection() as conn:
+        cursor = conn.cursor()
+        # both started long ago; only 'alive' is still heartbeating
+        cursor.execute("""
+            UPDATE background_jobs SET started_at = NOW() - INTERVAL '2 hours',
+                heartbeat_at = CASE WHEN job_key = 'dead' THEN NOW() - INTERVAL '10 minutes' ELSE NOW() END
+            WHERE job_type = 'test_stale'
+        """)
+        conn.commit()
+        cursor.close()
+        job_queue.requeue_stale_jobs(conn, timeout=300)
+
+    assert _job(queue, 'test_stale', 'dead')['status'] == 'queued'
+    assert _job(queue, 'test_stale', 'alive')['status'] == 'running'
+    assert claimed['dead']['id'] == _job(queue, 'test_stale', 'dead')['id']
+
+
+def test_queue_lag_ignores_backed_off_jobs(queue):
+    _enqueue(queue, 'test_lag', ['k'])
+    with queue.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            UPDATE background_jobs SET created_at = NOW() - INTERVAL '1 hour', run_after = NOW() + INTERVAL '1 hour'
+            WHERE job_type = 'test_lag'
+        """)
+        conn.commit()
+        cursor.close()
+        assert job_queue.queue_stats(conn)['lag_seconds'] < 3600
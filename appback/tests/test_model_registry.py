@@ -0,0 +1,43 @@
+# tests/test_model_registry.py
+#
+# Activation history of the versioned model registry. Artifacts are plain picklable
+# objects (no training); the flat forest build is switched off.
+
+import pytest
+
+pytest.importorskip('numpy')
+pytest.importorskip('joblib')
+
+from app.services import model_registry
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    monkeypatch.setattr(model_registry.forest_engine, 'build_forest', lambda pipeline, frame: None)
+    monkeypatch.setattr(model_registry.ml_service, 'build_feature_frame', lambda cases: None)
+    return model_registry.ModelRegistry(str(tmp_path / 'registry'))
+
+
+def test_repeated_rollbacks_walk_back_through_history(registry):
+    v1 = registry.publish({'model': 1})
+    v2 = registry.publish({'model': 2})
+    v3 = registry.publish({'model': 3})
+    assert registry.active_version() == v3
+
+    assert registry.rollback() == v2
+    assert registry.active_version() == v2
+    assert registry.rollback() == v1
+    assert registry.active_version() == v1
+
+    with pytest.raises(ValueError):
+        registry.rollback()
+    assert registry.active_version() == v1
+
+
+def test_rollback_after_reactivation_returns_to_the_version_before_it(registry):
+    v1 = registry.publish({'model': 1})
+    v2 = registry.publish({'model': 2})
+    registry.rollback()          # v2 -> v1
+    registry.activate(v2)        # v1 -> v2 again
+    assert registry.rollback() == v1
+    assert registry.load(v1, mmap_mode=None) == {'model': 1}
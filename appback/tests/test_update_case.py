@@ -0,0 +1,117 @@
+# tests/test_update_case.py
+#
+# PUT /cases/<case_number> against a recording fake connection: the case is rescored the
+# same way rank_case scores it, and the rollup, group summary and dashboard cache are kept
+# in step. Needs the app's dependencies (Flask, psycopg2, numpy), not a database.
+
+from contextlib import contextmanager
+import datetime
+from types import SimpleNamespace
+import pytest
+
+pytest.importorskip('flask')
+pytest.importorskip('flask_cors')
+pytest.importorskip('psycopg2')
+pytest.importorskip('numpy')
+
+from flask import Flask
+from app.routes import main as routes
+
+
+OLD_CASE = (datetime.datetime(2024, 1, 5), 'Online Fraud', 'รับเรื่อง', None, 'group-1', 3, 50000, 'case-1')
+
+
+class FakeCursor:
+    def __init__(self, log):
+        self.log = log
+        self._result = []
+
+    def execute(self, sql, params=None):
+        self.log.append((' '.join(sql.split()), params))
+        if 'FROM cases WHERE case_number' in sql:
+            self._result = [OLD_CASE]
+        elif 'FROM structured_evidence' in sql:
+            self._result = [('BANK_ACCOUNT',), ('URL',)]
+        else:
+            self._result = []
+
+    def fetchone(self):
+        return self._result[0] if self._result else None
+
+    def fetchall(self):
+        return self._result
+
+    def close(self):
+        pass
+
+
+class FakeConn:
+    def __init__(self):
+        self.log = []
+        self.committed = False
+
+    def cursor(self, *args, **kwargs):
+        return FakeCursor(self.log)
+
+    def commit(self):
+        self.committed = True
+
+
+@pytest.fixture
+def client(monkeypatch):
+    conn = FakeConn()
+    calls = {}
+
+    @contextmanager
+    def fake_get_db_conn():
+        yield conn
+
+    def fake_score_case(pipeline, features, encoder=None, forest=None):
+        calls['score_case'] = (pipeline, features, encoder, forest)
+        return 73.5
+
+    monkeypatch.setattr(routes, 'get_db_conn', fake_get_db_conn)
+    monkeypatch.setattr(routes.ml_service, 'score_case', fake_score_case)
+    monkeypatch.setattr(routes.stats_service, 'record_case_changed',
+                        lambda cursor, old, new: calls.setdefault('stats', (old, new)))
+    monkeypatch.setattr(routes.group_summary_service, 'record_case_changed',
+                        lambda cursor, group_id, old, new: calls.setdefault('group', (group_id, old, new)))
+    monkeypatch.setattr(routes.dashboard_service, 'invalidate_dashboard_cache',
+                        lambda: calls.setdefault('dashboard', True))
+
+    app = Flask(__name__)
+    app.register_blueprint(routes.main_bp)
+    model = SimpleNamespace(version='v1', pipeline='pipeline', encoder='encoder', forest=None)
+    app.extensions['ml_model'] = SimpleNamespace(current=model)
+    return app.test_client(), conn, calls
+
+
+def test_update_case_rescores_and_keeps_rollups_in_step(client):
+    http, conn, calls = client
+    response = http.put('/cases/CC-001', json={
+        "case_details": {"case_name": "แก้ไขแล้ว", "case_type": "Online Fraud", "status": "ปิดคดี"},
+        "officers": [{"id": "officer-1"}],
+    })
+
+    assert response.status_code == 200, response.get_json()
+    assert conn.committed
+
+    pipeline, features, encoder, forest = calls['score_case']
+    assert pipeline == 'pipeline' and encoder == 'encoder'  # pandas-free fast path
+    # Stored evidence is used when the request doesn't send any
+    assert features['evidence_count'] == 2 and features['has_actionable_evidence'] is True
+
+    update_sql, update_params = next(entry for entry in conn.log if entry[0].startswith('UPDATE cases SET'))
+    assert 'priority_score = %s' in update_sql and 73.5 in update_params
+    assert 'date_closed = %s' in update_sql
+
+    old, new = calls['stats']
+    assert old[2] == 'รับเรื่อง' and new[2] == 'ปิดคดี'
+    assert calls['group'][0] == 'group-1'
+    assert calls['dashboard'] is True
+
+
+def test_update_case_returns_503_without_a_model(client):
+    http, _, _ = client
+    http.application.extensions['ml_model'] = SimpleNamespace(current=None)
+    assert http.put('/cases/CC-001', json={"case_details": {}}).status_code == 503